@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare TeamsBot (Flask, a thread per request) with AsyncTeamsBot (ASGI,
+a coroutine per request) handling many concurrent webhooks whose command
+callback is slow, against a local fake Webex API.
+
+    python -m benchmarks.bench_async --requests 2000 --concurrency 500
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import threading
+import time
+
+from benchmarks.common import ASGIServer, WSGIServer, drive, summarize, \
+    webhook
+from tests.fake_webex import FakeWebex
+from webexteamsbot import TeamsBot
+from webexteamsbot.aio import AsyncTeamsBot
+
+
+def bot_args(fake):
+    return dict(
+        teams_bot_token="somefaketoken",
+        teams_api_url=fake.base_url,
+        teams_bot_email="bot@webex.bot",
+        teams_bot_url="http://127.0.0.1/unused",
+    )
+
+
+def run_flask(fake, args):
+    bot = TeamsBot("benchbot", http_pool_size=args.concurrency,
+                   delivery_workers=1, **bot_args(fake))
+
+    def slow(incoming_msg):
+        time.sleep(args.callback_delay)
+        return "done"
+
+    bot.add_command("/slow", "slow command", slow)
+    return WSGIServer(bot)
+
+
+def run_async(fake, args):
+    bot = AsyncTeamsBot("benchbot", http_pool_size=args.concurrency,
+                        **bot_args(fake))
+
+    async def slow(incoming_msg):
+        await asyncio.sleep(args.callback_delay)
+        return "done"
+
+    bot.add_command("/slow", "slow command", slow)
+    return ASGIServer(bot)
+
+
+def measure(name, server, args):
+    payloads = [
+        webhook("%s_%d" % (name, i), room_id="room_%d" % (i % args.rooms))
+        for i in range(args.requests)
+    ]
+    peak = [threading.active_count()]
+    done = threading.Event()
+
+    def watch():
+        while not done.wait(0.05):
+            peak[0] = max(peak[0], threading.active_count())
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    # The bots log every message to stderr
+    with server, contextlib.redirect_stderr(io.StringIO()):
+        latencies, elapsed, errors = drive(server.url, payloads,
+                                           args.concurrency)
+    done.set()
+    watcher.join()
+    result = summarize(latencies, elapsed, errors)
+    result["peak_threads"] = peak[0]
+    result["bot"] = name
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--callback-delay", type=float, default=0.5,
+                        help="Seconds each command callback takes")
+    parser.add_argument("--api-latency", type=float, default=0.02,
+                        help="Seconds added to every fake Webex response")
+    parser.add_argument("--rooms", type=int, default=50,
+                        help="Rooms the webhooks are spread over")
+    parser.add_argument("--json", action="store_true",
+                        help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with FakeWebex(latency=args.api_latency, message_text="/slow") as fake:
+        results.append(measure("flask", run_flask(fake, args), args))
+        results.append(measure("asyncio", run_async(fake, args), args))
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    cols = ("bot", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms",
+            "peak_threads")
+    print(" ".join("%12s" % c for c in cols))
+    for r in results:
+        print(" ".join("%12s" % r[c] for c in cols))
+
+
+if __name__ == "__main__":
+    main()
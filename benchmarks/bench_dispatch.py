@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput and latency of TeamsBot's webhook dispatch path against a local
+fake Webex API, through the Flask test client and a real WSGI server.
+
+Scenarios vary the number of registered commands, the reply size, the
+number of Responses returned per message and the size of the approved
+users list.  Results can be written as JSON and compared with an earlier
+run:
+
+    python -m benchmarks.bench_dispatch --output results.json
+    python -m benchmarks.bench_dispatch --compare results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks.common import WSGIServer, drive, summarize, webhook
+from tests.fake_webex import FakeWebex
+import webexteamsbot
+from webexteamsbot import TeamsBot
+from webexteamsbot.models import Response
+
+BASE = dict(commands=2, reply_size=50, responses=1, approved_users=0)
+
+# name: changes from BASE
+SCENARIOS = [
+    ("baseline", {}),
+    ("commands_100", dict(commands=100)),
+    ("commands_1000", dict(commands=1000)),
+    ("reply_4k", dict(reply_size=4096)),
+    ("responses_5", dict(responses=5)),
+    ("approved_1k", dict(approved_users=1000)),
+    ("approved_100k", dict(approved_users=100000)),
+]
+
+
+def make_bot(fake, scenario, pool_size):
+    approved = []
+    if scenario["approved_users"]:
+        approved = ["user%06d@example.com" % i
+                    for i in range(scenario["approved_users"] - 1)]
+        # The sender of every fake message
+        approved.append("matt@example.com")
+
+    bot = TeamsBot(
+        "benchbot",
+        teams_bot_token="somefaketoken",
+        teams_api_url=fake.base_url,
+        teams_bot_email="bot@webex.bot",
+        teams_bot_url="http://127.0.0.1/unused",
+        approved_users=approved,
+        http_pool_size=pool_size,
+    )
+    for i in range(scenario["commands"]):
+        bot.add_command("/command%04d" % i, "filler command", bot.send_echo)
+
+    text = "x" * scenario["reply_size"]
+    count = scenario["responses"]
+
+    def bench(incoming_msg):
+        if count == 1:
+            return text
+        responses = []
+        for i in range(count):
+            r = Response()
+            r.markdown = text
+            r.roomId = "reply_room_%d" % i
+            responses.append(r)
+        return responses
+
+    bot.add_command("/bench", "benchmark command", bench)
+    return bot
+
+
+def payloads(prefix, count, rooms):
+    return [webhook("%s_%d" % (prefix, i), room_id="room_%d" % (i % rooms))
+            for i in range(count)]
+
+
+def run_test_client(bot, args, prefix):
+    client = bot.test_client()
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for payload in payloads(prefix, args.requests, args.rooms):
+        body = json.dumps(payload)
+        t = time.perf_counter()
+        resp = client.post("/", data=body, content_type="application/json")
+        latencies.append(time.perf_counter() - t)
+        if resp.status_code != 200:
+            errors += 1
+    return latencies, time.perf_counter() - start, errors
+
+
+def run_wsgi(bot, args, prefix):
+    with WSGIServer(bot) as server:
+        return drive(server.url, payloads(prefix, args.requests, args.rooms),
+                     args.concurrency)
+
+
+MODES = {"test_client": run_test_client, "wsgi": run_wsgi}
+
+
+def run(args):
+    results = []
+    selected = args.scenarios.split(",") if args.scenarios else None
+    with FakeWebex(latency=args.api_latency, message_text="/bench") as fake:
+        for name, changes in SCENARIOS:
+            if selected and name not in selected:
+                continue
+            scenario = dict(BASE, **changes)
+            for mode in args.modes.split(","):
+                # The bots log every message to stderr
+                with contextlib.redirect_stderr(io.StringIO()):
+                    bot = make_bot(fake, scenario, args.concurrency)
+                    try:
+                        latencies, elapsed, errors = MODES[mode](
+                            bot, args, "%s_%s" % (name, mode)
+                        )
+                    finally:
+                        bot.outbound.stop()
+                        bot.delivery.shutdown()
+                result = dict(scenario=name, mode=mode, **scenario)
+                result.update(summarize(latencies, elapsed, errors))
+                results.append(result)
+                print_row(result, args.compare_with)
+    return results
+
+
+COLUMNS = ("scenario", "mode", "requests", "errors", "rps", "p50_ms",
+           "p95_ms", "p99_ms")
+
+
+def print_header(compare):
+    cols = COLUMNS + (("rps_change",) if compare else ())
+    print(" ".join("%14s" % c for c in cols))
+
+
+def print_row(result, compare):
+    row = ["%14s" % result[c] for c in COLUMNS]
+    if compare:
+        old = compare.get((result["scenario"], result["mode"]))
+        change = ""
+        if old and old["rps"]:
+            change = "%+.1f%%" % ((result["rps"] / old["rps"] - 1) * 100)
+        row.append("%14s" % change)
+    print(" ".join(row))
+    sys.stdout.flush()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--requests", type=int, default=500,
+                        help="Webhooks sent per scenario and mode")
+    parser.add_argument("--concurrency", type=int, default=20,
+                        help="Webhooks in flight for the wsgi mode")
+    parser.add_argument("--api-latency", type=float, default=0.005,
+                        help="Seconds added to every fake Webex response")
+    parser.add_argument("--rooms", type=int, default=50,
+                        help="Rooms the webhooks are spread over")
+    parser.add_argument("--modes", default="test_client,wsgi",
+                        help="Comma separated: test_client, wsgi")
+    parser.add_argument("--scenarios", default="",
+                        help="Comma separated scenario names, default all: "
+                             + ", ".join(n for n, _ in SCENARIOS))
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Earlier JSON results to compare "
+                                          "throughput against")
+    args = parser.parse_args()
+
+    args.compare_with = None
+    if args.compare:
+        with open(args.compare) as f:
+            earlier = json.load(f)
+        args.compare_with = {(r["scenario"], r["mode"]): r
+                             for r in earlier["results"]}
+
+    print_header(args.compare_with)
+    results = run(args)
+
+    if args.output:
+        report = dict(
+            version=webexteamsbot.__version__,
+            revision=git_revision(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            settings=dict(requests=args.requests,
+                          concurrency=args.concurrency,
+                          api_latency=args.api_latency, rooms=args.rooms),
+            results=results,
+        )
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memory and threads used by N bots: each a standalone TeamsBot with its own
+pool and webhook workers, or all added to one BotHost.  Every bot handles
+one message first, then threads are counted once the bots are idle again.
+
+    python -m benchmarks.bench_host --bots 1 10 40
+"""
+
+import argparse
+import gc
+import logging
+import threading
+import time
+import tracemalloc
+
+from benchmarks.common import webhook
+from tests.fake_webex import FakeWebex
+from webexteamsbot import TeamsBot
+from webexteamsbot.host import BotHost
+
+WORKERS = 4
+# Seconds the bots are left idle before counting threads
+IDLE = 0.5
+
+
+def standalone(fake, count):
+    bots = [TeamsBot("bot%d" % i, teams_bot_token="token%d" % i,
+                     teams_bot_email="bot%d@test.com" % i,
+                     teams_api_url=fake.base_url, webhook_workers=WORKERS,
+                     log_level=logging.WARNING)
+            for i in range(count)]
+
+    def stop():
+        for bot in bots:
+            bot.work_queue.stop()
+            bot.outbound.stop()
+            bot.delivery.shutdown()
+
+    return [(bot, "/") for bot in bots], stop
+
+
+def hosted(fake, count):
+    host = BotHost(teams_api_url=fake.base_url, webhook_workers=WORKERS,
+                   idle_timeout=IDLE / 2)
+    bots = [host.add_bot("bot%d" % i, "token%d" % i, "bot%d@test.com" % i,
+                         log_level=logging.WARNING)
+            for i in range(count)]
+    return [(host, "/bot%d" % i) for i in range(len(bots))], host.stop
+
+
+def measure(fake, build, count):
+    gc.collect()
+    threads = threading.active_count()
+    tracemalloc.start()
+    apps, stop = build(fake, count)
+    before = len(fake.sent)
+    for i, (app, path) in enumerate(apps):
+        app.test_client().post(path, json=webhook("message%d" % i))
+    deadline = time.time() + 30
+    while len(fake.sent) - before < count and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(IDLE)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    result = dict(kb=memory / 1024.0,
+                  threads=threading.active_count() - threads)
+    stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--bots", type=int, nargs="+", default=[1, 10, 40],
+                        help="Numbers of bots to measure")
+    args = parser.parse_args()
+
+    print("%6s %12s %16s %10s %14s" % ("bots", "standalone kB",
+                                       "standalone thr", "host kB",
+                                       "host threads"))
+    with FakeWebex(message_text="/echo hi") as fake:
+        for count in args.bots:
+            alone = measure(fake, standalone, count)
+            host = measure(fake, hosted, count)
+            print("%6d %12.0f %16d %10.0f %14d" % (
+                count, alone["kb"], alone["threads"], host["kb"],
+                host["threads"],
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the compiled CommandMatcher against the original sort-and-scan
+command lookup as the number of registered commands grows.  The automaton
+and the presorted scan CommandMatcher uses for few commands are timed
+separately, to choose matcher.SCAN_THRESHOLD.
+
+    python -m benchmarks.bench_matcher
+"""
+
+import argparse
+import timeit
+from webexteamsbot.matcher import CommandMatcher
+
+
+def sorted_scan(commands, text):
+    """The original per-message command lookup."""
+    for c in sorted(commands.items()):
+        if text.lower().find(c[0]) != -1:
+            return c[0]
+    return ""
+
+
+def make_commands(count):
+    return {"/command%04d" % i: {"help": "", "callback": None}
+            for i in range(count)}
+
+
+def run(counts, number):
+    text = "hey bot, could you please run /command%04d for me? thanks!"
+    print("%8s %14s %14s %14s %8s" % ("commands", "scan (us)",
+                                      "presorted (us)", "automaton (us)",
+                                      "speedup"))
+    for count in counts:
+        commands = make_commands(count)
+        presorted = CommandMatcher(commands.keys(), threshold=count)
+        automaton = CommandMatcher(commands.keys(), threshold=0)
+        matcher = CommandMatcher(commands.keys())
+        # Worst case for the scan: the last command in sorted order
+        msg = text % (count - 1)
+        assert sorted_scan(commands, msg) == matcher.match(msg.lower()) \
+            == presorted.match(msg.lower()) == automaton.match(msg.lower())
+
+        def timed(func):
+            return min(timeit.repeat(func, number=number,
+                                     repeat=3)) / number * 1e6
+
+        scan = timed(lambda: sorted_scan(commands, msg))
+        times = [timed(lambda: m.match(msg.lower()))
+                 for m in (presorted, automaton, matcher)]
+        print("%8d %14.2f %14.2f %14.2f %7.1fx" % (
+            count, scan, times[0], times[1], scan / times[2]
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--counts", default="1,5,10,20,30,50,200,1000",
+                        help="Comma separated command counts")
+    parser.add_argument("--number", type=int, default=2000,
+                        help="Lookups per timing run")
+    args = parser.parse_args()
+    run([int(c) for c in args.counts.split(",")], args.number)
+
+
+if __name__ == "__main__":
+    main()
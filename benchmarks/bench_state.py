@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per-operation overhead of the state backends: in memory, SQLite and
+Redis, against the local stand-in or a real server with --redis-url.
+
+    python -m benchmarks.bench_state
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+from webexteamsbot.state import (MemoryStateBackend, RedisStateBackend,
+                                 SQLiteStateBackend)
+from tests.fake_redis import FakeRedis
+
+OPERATIONS = (
+    ("get", lambda s, i: s.get("key")),
+    ("set", lambda s, i: s.set("key", {"id": i}, ttl=60)),
+    ("add", lambda s, i: s.add("event:%d" % i, 1, ttl=60)),
+    ("incr", lambda s, i: s.incr("counter")),
+    ("bucket", lambda s, i: s.bucket("bucket", 1e6, 1e6)),
+)
+
+
+def measure(state, number):
+    """Microseconds per call of each operation."""
+    state.set("key", {"id": 0})
+    ret = {}
+    for name, op in OPERATIONS:
+        counter = iter(range(10 ** 9))
+        best = min(timeit.repeat(lambda: op(state, next(counter)),
+                                 number=number, repeat=3))
+        ret[name] = best / number * 1e6
+    return ret
+
+
+def run(backends, number):
+    print("%-14s" % "backend" +
+          "".join("%11s" % (name + " us") for name, _ in OPERATIONS))
+    for label, state in backends:
+        results = measure(state, number)
+        print("%-14s" % label +
+              "".join("%11.1f" % results[name] for name, _ in OPERATIONS))
+        state.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--number", type=int, default=2000,
+                        help="Calls per timing run")
+    parser.add_argument("--redis-url",
+                        help="Benchmark a real Redis server too")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        with FakeRedis() as fake:
+            backends = [
+                ("memory", MemoryStateBackend()),
+                ("sqlite", SQLiteStateBackend(os.path.join(tmp, "state.db"))),
+                ("redis (fake)", RedisStateBackend(fake.url,
+                                                   prefix="bench:")),
+            ]
+            if args.redis_url:
+                backends.append(("redis", RedisStateBackend(
+                    args.redis_url, prefix="bench:"
+                )))
+            run(backends, args.number)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
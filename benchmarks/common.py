@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Shared helpers for the benchmarks: servers, load generation, stats."""
+
+import asyncio
+import json
+import socket
+import threading
+import time
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import aiohttp
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1,
+                      int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency summary, latencies in milliseconds."""
+    return dict(
+        requests=len(latencies),
+        errors=errors,
+        seconds=round(elapsed, 4),
+        rps=round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        p50_ms=round(percentile(latencies, 50) * 1000, 2),
+        p95_ms=round(percentile(latencies, 95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 99) * 1000, 2),
+    )
+
+
+def webhook(data_id, resource="messages", room_id="some_room_id"):
+    """A webhook payload for a new message."""
+    return {
+        "id": "webhook_id",
+        "resource": resource,
+        "event": "created",
+        "data": {
+            "id": data_id,
+            "roomId": room_id,
+            "personId": "some_person_id",
+            "personEmail": "matt@example.com",
+        },
+    }
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class WSGIServer(object):
+    """Serve a WSGI app (e.g. TeamsBot) on a thread per request."""
+
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True,
+                                  request_handler=_QuietHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        self.url = "http://127.0.0.1:%d/" % self.port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+
+class ASGIServer(object):
+    """Serve an ASGI app (e.g. AsyncTeamsBot) with uvicorn."""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self.port = free_port()
+        self.url = "http://127.0.0.1:%d/" % self.port
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port,
+                                log_level="warning", backlog=4096)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def drive(url, payloads, concurrency):
+    """
+    POST webhook payloads to a bot with a fixed number in flight.
+    :return: (latencies in seconds, elapsed seconds, error count)
+    """
+    async def run():
+        latencies = []
+        errors = 0
+        queue = list(reversed(payloads))
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        timeout = aiohttp.ClientTimeout(total=300)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=timeout) as client:
+            async def worker():
+                nonlocal errors
+                while queue:
+                    body = json.dumps(queue.pop())
+                    start = time.perf_counter()
+                    try:
+                        async with client.post(
+                            url, data=body,
+                            headers={"Content-Type": "application/json"},
+                        ) as resp:
+                            await resp.read()
+                            if resp.status != 200:
+                                errors += 1
+                    except aiohttp.ClientError:
+                        errors += 1
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+            return latencies, time.perf_counter() - start, errors
+
+    return asyncio.run(run())
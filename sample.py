@@ -6,9 +6,9 @@ Sample code for using webexteamsbot
 import os
 import requests
 from webexteamsbot import TeamsBot
+from webexteamsbot.arguments import Arg
 from webexteamsbot.models import Response
 import sys
-import json
 
 # Retrieve required details from environment variables
 bot_email = os.getenv("TEAMS_BOT_EMAIL")
@@ -82,94 +82,63 @@ def do_something(incoming_msg):
     return "i did what you said - {}".format(incoming_msg.text)
 
 
-# This function generates a basic adaptive card and sends it to the user
-# You can use Microsofts Adaptive Card designer here:
-# https://adaptivecards.io/designer/. The formatting that Webex Teams
-# uses isn't the same, but this still helps with the overall layout
-# make sure to take the data that comes out of the MS card designer and
-# put it inside of the "content" below, otherwise Webex won't understand
-# what you send it.
-def show_card(incoming_msg):
-    attachment = """
-    {
-        "contentType": "application/vnd.microsoft.card.adaptive",
-        "content": {
-            "type": "AdaptiveCard",
-            "body": [{
-                "type": "Container",
-                "items": [{
-                    "type": "TextBlock",
-                    "text": "This is a sample of the adaptive card system."
-                }]
-            }],
-            "actions": [{
-                    "type": "Action.Submit",
-                    "title": "Create",
-                    "data": "add",
-                    "style": "positive",
-                    "id": "button1"
-                },
-                {
-                    "type": "Action.Submit",
-                    "title": "Delete",
-                    "data": "remove",
-                    "style": "destructive",
-                    "id": "button2"
-                }
-            ],
-            "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
-            "version": "1.0"
-        }
-    }
-    """
-    backupmessage = "This is an example using Adaptive Cards."
-
-    c = create_message_with_attachment(
-        incoming_msg.roomId, msgtxt=backupmessage, attachment=json.loads(attachment)
-    )
-    print(c)
-    return ""
-
-
 # An example of how to process card actions
-def handle_cards(api, incoming_msg):
+def handle_cards(action):
     """
     Sample function to handle card actions.
-    :param api: webexteamssdk object
-    :param incoming_msg: The incoming message object from Teams
+    :param action: The card submission, with the button's data and any
+            input values in action.inputs
     :return: A text or markdown based reply
     """
-    m = get_attachment_actions(incoming_msg["data"]["id"])
-
-    return "card action was - {}".format(m["inputs"])
-
-
-# Temporary function to send a message with a card attachment (not yet
-# supported by webexteamssdk, but there are open PRs to add this
-# functionality)
-def create_message_with_attachment(rid, msgtxt, attachment):
-    headers = {
-        "content-type": "application/json; charset=utf-8",
-        "authorization": "Bearer " + teams_token,
-    }
+    return "card action was - {}".format(action.inputs["action"])
 
-    url = "https://api.ciscospark.com/v1/messages"
-    data = {"roomId": rid, "attachments": [attachment], "markdown": msgtxt}
-    response = requests.post(url, json=data, headers=headers)
-    return response.json()
 
+# An Adaptive Card, registered once and sent by show_card.
+# You can use Microsofts Adaptive Card designer here:
+# https://adaptivecards.io/designer/. The formatting that Webex Teams
+# uses isn't the same, but this still helps with the overall layout
+# make sure to take the data that comes out of the MS card designer and
+# put it inside of the "content" below, otherwise Webex won't understand
+# what you send it.
+# Strings like ${name} are filled in each time the card is sent.
+# on_submit is called when someone clicks one of the card's buttons.
+bot.add_card(
+    "sample",
+    {
+        "type": "AdaptiveCard",
+        "body": [{
+            "type": "Container",
+            "items": [{
+                "type": "TextBlock",
+                "text": "Hi ${name}, this is a sample of the adaptive card system."
+            }]
+        }],
+        "actions": [{
+                "type": "Action.Submit",
+                "title": "Create",
+                "data": {"action": "add"},
+                "style": "positive",
+                "id": "button1"
+            },
+            {
+                "type": "Action.Submit",
+                "title": "Delete",
+                "data": {"action": "remove"},
+                "style": "destructive",
+                "id": "button2"
+            }
+        ],
+        "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+        "version": "1.0"
+    },
+    fallback="This is an example using Adaptive Cards.",
+    on_submit=handle_cards,
+)
 
-# Temporary function to get card attachment actions (not yet supported
-# by webexteamssdk, but there are open PRs to add this functionality)
-def get_attachment_actions(attachmentid):
-    headers = {
-        "content-type": "application/json; charset=utf-8",
-        "authorization": "Bearer " + teams_token,
-    }
 
-    url = "https://api.ciscospark.com/v1/attachment/actions/" + attachmentid
-    response = requests.get(url, headers=headers)
-    return response.json()
+# This function sends the card registered above to the user
+def show_card(incoming_msg):
+    return bot.cards.response("sample", name=incoming_msg.personEmail)
 
 
 # An example using a Response object.  Response objects allow more complex
@@ -197,14 +166,15 @@ def ret_message(incoming_msg):
 
 # An example command the illustrates using details from incoming message within
 # the command processing.
-def current_time(incoming_msg):
+def current_time(incoming_msg, args):
     """
     Sample function that returns the current time for a provided timezone
     :param incoming_msg: The incoming message object from Teams
+    :param args: The command's arguments, parsed from the message
     :return: A Response object based reply
     """
-    # Extract the message content, without the command "/time"
-    timezone = bot.extract_message("/time", incoming_msg.text).strip()
+    # The timezone following the command "/time"
+    timezone = args.timezone
 
     # Craft REST API URL to retrieve current time
     #   Using API from http://worldclockapi.com
@@ -238,13 +208,15 @@ current_time_help += "_Example: **/time EST**_"
 bot.set_greeting(greeting)
 
 # Add new commands to the bot.
-bot.add_command("attachmentActions", "*", handle_cards)
 bot.add_command("/showcard", "show an adaptive card", show_card)
 bot.add_command("/dosomething", "help for do something", do_something)
 bot.add_command(
     "/demo", "Sample that creates a Teams message to be returned.", ret_message
 )
-bot.add_command("/time", current_time_help, current_time)
+# "/time" takes one argument.  Messages without it get a usage message
+# instead of calling current_time.
+bot.add_command("/time", current_time_help, current_time,
+                args=[Arg("timezone")])
 
 # Every bot includes a default "/echo" command.  You can remove it, or any
 # other command with the remove_command(command) method.
@@ -16,6 +16,11 @@ requirements = [
     "Flask>=0.12.1"
     ]
 
+extras_requirements = {
+    "async": ["aiohttp>=3.6"],
+    "redis": ["redis>=5"],
+    }
+
 setup_requirements = [ ]
 
 test_requirements = [
@@ -33,16 +38,18 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
     description="A Flask based Webex Teams chat bot.",
+    python_requires=">=3.8",
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description_content_type="text/markdown",
     long_description=readme + '\n\n' + history,
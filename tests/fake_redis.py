@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for a Redis server, for tests and benchmarks.
+
+FakeRedis answers the commands RedisStateBackend uses, including
+WATCH/MULTI/EXEC transactions, over real sockets on a background thread.
+"""
+
+import socket
+import socketserver
+import threading
+import time
+
+
+class _Error(Exception):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super(_Handler, self).setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.fake.clients.add(self.connection)
+        self.watched = None
+        self.queued = None
+
+    def handle(self):
+        server = self.server.fake
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            self.wfile.write(server.execute(self, args))
+
+    def finish(self):
+        self.server.fake.clients.discard(self.connection)
+        super(_Handler, self).finish()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            raise ValueError("Inline commands are not supported")
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2].decode("utf-8"))
+        return args
+
+
+class FakeRedis(object):
+    def __init__(self, latency=0.0, password=None):
+        """
+        :param latency: Seconds added to every reply
+        :param password: Password required by AUTH
+        """
+        self.latency = latency
+        self.password = password
+        # key: (value, expires or None)
+        self.data = {}
+        # Bumped whenever a key changes, for WATCH
+        self.versions = {}
+        self.commands = []
+        self.clients = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.port = None
+
+    @property
+    def url(self):
+        if self.password:
+            return "redis://:%s@127.0.0.1:%d/0" % (self.password, self.port)
+        return "redis://127.0.0.1:%d/0" % self.port
+
+    # *** Server lifecycle
+    def start(self):
+        self._server = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0), _Handler
+        )
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        for sock in list(self.clients):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # *** Protocol
+    def execute(self, conn, args):
+        if self.latency:
+            time.sleep(self.latency)
+        name = args[0].upper()
+        self.commands.append(name)
+        try:
+            if conn.queued is not None and name not in ("EXEC", "DISCARD"):
+                conn.queued.append(args)
+                return b"+QUEUED\r\n"
+            with self._lock:
+                return encode(self.run(conn, name, args[1:]))
+        except _Error as e:
+            return b"-ERR " + str(e).encode("utf-8") + b"\r\n"
+
+    def run(self, conn, name, args):
+        if name == "PING":
+            return "PONG"
+        if name == "AUTH":
+            if args[-1] != self.password:
+                raise _Error("invalid password")
+            return "OK"
+        if name == "SELECT":
+            return "OK"
+        if name == "WATCH":
+            conn.watched = {k: self.versions.get(k, 0) for k in args}
+            return "OK"
+        if name == "UNWATCH":
+            conn.watched = None
+            return "OK"
+        if name == "MULTI":
+            conn.queued = []
+            return "OK"
+        if name == "DISCARD":
+            conn.queued = conn.watched = None
+            return "OK"
+        if name == "EXEC":
+            queued, watched = conn.queued, conn.watched
+            conn.queued = conn.watched = None
+            if queued is None:
+                raise _Error("EXEC without MULTI")
+            if watched and any(self.versions.get(k, 0) != v
+                               for k, v in watched.items()):
+                return None
+            return [self.run(conn, c[0].upper(), c[1:]) for c in queued]
+        if name == "GET":
+            return self.get(args[0])
+        if name == "SET":
+            return self.set(args)
+        if name == "DEL":
+            count = 0
+            for key in args:
+                if self.get(key) is not None:
+                    count += 1
+                    self.delete(key)
+            return count
+        if name in ("INCR", "INCRBY"):
+            value = self.get(args[0])
+            try:
+                value = int(value or 0) + (int(args[1]) if len(args) > 1
+                                           else 1)
+            except ValueError:
+                raise _Error("value is not an integer or out of range")
+            self.put(args[0], str(value), self.data[args[0]][1]
+                     if args[0] in self.data else None)
+            return value
+        if name == "PEXPIRE":
+            value = self.get(args[0])
+            if value is None:
+                return 0
+            self.put(args[0], value, time.time() + int(args[1]) / 1000.0)
+            return 1
+        if name == "DBSIZE":
+            return sum(1 for k in list(self.data) if self.get(k) is not None)
+        if name == "FLUSHDB":
+            for key in list(self.data):
+                self.delete(key)
+            return "OK"
+        raise _Error("unknown command '%s'" % name)
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            self.delete(key)
+            return None
+        return entry[0]
+
+    def put(self, key, value, expires):
+        self.data[key] = (value, expires)
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def delete(self, key):
+        del self.data[key]
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def set(self, args):
+        key, value = args[0], args[1]
+        options = [a.upper() for a in args[2:]]
+        expires = None
+        for unit, scale in (("PX", 1000.0), ("EX", 1.0)):
+            if unit in options:
+                i = options.index(unit)
+                expires = time.time() + int(args[2 + i + 1]) / scale
+        if "NX" in options and self.get(key) is not None:
+            return None
+        self.put(key, value, expires)
+        return "OK"
+
+
+def encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(encode(r) for r in reply)
+    if reply in ("OK", "PONG", "QUEUED"):
+        return ("+%s\r\n" % reply).encode("utf-8")
+    data = reply.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
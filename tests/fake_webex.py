@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for the Webex Teams API, for tests and benchmarks.
+
+FakeWebex runs a small asyncio HTTP/1.1 server on a background thread and
+answers the subset of the API the bot uses, optionally adding latency to
+every response.  Thousands of concurrent slow requests are cheap since each
+is just a coroutine.
+"""
+
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+import itertools
+from email.parser import BytesParser
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeWebex(object):
+    def __init__(self, latency=0.0, message_text="/help",
+                 bot_id="bot_person_id"):
+        """
+        :param latency: Seconds added to every response
+        :param message_text: Text of messages returned by messages/<id>
+        :param bot_id: personId of the bot (people/me)
+        """
+        self.latency = latency
+        self.message_text = message_text
+        self.bot_id = bot_id
+        self.fail_rooms = set()
+        self.messages = {}
+        self.sent = []
+        self.uploads = []
+        self.actions = {}
+        self.webhooks = {}
+        self.rooms = {}
+        self.requests = Counter()
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%d/v1/" % self.port
+
+    # *** Server lifecycle
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._client, "127.0.0.1", 0,
+                                     backlog=4096)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="fake-webex")
+        self._thread.daemon = True
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # *** HTTP handling
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get("transfer-encoding") == "chunked":
+                    body = await self._read_chunked(reader)
+                else:
+                    length = int(headers.get("content-length", 0))
+                    body = await reader.readexactly(length) if length \
+                        else b""
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, data = self.handle(method, target, body,
+                                           headers.get("content-type", ""))
+                payload = b"" if data is None else json.dumps(data).encode()
+                writer.write(
+                    ("HTTP/1.1 %d OK\r\n"
+                     "Content-Type: application/json\r\n"
+                     "Content-Length: %d\r\n\r\n" % (status, len(payload))
+                     ).encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    # noinspection PyMethodMayBeStatic
+    async def _read_chunked(self, reader):
+        body = b""
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                return body
+            body += chunk[:-2]
+
+    def parse_multipart(self, body, content_type):
+        """
+        Message fields of a multipart/form-data body.  Files are recorded
+        in self.uploads and replaced by their filename.
+        """
+        message = BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode("latin-1") +
+            b"\r\n\r\n" + body
+        )
+        data = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            content = part.get_payload(decode=True)
+            filename = part.get_filename()
+            if filename is not None:
+                self.uploads.append(dict(
+                    filename=filename,
+                    content_type=part.get_content_type(),
+                    content=content,
+                ))
+                data.setdefault(name, []).append(filename)
+            else:
+                data[name] = content.decode("utf-8")
+        return data
+
+    def handle(self, method, target, body, content_type=""):
+        """
+        Answer one API request.
+        :return: (status, JSON data)
+        """
+        url = urlsplit(target)
+        path = url.path[len("/v1/"):] if url.path.startswith("/v1/") \
+            else url.path.lstrip("/")
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if content_type.startswith("multipart/"):
+            data = self.parse_multipart(body, content_type)
+        else:
+            data = json.loads(body) if body else {}
+        parts = path.split("/")
+        self.requests[(method, parts[0])] += 1
+
+        if path == "people/me":
+            return 200, {"id": self.bot_id, "emails": ["bot@webex.bot"],
+                         "displayName": "Fake Bot"}
+        if parts[0] == "messages":
+            if method == "GET" and len(parts) == 2:
+                return 200, self.get_message(parts[1])
+            if method == "GET":
+                return 200, {"items": self.list_messages(query)}
+            if method == "POST":
+                if data.get("roomId") in self.fail_rooms:
+                    return 400, {"message": "Room not found"}
+                message = dict(data, id="sent_%d" % next(self._ids),
+                               personId=self.bot_id)
+                self.sent.append(message)
+                room = self.rooms.get(data.get("roomId"))
+                if room is not None:
+                    message["created"] = self.timestamp()
+                    message["roomType"] = room["type"]
+                    self.messages[message["id"]] = message
+                    room["lastActivity"] = message["created"]
+                return 200, message
+        if parts[:2] == ["attachment", "actions"] and method == "GET":
+            if len(parts) == 3 and parts[2] in self.actions:
+                return 200, self.actions[parts[2]]
+            return 404, {"message": "Not found"}
+        if parts[0] == "webhooks":
+            return self.handle_webhooks(method, parts, data)
+        if parts[0] == "rooms" and method == "GET":
+            if len(parts) == 2:
+                if parts[1] not in self.rooms:
+                    return 404, {"message": "Not found"}
+                return 200, self.rooms[parts[1]]
+            return 200, {"items": self.list_rooms(query)}
+        return 404, {"message": "Not found"}
+
+    def get_message(self, message_id):
+        message = self.messages.get(message_id)
+        if message is None:
+            message = {
+                "id": message_id,
+                "roomId": "some_room_id",
+                "roomType": "group",
+                "personId": "some_person_id",
+                "personEmail": "matt@example.com",
+                "text": self.message_text,
+                "created": "2015-10-18T14:26:16+00:00",
+            }
+        return message
+
+    def list_messages(self, query):
+        room = query.get("roomId")
+        items = [m for m in self.messages.values() if m["roomId"] == room]
+        items.reverse()
+        before = query.get("beforeMessage")
+        if before is not None:
+            ids = [m["id"] for m in items]
+            items = items[ids.index(before) + 1:] if before in ids else []
+        return items[:int(query.get("max", 50))]
+
+    # *** Test setup
+    def timestamp(self):
+        """An API style timestamp, later than every earlier one."""
+        when = datetime(2020, 1, 1) + timedelta(milliseconds=next(self._ids))
+        return when.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+    def add_room(self, room_id, room_type="group"):
+        self.rooms[room_id] = {
+            "id": room_id,
+            "title": room_id,
+            "type": room_type,
+            "lastActivity": self.timestamp(),
+        }
+        return self.rooms[room_id]
+
+    def add_message(self, room_id, text, person_id="some_person_id",
+                    person_email="matt@example.com"):
+        """
+        Post a message to a room, as a user would.
+        :return: The message
+        """
+        if room_id not in self.rooms:
+            self.add_room(room_id)
+        room = self.rooms[room_id]
+        created = self.timestamp()
+        message = {
+            "id": "message_%d" % next(self._ids),
+            "roomId": room_id,
+            "roomType": room["type"],
+            "personId": person_id,
+            "personEmail": person_email,
+            "text": text,
+            "created": created,
+        }
+        self.messages[message["id"]] = message
+        room["lastActivity"] = created
+        return message
+
+    def add_action(self, room_id, inputs, message_id="card_message",
+                   person_id="some_person_id"):
+        """
+        Submit a card, as a user would.
+        :return: The attachmentAction
+        """
+        action = {
+            "id": "action_%d" % next(self._ids),
+            "type": "submit",
+            "messageId": message_id,
+            "inputs": inputs,
+            "personId": person_id,
+            "roomId": room_id,
+            "created": self.timestamp(),
+        }
+        self.actions[action["id"]] = action
+        return action
+
+    def list_rooms(self, query):
+        items = list(self.rooms.values())
+        if query.get("sortBy") == "lastactivity":
+            items.sort(key=lambda r: r["lastActivity"], reverse=True)
+        return items[:int(query.get("max", 100))]
+
+    def handle_webhooks(self, method, parts, data):
+        if method == "GET":
+            return 200, {"items": list(self.webhooks.values())}
+        if method == "POST":
+            hook = dict(data, id="webhook_%d" % next(self._ids),
+                        status="active")
+            self.webhooks[hook["id"]] = hook
+            return 200, hook
+        hook_id = parts[1] if len(parts) > 1 else None
+        if hook_id not in self.webhooks:
+            return 404, {"message": "Not found"}
+        if method == "PUT":
+            self.webhooks[hook_id].update(data)
+            return 200, self.webhooks[hook_id]
+        if method == "DELETE":
+            del self.webhooks[hook_id]
+            return 204, None
+        return 405, {"message": "Method not allowed"}
@@ -37,3 +37,55 @@ class ModelTests(unittest.TestCase):
         r = Response()
         r.text = "foo"
         self.assertIn("text", r.as_dict())
+
+    def test_response_fields(self):
+        card = {"contentType": "application/vnd.microsoft.card.adaptive",
+                "content": {"type": "AdaptiveCard"}}
+        r = Response(markdown="hi", toPersonEmail="someone@example.com",
+                     parentId="someparent")
+        r.attachments = card
+        self.assertEqual(r.as_dict(), {
+            "toPersonEmail": "someone@example.com",
+            "parentId": "someparent",
+            "markdown": "hi",
+            "attachments": [card],
+        })
+        r.files = ["a", "b"]
+        self.assertEqual(r.files, ["a", "b"])
+
+    def test_response_attributes_dict(self):
+        r = Response({"text": "foo", "files": ["someurl"], "custom": 1})
+        self.assertEqual(r.as_dict(),
+                         {"text": "foo", "files": ["someurl"], "custom": 1})
+        self.assertIsNone(r.attributes["roomId"])
+
+    def test_response_cached(self):
+        r = Response()
+        r.text = "foo"
+        self.assertIs(r.as_dict(), r.as_dict())
+        self.assertIs(r.json(), r.json())
+        r.text = "bar"
+        self.assertEqual(r.as_dict(), {"text": "bar"})
+        self.assertEqual(r.json(), '{"text": "bar"}')
+        r.files = "someurl"
+        self.assertEqual(r.as_dict()["files"], ["someurl"])
+
+    def test_response_template(self):
+        t = Response.template(markdown="**notice**", files=["someurl"])
+        self.assertTrue(t.frozen)
+        with self.assertRaises(AttributeError):
+            t.roomId = "someid"
+        with self.assertRaises(AttributeError):
+            t.files = "another"
+
+        a = t.clone(roomId="room_a")
+        b = t.clone(roomId="room_b")
+        self.assertEqual(a.as_dict(), {"roomId": "room_a",
+                                       "markdown": "**notice**",
+                                       "files": ["someurl"]})
+        self.assertEqual(b.roomId, "room_b")
+        self.assertNotIn("roomId", t.as_dict())
+        self.assertFalse(a.frozen)
+        a.files = "another"
+        self.assertEqual(a.files, ["someurl", "another"])
+        self.assertEqual(t.files, ("someurl",))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.actions`."""
+
+import json
+import time
+import unittest
+from webexteamsbot import TeamsBot
+from webexteamsbot.actions import (ActionCache, ActionRouter,
+                                   AttachmentAction, tag_submit_actions)
+from webexteamsbot.models import Response
+from .fake_webex import FakeWebex
+
+try:
+    import aiohttp
+    from webexteamsbot.aio import AsyncTeamsBot
+    from .test_aio import asgi_request
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+VOTE = {
+    "type": "AdaptiveCard",
+    "version": "1.0",
+    "body": [{"type": "Input.Text", "id": "comment"}],
+    "actions": [
+        {"type": "Action.Submit", "title": "Yes", "data": {"action": "yes"}},
+        {"type": "Action.Submit", "title": "No", "data": {"action": "no"}},
+        {"type": "Action.OpenUrl", "url": "https://example.com"},
+    ],
+}
+
+
+def action_event(action):
+    return {
+        "id": "webhook_id",
+        "resource": "attachmentActions",
+        "event": "created",
+        "data": {"id": action["id"], "roomId": action["roomId"],
+                 "personId": action["personId"]},
+    }
+
+
+class TagSubmitActionsTests(unittest.TestCase):
+    def test_tag(self):
+        tagged = tag_submit_actions(json.dumps(VOTE), "vote")
+        self.assertEqual(tagged["actions"][0]["data"],
+                         {"action": "yes", "card": "vote"})
+        self.assertEqual(tagged["actions"][1]["data"]["card"], "vote")
+        self.assertNotIn("data", tagged["actions"][2])
+
+        tagged = tag_submit_actions(VOTE, "vote")
+        # The card itself is not modified, and untouched parts are shared
+        self.assertNotIn("card", VOTE["actions"][0]["data"])
+        self.assertIs(tagged["body"], VOTE["body"])
+        self.assertIs(tagged["actions"][2], VOTE["actions"][2])
+
+        card = {"actions": [{"type": "Action.Submit",
+                             "data": {"card": "other"}}]}
+        self.assertIs(tag_submit_actions(card, "vote"), card)
+
+
+class ActionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.fetched = []
+
+        def fetch(action_id):
+            self.fetched.append(action_id)
+            return AttachmentAction({"id": action_id, "inputs": {}})
+
+        self.fetch = fetch
+
+    def test_fetch_once(self):
+        cache = ActionCache(self.fetch)
+        a = cache.get("a")
+        self.assertIs(cache.get("a"), a)
+        self.assertEqual(self.fetched, ["a"])
+        self.assertEqual(cache.stats()["api_calls_saved"], 1)
+
+    def test_ttl_and_size(self):
+        cache = ActionCache(self.fetch, ttl=0.05, max_size=2)
+        cache.get("a")
+        cache.get("b")
+        cache.get("a")
+        cache.get("c")
+        # b was the least recently used
+        self.assertIsNone(cache.lookup("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.lookup("a"))
+
+
+class ActionRouterTests(unittest.TestCase):
+    def test_route(self):
+        router = ActionRouter()
+        card_handler = object()
+        yes_handler = object()
+        router.add("vote", card_handler)
+        router.add("vote", yes_handler, action="yes")
+
+        def route(inputs):
+            return router.route(AttachmentAction({"inputs": inputs}))
+
+        self.assertEqual(route({"card": "vote", "action": "yes"}),
+                         ("vote", yes_handler))
+        self.assertEqual(route({"card": "vote", "action": "no"}),
+                         ("vote", card_handler))
+        self.assertEqual(route({"card": "survey"}), (None, None))
+        self.assertEqual(route({}), (None, None))
+        self.assertEqual(router.stats()["unrouted"], 2)
+
+
+class TeamsBotActionTests(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeWebex().start()
+        self.addCleanup(self.fake.stop)
+        self.bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=self.fake.base_url,
+            teams_bot_email="test@test.com",
+        )
+        self.addCleanup(self.bot.outbound.stop)
+        self.bot.testing = True
+
+    def post(self, action):
+        return self.bot.test_client().post(
+            "/", data=json.dumps(action_event(action)),
+            content_type="application/json",
+        )
+
+    def test_on_submit(self):
+        submitted = []
+
+        def vote(action):
+            submitted.append(action)
+            return Response(markdown="Thanks for voting " +
+                            action.inputs["action"])
+
+        template = self.bot.add_card("vote", VOTE, on_submit=vote)
+        sent_card = template.render()["content"]
+        self.assertEqual(sent_card["actions"][0]["data"]["card"], "vote")
+
+        action = self.fake.add_action(
+            "some_room_id", dict(sent_card["actions"][0]["data"],
+                                 comment="ok")
+        )
+        resp = self.post(action)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(submitted[0].inputs["comment"], "ok")
+        self.assertEqual(submitted[0].personId, "some_person_id")
+        self.assertEqual(self.fake.sent[-1]["markdown"],
+                         "Thanks for voting yes")
+        self.assertEqual(self.fake.sent[-1]["roomId"], "some_room_id")
+
+        # The action is cached for anything else looking it up
+        self.assertIs(self.bot.actions.get(action["id"]), submitted[0])
+        self.assertEqual(
+            self.fake.requests[("GET", "attachment")], 1
+        )
+        text = self.bot.metrics.registry.render()
+        self.assertIn('webexteamsbot_card_actions_routed 1', text)
+
+    def test_resource_callback_fallback(self):
+        self.bot.add_card_action("vote", lambda action: "voted")
+        legacy = []
+        self.bot.add_command(
+            "attachmentActions", "*",
+            lambda teams, post_data: legacy.append(post_data) or "legacy"
+        )
+        action = self.fake.add_action("some_room_id", {"card": "survey"})
+        resp = self.post(action)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(legacy[0]["data"]["id"], action["id"])
+        self.assertEqual(self.fake.sent[-1]["markdown"], "legacy")
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class AsyncTeamsBotActionTests(unittest.IsolatedAsyncioTestCase):
+    async def test_on_submit(self):
+        fake = FakeWebex().start()
+        self.addCleanup(fake.stop)
+        bot = AsyncTeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_url="http://fakebot.com",
+            teams_bot_email="test@test.com",
+        )
+        self.addAsyncCleanup(bot.shutdown)
+
+        async def vote(action):
+            return "Voted " + action.inputs["action"]
+
+        bot.add_card_action("vote", vote, action="no")
+        action = fake.add_action("some_room_id",
+                                 {"card": "vote", "action": "no"})
+        status, text = await asgi_request(bot, "POST", "/",
+                                          action_event(action))
+        self.assertEqual(status, 200)
+        self.assertEqual(fake.sent[-1]["markdown"], "Voted no")
+        self.assertIsNotNone(bot.actions.lookup(action["id"]))
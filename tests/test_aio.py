@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.aio`."""
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from webexteamsbot.models import Response
+from webexteamsbot.uploads import UploadTooLarge
+from .fake_webex import FakeWebex
+from .teams_mock import MockTeamsAPI
+
+try:
+    import aiohttp
+    from webexteamsbot.aio import AsyncTeamsBot
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+async def asgi_request(app, method, path, data=None):
+    """Call an ASGI app directly, returning (status, body text)."""
+    body = json.dumps(data).encode() if data is not None else b""
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    status = sent[0]["status"]
+    text = b"".join(m.get("body", b"") for m in sent[1:]).decode()
+    return status, text
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class AsyncTeamsBotTests(unittest.IsolatedAsyncioTestCase):
+    def make_bot(self, **kwargs):
+        fake = FakeWebex(**kwargs).start()
+        self.addCleanup(fake.stop)
+        bot = AsyncTeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_url="http://fakebot.com",
+            teams_bot_email="test@test.com",
+        )
+        self.addAsyncCleanup(bot.shutdown)
+        return bot, fake
+
+    def incoming(self, data_id="incoming_message_id"):
+        post_data = json.loads(MockTeamsAPI.incoming_msg())
+        post_data["data"]["id"] = data_id
+        return post_data
+
+    async def test_health(self):
+        bot, fake = self.make_bot()
+        status, text = await asgi_request(bot, "GET", "/health")
+        self.assertEqual(status, 200)
+        self.assertEqual(text, "I'm Alive")
+
+    async def test_unknown_route(self):
+        bot, fake = self.make_bot()
+        status, text = await asgi_request(bot, "GET", "/nope")
+        self.assertEqual(status, 404)
+
+    async def test_help_reply(self):
+        bot, fake = self.make_bot()
+        status, text = await asgi_request(bot, "POST", "/", self.incoming())
+        self.assertEqual(status, 200)
+        self.assertIn("I understand the following commands", text)
+        self.assertEqual(len(fake.sent), 1)
+        self.assertEqual(fake.sent[0]["roomId"], "some_room_id")
+
+    async def test_help_follows_command_changes(self):
+        bot, fake = self.make_bot()
+        self.assertNotIn("/status", await bot.send_help(None))
+        bot.add_command("/status", "Show the status.", lambda m: "ok")
+        bot.set_help_message("Commands:  \n")
+        help_text = await bot.send_help(None)
+        self.assertTrue(help_text.startswith("Commands:"))
+        self.assertIn("* **/status**: Show the status.", help_text)
+        self.assertEqual(bot.find_command("please /STATUS"), "/status")
+        bot.remove_command("/status")
+        self.assertNotIn("/status", await bot.send_help(None))
+        self.assertEqual(bot.find_command("/status"), "")
+
+    async def test_async_and_sync_callbacks(self):
+        bot, fake = self.make_bot(message_text="/slow")
+
+        async def slow(incoming_msg):
+            await asyncio.sleep(0.05)
+            return "done " + incoming_msg.text
+
+        bot.add_command("/slow", "slow command", slow)
+        posts = [asgi_request(bot, "POST", "/", self.incoming("id%d" % i))
+                 for i in range(50)]
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        responses = await asyncio.gather(*posts)
+        # 50 concurrent slow callbacks cost about one callback's time
+        self.assertLess(loop.time() - start, 1.0)
+        self.assertTrue(all(text == "done /slow" for _, text in responses))
+        # The bot identity is looked up once
+        self.assertEqual(fake.requests[("GET", "people")], 1)
+
+        bot.add_command("/slow", "sync command", lambda m: "sync")
+        status, text = await asgi_request(bot, "POST", "/",
+                                          self.incoming("sync"))
+        self.assertEqual(text, "sync")
+
+    async def test_response_attachments(self):
+        bot, fake = self.make_bot(message_text="/report")
+        tmp = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+        self.addCleanup(os.unlink, tmp.name)
+        tmp.write(b"a,b\n1,2\n")
+        tmp.close()
+
+        def report(incoming_msg):
+            generated = Response(text="Generated")
+            generated.attach((b"%d\n" % i for i in range(1000)),
+                             filename="numbers.txt")
+            local = Response(text="From disk")
+            local.files = tmp.name
+            return [generated, local]
+
+        bot.add_command("/report", "send a report", report)
+        status, text = await asgi_request(bot, "POST", "/", self.incoming())
+        self.assertEqual((status, text), (200, "ok"))
+        self.assertEqual(len(fake.uploads), 2)
+        self.assertEqual(fake.uploads[0]["filename"], "numbers.txt")
+        self.assertEqual(fake.uploads[0]["content"],
+                         b"".join(b"%d\n" % i for i in range(1000)))
+        # A local path is uploaded, not sent to the API as a URL
+        self.assertEqual(fake.uploads[1]["filename"],
+                         os.path.basename(tmp.name))
+        self.assertEqual(fake.uploads[1]["content"], b"a,b\n1,2\n")
+        self.assertEqual([m["text"] for m in fake.sent],
+                         ["Generated", "From disk"])
+
+        bot.teams.upload_max_size = 4
+        response = Response(text="Too big")
+        response.attach(b"12345", filename="big.bin")
+        with self.assertRaises(UploadTooLarge):
+            await bot.teams.create_message(roomId="some_room_id",
+                                           **response.as_dict())
+
+    async def test_response_list(self):
+        bot, fake = self.make_bot(message_text="/multi")
+        fake.fail_rooms.add("bad_room")
+
+        def multi(incoming_msg):
+            responses = []
+            for room in (None, "bad_room", "other_room"):
+                r = Response()
+                r.markdown = "part"
+                r.roomId = room
+                responses.append(r)
+            return responses
+
+        bot.add_command("/multi", "*", multi)
+        status, text = await asgi_request(bot, "POST", "/", self.incoming())
+        self.assertEqual(text, "1 of 3 replies failed")
+        self.assertEqual(len(fake.sent), 2)
+
+        # Errors other than API errors are counted per reply too
+        create_message = bot.teams.create_message
+
+        async def timing_out(**payload):
+            if payload["roomId"] == "other_room":
+                raise asyncio.TimeoutError()
+            return await create_message(**payload)
+
+        bot.teams.create_message = timing_out
+        status, text = await asgi_request(bot, "POST", "/",
+                                          self.incoming("second"))
+        self.assertEqual(text, "2 of 3 replies failed")
+        self.assertEqual(len(fake.sent), 3)
+
+    async def test_duplicate_and_self_messages(self):
+        bot, fake = self.make_bot(bot_id="some_person_id")
+        status, text = await asgi_request(bot, "POST", "/", self.incoming())
+        self.assertEqual(text, "")
+        status, text = await asgi_request(bot, "POST", "/", self.incoming())
+        self.assertEqual(text, "Duplicate")
+        self.assertEqual(fake.sent, [])
+
+    async def test_startup_creates_webhook(self):
+        bot, fake = self.make_bot()
+        await bot.startup()
+        self.assertEqual(len(bot.webhooks), 1)
+        self.assertEqual(bot.webhooks[0].targetUrl, "http://fakebot.com")
+        self.assertEqual(fake.requests[("POST", "webhooks")], 1)
+        # A second startup finds the webhook already correct
+        await bot.startup()
+        self.assertEqual(fake.requests[("POST", "webhooks")], 1)
+        self.assertNotIn(("PUT", "webhooks"), fake.requests)
+
+    async def test_startup_enables_disabled_webhook(self):
+        bot, fake = self.make_bot()
+        await bot.startup()
+        hook = next(iter(fake.webhooks.values()))
+        hook["status"] = "inactive"
+        await bot.startup()
+        self.assertEqual(fake.requests[("PUT", "webhooks")], 1)
+        self.assertEqual(fake.requests[("POST", "webhooks")], 1)
+        self.assertEqual(hook["status"], "active")
+        self.assertEqual(bot.webhooks[0].status, "active")
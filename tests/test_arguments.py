@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.arguments`."""
+
+import unittest
+from webexteamsbot import TeamsBot
+from webexteamsbot.arguments import (Arg, ArgumentSpec, Option, UsageError,
+                                     command_text)
+from .fake_webex import FakeWebex
+
+try:
+    import aiohttp
+    from webexteamsbot.aio import AsyncTeamsBot
+    from .test_aio import asgi_request
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+ROLL = [
+    Arg("dice", type=int, default=1),
+    Arg("sides", type=int, default=6),
+    Option("modifier", type=int, default=0, short="m"),
+    Option("colour", choices=["Red", "Blue"]),
+    Option("secret", flag=True, short="s"),
+]
+
+
+class ArgumentSpecTests(unittest.TestCase):
+    def test_parse(self):
+        spec = ArgumentSpec(ROLL)
+        self.assertEqual(spec.parse(""), dict(dice=1, sides=6, modifier=0,
+                                              colour=None, secret=False))
+        args = spec.parse(" 2 20 -m -3 --colour=red -s")
+        self.assertEqual((args.dice, args.sides, args.modifier, args.colour,
+                          args.secret), (2, 20, -3, "Red", True))
+
+    def test_usage_errors(self):
+        spec = ArgumentSpec(ROLL)
+        for text, error in (("two", "dice must be an int, not 'two'"),
+                            ("1 2 3", "Unexpected argument '3'"),
+                            ("--colour green",
+                             "colour must be one of Red, Blue"),
+                            ("--modifier", "--modifier needs a value"),
+                            ("--secret=yes", "--secret takes no value"),
+                            ("--loud", "Unknown option --loud")):
+            with self.assertRaises(UsageError) as ctx:
+                spec.parse(text)
+            self.assertEqual(str(ctx.exception), error)
+        self.assertEqual(
+            spec.usage("/roll"),
+            "/roll [dice] [sides] [--modifier MODIFIER] "
+            "[--colour Red|Blue] [--secret]"
+        )
+
+    def test_required_and_rest(self):
+        spec = ArgumentSpec([Arg("room"), Arg("text", rest=True)])
+        args = spec.parse(' "Project X"  hello  there ')
+        self.assertEqual(args, {"room": "Project X", "text": "hello  there"})
+        with self.assertRaises(UsageError) as ctx:
+            spec.parse("")
+        self.assertEqual(str(ctx.exception), "Missing room")
+        self.assertEqual(spec.usage("/say"), "/say <room> <text...>")
+
+        for args in ([Arg("a", rest=True), Arg("b")],
+                     [Arg("a", default=1), Arg("b")],
+                     [Arg("a"), Option("a")]):
+            with self.assertRaises(ValueError):
+                ArgumentSpec(args)
+
+    def test_command_text(self):
+        self.assertEqual(command_text("/time", "@bot /TIME est"), " est")
+        self.assertEqual(command_text("/time", None), "")
+
+
+class TeamsBotArgumentTests(unittest.TestCase):
+    def test_add_command_args(self):
+        fake = FakeWebex().start()
+        self.addCleanup(fake.stop)
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_email="test@test.com",
+        )
+        self.addCleanup(bot.outbound.stop)
+        bot.add_command(
+            "/roll", "Roll dice",
+            lambda message, args: "%dd%d" % (args.dice, args.sides),
+            args=ROLL,
+        )
+        for text in ("/roll 3 8", "/roll lots"):
+            message = fake.add_message("some_room_id", text)
+            bot.process_event({"resource": "messages", "event": "created",
+                               "data": {"id": message["id"],
+                                        "roomId": "some_room_id",
+                                        "personId": "some_person_id"}})
+        self.assertEqual(fake.sent[0]["markdown"], "3d8")
+        self.assertEqual(
+            fake.sent[1]["markdown"],
+            "dice must be an int, not 'lots'  \nUsage: `/roll [dice] [sides] "
+            "[--modifier MODIFIER] [--colour Red|Blue] [--secret]`"
+        )
+        self.assertIn("* **/roll [dice] [sides]", bot.send_help(None))
+        self.assertIn('webexteamsbot_errors_total{stage="usage"} 1',
+                      bot.metrics.registry.render())
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class AsyncTeamsBotArgumentTests(unittest.IsolatedAsyncioTestCase):
+    async def test_add_command_args(self):
+        fake = FakeWebex().start()
+        self.addCleanup(fake.stop)
+        bot = AsyncTeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_url="http://fakebot.com",
+            teams_bot_email="test@test.com",
+        )
+        self.addAsyncCleanup(bot.shutdown)
+
+        async def roll(message, args):
+            return "%dd%d" % (args.dice, args.sides)
+
+        bot.add_command("/roll", "Roll dice", roll, args=ROLL)
+        for text in ("/roll 2", "/roll --colour green"):
+            message = fake.add_message("some_room_id", text)
+            status, _ = await asgi_request(bot, "POST", "/", {
+                "resource": "messages", "event": "created",
+                "data": {"id": message["id"], "roomId": "some_room_id",
+                         "personId": "some_person_id"},
+            })
+            self.assertEqual(status, 200)
+        self.assertEqual(fake.sent[0]["markdown"], "2d6")
+        self.assertTrue(fake.sent[1]["markdown"].startswith(
+            "colour must be one of Red, Blue  \nUsage: `/roll"
+        ))
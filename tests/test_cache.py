@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.cache`."""
+
+import unittest
+from webexteamsbot.cache import TTLCache
+
+
+class TTLCacheTests(unittest.TestCase):
+    def test_expiry(self):
+        cache = TTLCache(10)
+        cache.put("a", 1, 5.0, 0.0)
+        cache.put("b", 2, None, 0.0)
+        self.assertEqual(cache.get("a", 4.9), 1)
+        self.assertIsNone(cache.get("a", 5.0))
+        self.assertEqual(cache.get("a", 5.0, "missing"), "missing")
+        self.assertEqual(cache.get("b", 1e9), 2)
+        self.assertEqual((len(cache), cache.expirations), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = TTLCache(2)
+        cache.put("a", 1, None, 0.0)
+        cache.put("b", 2, None, 0.0)
+        cache.get("a", 0.0)
+        cache.put("c", 3, None, 0.0)
+        self.assertEqual(list(cache), ["a", "c"])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_expired_dropped_from_old_end(self):
+        cache = TTLCache(10)
+        cache.put("a", 1, 1.0, 0.0)
+        cache.put("b", 2, 1.0, 0.0)
+        cache.put("c", 3, 10.0, 2.0)
+        self.assertEqual(list(cache), ["c"])
+        self.assertEqual((cache.expirations, cache.evictions), (2, 0))
+
+    def test_size_limit(self):
+        cache = TTLCache(10, max_bytes=10)
+        cache.put("a", "x", None, 0.0, size=4)
+        cache.put("b", "x", None, 0.0, size=4)
+        cache.put("a", "x", None, 0.0, size=5)
+        self.assertEqual(list(cache), ["b", "a"])
+        self.assertEqual(cache.bytes, 9)
+        cache.put("b", "x", None, 0.0, size=2)
+        self.assertEqual(list(cache), ["a", "b"])
+        cache.put("c", "x", None, 0.0, size=4)
+        self.assertEqual(list(cache), ["b", "c"])
+        self.assertEqual((cache.bytes, cache.evictions), (6, 1))
+        # Kept even when larger than the limit on its own
+        cache.put("c", "x", None, 0.0, size=20)
+        self.assertEqual(list(cache), ["c"])
+        self.assertEqual(cache.bytes, 20)
+        cache.pop("c")
+        self.assertEqual((len(cache), cache.bytes), (0, 0))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.cards`."""
+
+import json
+import unittest
+from webexteamsbot import TeamsBot
+from webexteamsbot.cards import (CONTENT_TYPE, CardDataError, CardRegistry,
+                                 CardTemplate)
+from .fake_webex import FakeWebex
+from .teams_mock import MockTeamsAPI
+
+DASHBOARD = {
+    "type": "AdaptiveCard",
+    "version": "1.0",
+    "body": [
+        {"type": "TextBlock", "text": "Status of ${service.name}",
+         "size": "large"},
+        {"type": "FactSet", "facts": "${facts}"},
+        {"type": "TextBlock", "text": "Static footer"},
+    ],
+    "actions": [{"type": "Action.Submit", "title": "Refresh",
+                 "data": {"service": "${service.id}"}}],
+}
+
+
+class Service(object):
+    name = "api"
+    id = 7
+
+
+class CardTemplateTests(unittest.TestCase):
+    def test_render(self):
+        t = CardTemplate("dashboard", DASHBOARD)
+        facts = [{"title": "Up", "value": "yes"}]
+        card = t.render(service={"name": "api", "id": 7}, facts=facts)
+        self.assertEqual(card["contentType"], CONTENT_TYPE)
+        body = card["content"]["body"]
+        self.assertEqual(body[0]["text"], "Status of api")
+        self.assertEqual(body[0]["size"], "large")
+        self.assertIs(body[1]["facts"], facts)
+        self.assertEqual(card["content"]["actions"][0]["data"],
+                         {"service": 7})
+        # Parts without slots are shared, not copied
+        self.assertIs(body[2], DASHBOARD["body"][2])
+        self.assertEqual(DASHBOARD["body"][0]["text"],
+                         "Status of ${service.name}")
+
+    def test_attribute_data_and_missing(self):
+        t = CardTemplate("dashboard", json.dumps(DASHBOARD))
+        card = t.render({"service": Service(), "facts": []})
+        self.assertEqual(card["content"]["body"][0]["text"], "Status of api")
+        with self.assertRaises(CardDataError):
+            t.render(service=Service())
+
+    def test_static_card(self):
+        attachment = {"contentType": CONTENT_TYPE,
+                      "content": {"type": "AdaptiveCard", "body": []}}
+        t = CardTemplate("static", attachment, fallback="A card")
+        self.assertIs(t.render(), attachment)
+        a = t.response()
+        b = t.response()
+        self.assertIsNot(a, b)
+        self.assertEqual(a.as_dict(), {"markdown": "A card",
+                                       "attachments": [attachment]})
+        a.roomId = "somewhere"
+        self.assertIsNone(b.roomId)
+
+    def test_fallback_slots(self):
+        t = CardTemplate("dashboard", DASHBOARD,
+                         fallback="**${service.name}** is up: ${up}")
+        r = t.response(service=Service(), facts=[], up=True)
+        self.assertEqual(r.markdown, "**api** is up: true")
+
+    def test_registry(self):
+        cards = CardRegistry()
+        cards.register("dashboard", DASHBOARD)
+        self.assertIn("dashboard", cards)
+        self.assertEqual(len(cards), 1)
+        with self.assertRaises(KeyError):
+            cards.render("missing")
+
+
+class TeamsBotCardTests(unittest.TestCase):
+    def test_card_command(self):
+        fake = FakeWebex(message_text="/status").start()
+        self.addCleanup(fake.stop)
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_email="test@test.com",
+        )
+        self.addCleanup(bot.outbound.stop)
+        bot.add_card("dashboard", DASHBOARD, fallback="Status")
+        bot.add_command(
+            "/status", "service status",
+            lambda m: bot.cards.response("dashboard", service=Service(),
+                                         facts=[]),
+        )
+        bot.testing = True
+        resp = bot.test_client().post("/", data=MockTeamsAPI.incoming_msg(),
+                                      content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        sent = fake.sent[0]
+        self.assertEqual(sent["roomId"], "some_room_id")
+        self.assertEqual(sent["markdown"], "Status")
+        self.assertEqual(sent["attachments"][0]["content"]["body"][0]["text"],
+                         "Status of api")
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.client`."""
+
+import unittest
+from webexteamsbot.client import PooledHTTPAdapter, create_teams_api
+
+
+class ClientTests(unittest.TestCase):
+    def test_pool_settings(self):
+        api = create_teams_api("somefaketoken", pool_size=25, max_retries=3)
+        adapter = api._session._req_session.adapters["https://"]
+        self.assertIsInstance(adapter, PooledHTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, 25)
+        self.assertEqual(adapter.max_retries.total, 3)
+
+    def test_keep_alive_disabled(self):
+        api = create_teams_api("somefaketoken", keep_alive=False)
+        self.assertEqual(api._session.headers["Connection"], "close")
+
+    def test_base_url(self):
+        api = create_teams_api("somefaketoken",
+                               base_url="http://localhost:8080/v1/")
+        self.assertEqual(api.base_url, "http://localhost:8080/v1/")
+
+    def test_resolve_timeout(self):
+        adapter = PooledHTTPAdapter()
+        self.assertEqual(adapter.resolve_timeout(60), 60)
+        adapter = PooledHTTPAdapter(connect_timeout=3)
+        self.assertEqual(adapter.resolve_timeout(60), (3, 60))
+        adapter = PooledHTTPAdapter(connect_timeout=3, read_timeout=10)
+        self.assertEqual(adapter.resolve_timeout(60), (3, 10))
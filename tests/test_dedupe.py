@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.dedupe`."""
+
+import time
+import unittest
+from webexteamsbot.dedupe import DedupeCache, MemoryDedupeBackend
+
+
+def event(data_id, resource="messages", event="created"):
+    return {"resource": resource, "event": event, "data": {"id": data_id}}
+
+
+class DedupeTests(unittest.TestCase):
+    def test_duplicate_detected(self):
+        cache = DedupeCache()
+        self.assertFalse(cache.seen(event("a")))
+        self.assertTrue(cache.seen(event("a")))
+        self.assertFalse(cache.seen(event("a", event="deleted")))
+        self.assertFalse(cache.seen(event("a", resource="attachmentActions")))
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["hit_rate"], 0.25)
+
+    def test_invalid_payload_not_deduplicated(self):
+        cache = DedupeCache()
+        self.assertFalse(cache.seen({}))
+        self.assertFalse(cache.seen(None))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_ttl_expiry(self):
+        cache = DedupeCache(ttl=0.01)
+        cache.seen(event("a"))
+        time.sleep(0.02)
+        self.assertFalse(cache.seen(event("a")))
+
+    def test_lru_eviction(self):
+        backend = MemoryDedupeBackend(max_size=2)
+        cache = DedupeCache(backend=backend)
+        cache.seen(event("a"))
+        cache.seen(event("b"))
+        # Touch "a" so "b" is the least recently used
+        self.assertTrue(cache.seen(event("a")))
+        cache.seen(event("c"))
+        self.assertEqual(len(backend), 2)
+        self.assertEqual(backend.evictions, 1)
+        self.assertTrue(cache.seen(event("a")))
+        self.assertFalse(cache.seen(event("b")))
+
+    def test_forget(self):
+        cache = DedupeCache()
+        cache.seen(event("a"))
+        cache.forget(event("a"))
+        self.assertFalse(cache.seen(event("a")))
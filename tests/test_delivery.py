@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.delivery`."""
+
+import threading
+import time
+import unittest
+from webexteamsbot.delivery import DeliveryEngine, reply_payload
+from webexteamsbot.models import Response
+
+
+class DeliveryEngineTests(unittest.TestCase):
+    def test_order_kept_within_room(self):
+        sent = []
+        lock = threading.Lock()
+
+        def send(payload):
+            # Make earlier messages slower so reordering would show up
+            time.sleep(0.01 * (3 - payload["n"] % 3))
+            with lock:
+                sent.append((payload["roomId"], payload["n"]))
+            return payload["n"]
+
+        engine = DeliveryEngine(send, workers=3)
+        payloads = [{"roomId": "room%d" % (n % 3), "n": n} for n in range(9)]
+        results = engine.deliver(payloads)
+        engine.shutdown()
+
+        self.assertEqual([r.message for r in results], list(range(9)))
+        for room in ("room0", "room1", "room2"):
+            ns = [n for r, n in sent if r == room]
+            self.assertEqual(ns, sorted(ns))
+
+    def test_rooms_sent_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def send(payload):
+            # Only completes if both rooms are being sent at the same time
+            barrier.wait()
+            return "ok"
+
+        engine = DeliveryEngine(send, workers=2)
+        results = engine.deliver([{"roomId": "a"}, {"roomId": "b"}])
+        engine.shutdown()
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_failures_reported_and_rest_sent(self):
+        def send(payload):
+            if payload["text"] == "bad":
+                raise ValueError("rejected")
+            return payload["text"]
+
+        engine = DeliveryEngine(send)
+        results = engine.deliver([
+            {"roomId": "a", "text": "one"},
+            {"roomId": "a", "text": "bad"},
+            {"roomId": "a", "text": "three"},
+        ])
+        self.assertEqual([r.ok for r in results], [True, False, True])
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertEqual(engine.stats()["sent"], 2)
+        self.assertEqual(engine.stats()["failed"], 1)
+
+    def test_reply_payload(self):
+        r = Response.template(text="hi")
+        self.assertEqual(reply_payload(r, "here"),
+                         {"roomId": "here", "text": "hi"})
+        self.assertIsNone(r.roomId)
+        r = Response(text="hi", toPersonEmail="someone@example.com")
+        self.assertEqual(reply_payload(r, "here"),
+                         {"toPersonEmail": "someone@example.com",
+                          "text": "hi"})
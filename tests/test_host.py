@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.host`."""
+
+import time
+import unittest
+from webexteamsbot import webexteamsbot as webexteamsbot_module
+from webexteamsbot.host import BotHost
+from .fake_webex import FakeWebex
+from .teams_mock import MockTeamsAPI
+
+
+class BotHostTests(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeWebex(message_text="/name").start()
+        self.addCleanup(self.fake.stop)
+
+    def make_host(self, **kwargs):
+        kwargs.setdefault("teams_api_url", self.fake.base_url)
+        host = BotHost(**kwargs)
+        self.addCleanup(host.stop)
+        host.testing = True
+        return host
+
+    def add_bots(self, host, count):
+        bots = []
+        for i in range(count):
+            name = "Bot %d" % i
+            bot = host.add_bot(name, "token%d" % i, "bot%d@test.com" % i)
+            bot.add_command("/name", "Say the bot's name",
+                            lambda message, name=name: name)
+            bots.append(bot)
+        return bots
+
+    def post(self, host, path):
+        return host.test_client().post(path, data=MockTeamsAPI.incoming_msg(),
+                                       content_type="application/json")
+
+    def test_routes_by_path(self):
+        host = self.make_host(webhook_workers=0)
+        self.add_bots(host, 2)
+        self.assertEqual(self.post(host, "/bot-1").status_code, 200)
+        self.assertEqual(self.post(host, "/bot-0").status_code, 200)
+        self.assertEqual(self.post(host, "/nobody").status_code, 404)
+        self.assertEqual([m["markdown"] for m in self.fake.sent],
+                         ["Bot 1", "Bot 0"])
+        self.assertEqual(host.test_client().get("/health").status_code, 200)
+
+    def test_shared_resources(self):
+        host = self.make_host()
+        bots = self.add_bots(host, 3)
+        for bot in bots:
+            self.assertIs(bot.http_adapter, host.http_adapter)
+            self.assertIs(bot.work_queue.queue, host.work_queue)
+            self.assertIs(bot.outbound.shared_executor, host.send_executor)
+        for path in ("/bot-0", "/bot-2", "/bot-2"):
+            self.assertEqual(self.post(host, path).status_code, 200)
+        host.work_queue.join()
+        deadline = time.time() + 5
+        while len(self.fake.sent) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        # The second webhook to Bot 2 was a duplicate
+        self.assertEqual(sorted(m["markdown"] for m in self.fake.sent),
+                         ["Bot 0", "Bot 2"])
+        self.assertEqual(bots[2].dedupe.stats()["hits"], 1)
+        self.assertEqual(bots[0].work_queue.stats()["submitted"], 1)
+
+        # Requests are timed into the metrics of the bot making them
+        text = host.test_client().get("/metrics").get_data(as_text=True)
+        self.assertIn('webexteamsbot_host_bots 3', text)
+        self.assertIn('webexteamsbot_commands_total{command="/name",'
+                      'bot="Bot 2"} 1', text)
+        self.assertIn('call="messages.get",bot="Bot 0"', text)
+        self.assertNotIn('call="messages.get",bot="Bot 1"', text)
+        self.assertEqual(text.count("# TYPE webexteamsbot_commands_total"), 1)
+
+    def test_add_bot(self):
+        host = self.make_host(url="https://bots.example.com/")
+        bot = host.add_bot("Alpha", "token", "alpha@test.com",
+                           path="/teams/alpha")
+        self.assertEqual(bot.teams_bot_url,
+                         "https://bots.example.com/teams/alpha")
+        self.assertIs(host.bot_for_path("teams/alpha"), bot)
+        hooks = list(self.fake.webhooks.values())
+        self.assertEqual(hooks[0]["targetUrl"],
+                         "https://bots.example.com/teams/alpha")
+        for args in (("Alpha", "other", "a@test.com"),
+                     ("Beta", "other", "b@test.com", "teams/alpha"),
+                     ("Gamma", "token", "g@test.com")):
+            with self.assertRaises(ValueError):
+                host.add_bot(*args)
+        self.assertEqual(sorted(host.bots), ["Alpha"])
+
+    def test_bots_isolated(self):
+        host = self.make_host(url="https://bots.example.com")
+        first, second = self.add_bots(host, 2)
+        self.assertEqual(first.teams.access_token, "token0")
+        self.assertEqual(second.teams.access_token, "token1")
+        self.assertEqual([w.targetUrl for w in first.webhooks],
+                         ["https://bots.example.com/bot-0"])
+        self.assertEqual([w.targetUrl for w in second.webhooks],
+                         ["https://bots.example.com/bot-1"])
+        # Nothing is left in module globals for the next bot to overwrite
+        for name in ("teams", "teams_token", "bot_email", "webhook"):
+            self.assertFalse(hasattr(webexteamsbot_module, name))
+
+    def test_idle_dispatcher_exits(self):
+        host = self.make_host(webhook_workers=0, idle_timeout=0.05)
+        bot, = self.add_bots(host, 1)
+        bot.send_message(roomId="some_room_id", markdown="hello")
+        self.assertIsNotNone(bot.outbound._thread)
+        deadline = time.time() + 5
+        while bot.outbound._thread is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(bot.outbound._thread)
+        # and starts again for the next message
+        bot.send_message(roomId="some_room_id", markdown="again")
+        self.assertEqual(self.fake.sent[-1]["markdown"], "again")
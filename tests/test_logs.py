@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.logs`."""
+
+import io
+import json
+import logging
+import unittest
+import requests_mock
+from webexteamsbot import TeamsBot, logs
+from .teams_mock import MockTeamsAPI
+
+
+def record(msg, level=logging.INFO, **fields):
+    r = logging.LogRecord("webexteamsbot.test", level, __file__, 1, msg,
+                          None, None)
+    r.fields = fields
+    return r
+
+
+class StructuredFormatterTests(unittest.TestCase):
+    def test_text(self):
+        f = logs.StructuredFormatter()
+        line = f.format(record("Message received", room="abc",
+                               text="hi there", empty=""))
+        self.assertIn("INFO webexteamsbot.test: Message received", line)
+        self.assertTrue(line.endswith(' room=abc text="hi there" empty=""'))
+
+    def test_json(self):
+        f = logs.StructuredFormatter(json_lines=True)
+        data = json.loads(f.format(record("Command handled",
+                                          command="/echo", duration_ms=1.5)))
+        self.assertEqual(data["message"], "Command handled")
+        self.assertEqual(data["level"], "INFO")
+        self.assertEqual(data["logger"], "webexteamsbot.test")
+        self.assertEqual(data["command"], "/echo")
+        self.assertEqual(data["duration_ms"], 1.5)
+
+
+class EventLoggerTests(unittest.TestCase):
+    def setUp(self):
+        self.log = logs.get_logger("webexteamsbot.test")
+
+    def test_fields_and_binding(self):
+        sampler = logs.LogSampler()
+        with self.assertLogs("webexteamsbot.test", "DEBUG") as cm:
+            with sampler.event(event_id="e1"):
+                logs.bind(room="r1")
+                self.log.info("inside", command="/echo")
+            self.log.info("outside")
+        self.assertEqual(cm.records[0].fields,
+                         dict(event_id="e1", room="r1", command="/echo"))
+        self.assertEqual(cm.records[1].fields, {})
+
+    def test_sampling(self):
+        sampler = logs.LogSampler(rate=0.0)
+        with self.assertLogs("webexteamsbot.test", "DEBUG") as cm:
+            with sampler.event():
+                self.assertFalse(self.log.enabled(logging.INFO))
+                self.log.info("dropped")
+                self.log.warning("kept")
+        self.assertEqual([r.getMessage() for r in cm.records], ["kept"])
+        self.assertEqual(sampler.stats(),
+                         dict(rate=0.0, events=1, sampled=0))
+        with self.assertRaises(ValueError):
+            logs.LogSampler(rate=1.5)
+
+
+class BackgroundHandlerTests(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("webexteamsbot.test.background")
+        self.logger.propagate = False
+        self.addCleanup(setattr, self.logger, "propagate", True)
+
+    def test_writes_from_thread(self):
+        out = io.StringIO()
+        target = logging.StreamHandler(out)
+        target.setFormatter(logs.StructuredFormatter())
+        handler = logs.BackgroundHandler([target])
+        handler.start()
+        self.addCleanup(handler.stop)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+
+        log = logs.EventLogger(self.logger)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            log.exception("Failed %s", room="r1")
+        handler.flush()
+        text = out.getvalue()
+        self.assertIn("Failed %s room=r1", text)
+        self.assertIn("ZeroDivisionError", text)
+
+    def test_drops_when_full(self):
+        handler = logs.BackgroundHandler([logging.NullHandler()],
+                                         queue_size=2)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        for i in range(5):
+            self.logger.warning("message %d", i)
+        self.assertEqual(handler.stats(), dict(queued=2, dropped=3))
+
+
+class TeamsBotLoggingTests(unittest.TestCase):
+    @requests_mock.mock()
+    def setUp(self, m):
+        m.get("https://api.ciscospark.com/v1/webhooks",
+              json=MockTeamsAPI.list_webhooks())
+        m.post("https://api.ciscospark.com/v1/webhooks",
+               json=MockTeamsAPI.create_webhook())
+        self.bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_bot_url="http://fakebot.com",
+            teams_bot_email="test@test.com",
+            log_sample_rate=0.5,
+        )
+        self.addCleanup(self.bot.outbound.stop)
+        self.bot.testing = True
+        self.client = self.bot.test_client()
+
+    @requests_mock.mock()
+    def test_message_fields(self, m):
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        m.get("//api.ciscospark.com/v1/messages/incoming_message_id",
+              json=MockTeamsAPI.get_message_dosomething())
+        m.post("//api.ciscospark.com/v1/messages", json={})
+        self.bot.log_sampler.rate = 1.0
+
+        with self.assertLogs("webexteamsbot", "INFO") as cm:
+            self.client.post("/", data=MockTeamsAPI.incoming_msg(),
+                             content_type="application/json")
+        by_message = {r.getMessage(): r.fields for r in cm.records}
+        received = by_message["Message received"]
+        self.assertEqual(received["room"], "some_room_id")
+        self.assertEqual(received["person"], "matt@example.com")
+        handled = by_message["Command handled"]
+        self.assertEqual(handled["command"], "/echo")
+        self.assertIn("duration_ms", handled)
+        self.assertEqual(self.bot.log_sampler.stats()["sampled"], 1)
+
+    def test_unsampled_event(self):
+        self.bot.log_sampler.rate = 0.0
+        with requests_mock.mock() as m, \
+                self.assertLogs("webexteamsbot", "INFO") as cm:
+            m.get("//api.ciscospark.com/v1/people/me",
+                  json=MockTeamsAPI.me())
+            m.get("//api.ciscospark.com/v1/messages/incoming_message_id",
+                  json=MockTeamsAPI.get_message_dosomething())
+            m.post("//api.ciscospark.com/v1/messages", json={})
+            self.client.post("/", data=MockTeamsAPI.incoming_msg(),
+                             content_type="application/json")
+            logs.get_logger("webexteamsbot").warning("marker")
+        self.assertEqual([r.getMessage() for r in cm.records], ["marker"])
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.matcher`."""
+
+import random
+import unittest
+from webexteamsbot.matcher import CommandMatcher
+
+
+def sorted_scan(commands, text):
+    """The original per-message command lookup."""
+    for c in sorted(commands):
+        if text.lower().find(c) != -1:
+            return c
+    return None
+
+
+class CommandMatcherTests(unittest.TestCase):
+    # Both the scan used for few commands and the automaton
+    THRESHOLDS = (0, 100)
+
+    def test_first_sorted_command_wins(self):
+        for threshold in self.THRESHOLDS:
+            m = CommandMatcher(["/help", "/echo", "/time"], threshold)
+            self.assertEqual(m.match("/time and /echo"), "/echo")
+            self.assertEqual(m.match("please /help"), "/help")
+            self.assertIsNone(m.match("nothing here"))
+
+    def test_overlapping_commands(self):
+        for threshold in self.THRESHOLDS:
+            m = CommandMatcher(["/status", "/stat", "tat"], threshold)
+            self.assertEqual(m.match("/status"), "/stat")
+            self.assertEqual(m.match("/sta tat"), "tat")
+
+    def test_automaton_above_threshold(self):
+        self.assertIsNone(CommandMatcher(["/a", "/b"], threshold=2)._goto)
+        self.assertIsNotNone(CommandMatcher(["/a", "/b"], threshold=1)._goto)
+
+    def test_empty_matcher(self):
+        self.assertIsNone(CommandMatcher().match("/help"))
+
+    def test_matches_sorted_scan(self):
+        rnd = random.Random(1234)
+        alphabet = "/abc de"
+        for _ in range(200):
+            commands = set(
+                "".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 4)))
+                for _ in range(rnd.randint(1, 12))
+            )
+            matchers = [CommandMatcher(commands, threshold)
+                        for threshold in self.THRESHOLDS]
+            for _ in range(10):
+                text = "".join(
+                    rnd.choice(alphabet) for _ in range(rnd.randint(0, 20))
+                )
+                for m in matchers:
+                    self.assertEqual(m.match(text),
+                                     sorted_scan(commands, text))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.metrics`."""
+
+import json
+import unittest
+from webexteamsbot import TeamsBot
+from webexteamsbot.metrics import MetricsRegistry, api_call_name
+from .fake_webex import FakeWebex
+from .teams_mock import MockTeamsAPI
+
+
+class MetricsRegistryTests(unittest.TestCase):
+    def test_counter(self):
+        r = MetricsRegistry(prefix="test")
+        c = r.counter("hits_total", "Hits.", ("path",))
+        c.inc("/a")
+        c.inc("/a")
+        c.add(3, 'say "hi"\n')
+        self.assertEqual(c.value("/a"), 2)
+        text = r.render()
+        self.assertIn("# TYPE test_hits_total counter", text)
+        self.assertIn('test_hits_total{path="/a"} 2', text)
+        self.assertIn('test_hits_total{path="say \\"hi\\"\\n"} 3', text)
+
+    def test_histogram(self):
+        r = MetricsRegistry(prefix="test")
+        h = r.histogram("seconds", "Durations.", ("op",), buckets=(0.1, 1))
+        h.observe(0.05, "x")
+        h.observe(0.5, "x")
+        h.observe(5, "x")
+        with h.time("y"):
+            pass
+        self.assertEqual(h.count("x"), 3)
+        text = r.render()
+        self.assertIn('test_seconds_bucket{op="x",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{op="x",le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{op="x",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_sum{op="x"} 5.55', text)
+        self.assertIn('test_seconds_count{op="x"} 3', text)
+        self.assertIn('test_seconds_count{op="y"} 1', text)
+
+    def test_label_sets_capped(self):
+        r = MetricsRegistry(prefix="test")
+        c = r.counter("hits_total", "Hits.", ("path",))
+        c.max_series = 2
+        for i in range(5):
+            c.inc("/%d" % i)
+        self.assertEqual(c.value("/0"), 1)
+        self.assertEqual(c.value("other"), 3)
+
+    def test_collector(self):
+        r = MetricsRegistry(prefix="test")
+        r.collector("queue", lambda: {"depth": 3, "ok": True, "name": "x"})
+        r.collector("missing", lambda: None)
+        text = r.render()
+        self.assertIn("test_queue_depth 3", text)
+        self.assertIn("test_queue_ok 1", text)
+        self.assertNotIn("name", text)
+
+    def test_api_call_name(self):
+        base = "https://webexapis.com/v1/"
+        self.assertEqual(api_call_name("GET", base + "people/me"),
+                         "people.me")
+        self.assertEqual(api_call_name("GET", base + "messages/abc"),
+                         "messages.get")
+        self.assertEqual(api_call_name("GET", base + "messages?roomId=x"),
+                         "messages.list")
+        self.assertEqual(api_call_name("POST", base + "messages"),
+                         "messages.create")
+        self.assertEqual(api_call_name("PUT", base + "webhooks/abc"),
+                         "webhooks.update")
+        self.assertEqual(api_call_name("DELETE", base + "webhooks/abc"),
+                         "webhooks.delete")
+        self.assertEqual(api_call_name("GET", base + "attachment/actions/a"),
+                         "attachmentActions.get")
+
+
+class TeamsBotMetricsTests(unittest.TestCase):
+    def test_metrics_route(self):
+        fake = FakeWebex(message_text="/hello").start()
+        self.addCleanup(fake.stop)
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_url="http://fakebot.com",
+            teams_bot_email="test@test.com",
+        )
+        self.addCleanup(bot.outbound.stop)
+
+        def fail(incoming_msg):
+            raise RuntimeError("boom")
+
+        bot.add_command("/hello", "greeting", lambda m: "hi")
+        bot.testing = True
+        client = bot.test_client()
+        resp = client.post("/", data=MockTeamsAPI.incoming_msg(),
+                           content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+
+        bot.add_command("/hello", "greeting", fail)
+        post_data = json.loads(MockTeamsAPI.incoming_msg())
+        post_data["data"]["id"] = "another_message_id"
+        with self.assertRaises(RuntimeError):
+            client.post("/", data=json.dumps(post_data),
+                        content_type="application/json")
+
+        resp = client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn('webexteamsbot_webhooks_received_total'
+                      '{resource="messages",event="created"} 2', text)
+        self.assertIn('webexteamsbot_commands_total{command="/hello"} 2',
+                      text)
+        self.assertIn('webexteamsbot_command_duration_seconds_count'
+                      '{command="/hello"} 2', text)
+        self.assertIn('webexteamsbot_api_request_duration_seconds_count'
+                      '{call="messages.get"} 2', text)
+        self.assertIn('webexteamsbot_api_request_duration_seconds_count'
+                      '{call="messages.create"} 1', text)
+        self.assertIn('webexteamsbot_api_request_duration_seconds_count'
+                      '{call="people.me"} 1', text)
+        self.assertIn('webexteamsbot_errors_total{stage="command"} 1', text)
+        self.assertIn('webexteamsbot_errors_total{stage="event"} 1', text)
+        # Component counters
+        self.assertIn("webexteamsbot_outbound_sent 1", text)
+        self.assertIn("webexteamsbot_webhooks_created 1", text)
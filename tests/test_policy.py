@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.policy`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import requests_mock
+from webexteamssdk import WebexTeamsAPI
+from webexteamsbot.policy import ApprovalPolicy
+
+
+class ApprovalPolicyTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "approved.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_no_rules_approves_everyone(self):
+        policy = ApprovalPolicy()
+        self.assertFalse(policy.enabled)
+        self.assertTrue(policy.is_approved("anyone@example.com"))
+
+    def test_case_insensitive_emails(self):
+        policy = ApprovalPolicy(users=["JoSmith@Demo.local"])
+        self.assertTrue(policy.is_approved("josmith@demo.local"))
+        self.assertTrue("JOSMITH@DEMO.LOCAL" in policy)
+        self.assertFalse(policy.is_approved("other@demo.local"))
+        self.assertFalse(policy.is_approved(None))
+
+    def test_domain_rules(self):
+        policy = ApprovalPolicy(users=["*@Example.com"])
+        self.assertTrue(policy.is_approved("matt@example.com"))
+        self.assertFalse(policy.is_approved("matt@sub.example.com"))
+        self.assertFalse(policy.is_approved("example.com@evil.com"))
+
+    def test_file_hot_reload(self):
+        with open(self.path, "w") as f:
+            f.write("# approved users\nmatt@example.com\n\n")
+        policy = ApprovalPolicy(path=self.path, reload_interval=0)
+        self.assertTrue(policy.is_approved("matt@example.com"))
+        self.assertFalse(policy.is_approved("julie@example.com"))
+
+        with open(self.path, "w") as f:
+            f.write("julie@example.com\n")
+        # Make sure the modification time changes
+        os.utime(self.path, (0, 0))
+        self.assertTrue(policy.is_approved("julie@example.com"))
+        self.assertFalse(policy.is_approved("matt@example.com"))
+        self.assertEqual(policy.stats()["reloads"], 2)
+
+    def test_missing_file_denies(self):
+        policy = ApprovalPolicy(path=self.path)
+        self.assertFalse(policy.is_approved("matt@example.com"))
+
+    @requests_mock.mock()
+    def test_room_membership_cached(self, m):
+        def memberships(request, context):
+            if request.qs["personemail"] == ["matt@example.com"]:
+                return {"items": [{"id": "membership"}]}
+            return {"items": []}
+
+        lookups = m.get("https://api.ciscospark.com/v1/memberships",
+                        json=memberships)
+        teams = WebexTeamsAPI(access_token="somefaketoken")
+        policy = ApprovalPolicy(rooms=["approved_room"], teams=teams)
+        for _ in range(3):
+            self.assertTrue(policy.is_approved("matt@example.com"))
+            self.assertFalse(policy.is_approved("julie@example.com"))
+        self.assertEqual(lookups.call_count, 2)
+        self.assertEqual(policy.stats()["membership_cache_hits"], 4)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.polling`."""
+
+import unittest
+from webexteamssdk import WebexTeamsAPI
+from webexteamsbot import TeamsBot
+from webexteamsbot.polling import MessagePoller
+from .fake_webex import FakeWebex
+
+
+class MessagePollerTests(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeWebex().start()
+        self.addCleanup(self.fake.stop)
+        self.teams = WebexTeamsAPI("somefaketoken",
+                                   base_url=self.fake.base_url)
+        self.handled = []
+
+    def handler(self, post_data, message):
+        self.handled.append((post_data, message))
+
+    def texts(self):
+        return [m.text for _, m in self.handled]
+
+    def test_discovers_active_rooms(self):
+        self.fake.add_message("room_a", "before polling")
+        self.fake.add_room("room_b")
+        poller = MessagePoller(self.teams, self.handler)
+        # The first cycle records the starting point only
+        self.assertEqual(poller.poll_once(), 2.0)
+        self.assertEqual(self.handled, [])
+
+        self.fake.add_message("room_a", "one")
+        self.fake.add_message("room_a", "two")
+        self.fake.add_message("room_b", "three")
+        poller.poll_once()
+        self.assertEqual(sorted(self.texts()), ["one", "three", "two"])
+        post_data, message = self.handled[0]
+        self.assertEqual(post_data["resource"], "messages")
+        self.assertEqual(post_data["data"]["id"], message.id)
+        # Messages within a room are handed over oldest first
+        room_a = [m.text for _, m in self.handled if m.roomId == "room_a"]
+        self.assertEqual(room_a, ["one", "two"])
+
+        # Nothing new: only the rooms list is fetched
+        calls = poller.message_list_calls
+        poller.poll_once()
+        self.assertEqual(poller.message_list_calls, calls)
+        self.assertEqual(len(self.handled), 3)
+
+    def test_idle_backoff(self):
+        poller = MessagePoller(self.teams, self.handler, min_interval=1,
+                               max_interval=5)
+        waits = [poller.poll_once() for _ in range(5)]
+        self.assertEqual(waits, [2, 4, 5, 5, 5])
+        self.fake.add_message("room_a", "wake up")
+        self.assertEqual(poller.poll_once(), 1)
+        self.assertEqual(self.texts(), ["wake up"])
+        self.assertEqual(poller.stats()["idle_cycles"], 5)
+
+    def test_max_room_polls(self):
+        poller = MessagePoller(self.teams, self.handler, max_room_polls=2)
+        poller.poll_once()
+        for i in range(5):
+            self.fake.add_message("room_%d" % i, "hi %d" % i)
+        poller.poll_once()
+        self.assertEqual(len(self.handled), 2)
+        self.assertEqual(poller.stats()["pending"], 3)
+        poller.poll_once()
+        poller.poll_once()
+        self.assertEqual(len(self.handled), 5)
+        self.assertEqual(poller.stats()["pending"], 0)
+
+    def test_explicit_rooms(self):
+        self.fake.add_message("room_a", "old")
+        self.fake.add_room("room_b", room_type="direct")
+        poller = MessagePoller(self.teams, self.handler,
+                               rooms=["room_a", "room_b"], min_interval=1,
+                               max_interval=8)
+        poller.poll_once()
+        self.assertEqual(self.handled, [])
+        self.assertEqual(poller.stats()["room_lookups"], 2)
+
+        self.fake.add_message("room_b", "new")
+        poller._rooms["room_b"].due = 0
+        poller.poll_once()
+        self.assertEqual(self.texts(), ["new"])
+        # room_a stayed idle and backs off, room_b is polled again soon
+        self.assertEqual(poller._rooms["room_a"].interval, 2)
+        self.assertEqual(poller._rooms["room_b"].interval, 1)
+
+    def test_handler_errors_do_not_stop_polling(self):
+        def handler(post_data, message):
+            raise RuntimeError("boom")
+
+        poller = MessagePoller(self.teams, handler)
+        poller.poll_once()
+        self.fake.add_message("room_a", "one")
+        poller.poll_once()
+        self.fake.add_message("room_a", "two")
+        poller.poll_once()
+        self.assertEqual(poller.stats()["errors"], 2)
+        self.assertEqual(poller.stats()["messages"], 2)
+
+    def test_burst_paged_back_to_mark(self):
+        poller = MessagePoller(self.teams, self.handler, max_messages=25)
+        self.fake.add_message("room_a", "before polling")
+        poller.poll_once()
+        for i in range(60):
+            self.fake.add_message("room_a", "m%d" % i)
+        self.assertEqual(poller.poll_once(), 1.0)
+        self.assertEqual(self.texts(), ["m%d" % i for i in range(60)])
+        self.assertEqual(poller.stats()["message_list_calls"], 3)
+        self.assertEqual(poller.stats()["messages_skipped"], 0)
+
+    def test_backlog_beyond_max_backlog_skipped(self):
+        poller = MessagePoller(self.teams, self.handler, max_messages=25,
+                               max_backlog=50)
+        self.fake.add_message("room_a", "before polling")
+        poller.poll_once()
+        for i in range(60):
+            self.fake.add_message("room_a", "m%d" % i)
+        poller.poll_once()
+        self.assertEqual(self.texts(), ["m%d" % i for i in range(10, 60)])
+        self.assertEqual(poller.stats()["messages_skipped"], 10)
+        # The mark moved past the skipped messages too
+        poller.poll_once()
+        self.assertEqual(len(self.handled), 50)
+
+
+class TeamsBotPollingTests(unittest.TestCase):
+    def test_polled_messages_are_answered(self):
+        fake = FakeWebex().start()
+        self.addCleanup(fake.stop)
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_email="test@test.com",
+        )
+        self.addCleanup(bot.outbound.stop)
+        self.assertIsNone(bot.webhooks)
+        self.assertEqual(fake.requests[("GET", "webhooks")], 0)
+
+        bot.add_command("/hello", "greeting", lambda m: "Hi " + m.text)
+        poller = MessagePoller(bot.teams, bot.process_polled_message)
+        poller.poll_once()
+        fake.add_message("room_a", "/hello there")
+        poller.poll_once()
+        self.assertEqual(len(fake.sent), 1)
+        self.assertEqual(fake.sent[0]["roomId"], "room_a")
+        self.assertEqual(fake.sent[0]["markdown"], "Hi /hello there")
+        # Messages are not fetched again
+        self.assertEqual(fake.requests[("GET", "messages")], 1)
+
+        # The bot's own reply is seen as room activity but not answered
+        poller.poll_once()
+        self.assertEqual(len(fake.sent), 1)
+        self.assertEqual(bot.identity.stats()["api_calls"], 1)
+
+        # A webhook for the same message is a duplicate
+        message_id = [i for i, m in fake.messages.items()
+                      if m.get("text") == "/hello there"][0]
+        post_data = {"resource": "messages", "event": "created",
+                     "data": {"id": message_id, "roomId": "room_a"}}
+        self.assertEqual(bot.process_polled_message(post_data, None),
+                         "Duplicate")
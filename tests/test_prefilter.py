@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.prefilter`."""
+
+import json
+import unittest
+from webexteamsbot.policy import ApprovalPolicy
+from webexteamsbot.prefilter import EventFilter, sign
+from .teams_mock import MockTeamsAPI
+
+
+class FakeIdentity(object):
+    def is_self(self, person_id):
+        return person_id == "bot_id"
+
+
+class FakeMemberships(object):
+    def __init__(self):
+        self.lookups = 0
+
+    def list(self, roomId, personEmail):
+        self.lookups += 1
+        return []
+
+
+class FakeTeams(object):
+    def __init__(self):
+        self.memberships = FakeMemberships()
+
+
+class EventFilterTests(unittest.TestCase):
+    def setUp(self):
+        self.filter = EventFilter(
+            identity=FakeIdentity(),
+            approval=ApprovalPolicy(users=["*@example.com"]),
+        )
+
+    def payload(self, **data):
+        post_data = json.loads(MockTeamsAPI.incoming_msg())
+        post_data["data"].update(data)
+        return post_data
+
+    def test_reasons(self):
+        self.assertIsNone(self.filter.check(self.payload()))
+        self.assertEqual(self.filter.check(self.payload(personId="bot_id")),
+                         "self")
+        self.assertEqual(
+            self.filter.check(self.payload(personEmail="eve@evil.com")),
+            "unapproved",
+        )
+        stats = self.filter.stats()
+        self.assertEqual(stats["checked"], 3)
+        self.assertEqual(stats["passed"], 1)
+        self.assertEqual(stats["fetches_avoided"], 2)
+
+    def test_undecidable_payloads_pass(self):
+        post_data = self.payload()
+        del post_data["data"]["personEmail"]
+        del post_data["data"]["personId"]
+        self.assertIsNone(self.filter.check(post_data))
+        self.assertIsNone(self.filter.check(None))
+        self.assertIsNone(self.filter.check({"resource": "memberships",
+                                             "data": {"personId": "bot_id"}}))
+
+    def test_signature(self):
+        self.filter.secret = "s3cret"
+        body = MockTeamsAPI.incoming_msg().encode("utf-8")
+        post_data = json.loads(body)
+        good = sign("s3cret", body)
+        self.assertIsNone(self.filter.check(post_data, body, good))
+        self.assertIsNone(self.filter.check(post_data, body, good.upper()))
+        self.assertEqual(self.filter.check(post_data, body, None),
+                         "signature")
+        self.assertEqual(self.filter.check(post_data, body + b" ", good),
+                         "signature")
+        self.assertEqual(self.filter.stats()["rejected_signature"], 2)
+
+    def test_room_membership_not_looked_up(self):
+        teams = FakeTeams()
+        policy = ApprovalPolicy(users=["*@example.com"], rooms=["room"],
+                                teams=teams)
+        event_filter = EventFilter(approval=policy)
+        post_data = self.payload(personEmail="eve@evil.com")
+        # Left for the worker, which looks the membership up
+        self.assertIsNone(event_filter.check(post_data))
+        self.assertEqual(teams.memberships.lookups, 0)
+        self.assertFalse(policy.is_approved("eve@evil.com"))
+        self.assertEqual(teams.memberships.lookups, 1)
+        # Rejected from the cached result from then on
+        self.assertEqual(event_filter.check(post_data), "unapproved")
+        self.assertEqual(teams.memberships.lookups, 1)
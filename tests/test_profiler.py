@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.profiler`."""
+
+import json
+import marshal
+import time
+import unittest
+import requests_mock
+from webexteamsbot import TeamsBot
+from webexteamsbot.profiler import Profiler
+from .teams_mock import MockTeamsAPI
+
+
+def busy_work(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilerTests(unittest.TestCase):
+    def setUp(self):
+        self.profiler = Profiler(interval=0.001)
+        self.addCleanup(self.profiler.stop)
+
+    def test_off_by_default(self):
+        with self.profiler.event(), self.profiler.run_command("/a"):
+            busy_work(0.01)
+        self.assertEqual(self.profiler.status()["profiled"], 0)
+
+    def test_named_command(self):
+        self.profiler.start(command="/slow")
+        with self.profiler.run_command("/fast"):
+            busy_work(0.01)
+        with self.profiler.run_command("/slow"):
+            busy_work(0.05)
+        status = self.profiler.status()
+        self.assertEqual(status["profiled"], 1)
+        self.assertGreater(status["samples"], 0)
+
+        lines = self.profiler.collapsed().splitlines()
+        self.assertTrue(any("busy_work (test_profiler.py" in line
+                            for line in lines))
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn("busy_work", self.profiler.pstats_text())
+        stats = marshal.loads(self.profiler.pstats_dump())
+        self.assertTrue(any(func[2] == "busy_work" for func in stats))
+
+        self.profiler.reset()
+        self.assertEqual(self.profiler.collapsed(), "")
+        self.assertEqual(self.profiler.status()["profiled"], 0)
+
+    def test_sample_rate(self):
+        self.profiler.start(sample_rate=1.0)
+        with self.profiler.event():
+            # Nested contexts record the event once
+            with self.profiler.run_command("/x"):
+                busy_work(0.01)
+        self.profiler.start(sample_rate=0.0)
+        with self.profiler.event():
+            pass
+        self.assertEqual(self.profiler.status()["profiled"], 1)
+        with self.assertRaises(ValueError):
+            self.profiler.start(sample_rate=2)
+
+    def test_stop(self):
+        self.profiler.start(sample_rate=1.0)
+        self.profiler.stop()
+        with self.profiler.event():
+            pass
+        status = self.profiler.status()
+        self.assertFalse(status["enabled"])
+        self.assertEqual(status["profiled"], 0)
+
+
+class TeamsBotProfileRouteTests(unittest.TestCase):
+    @requests_mock.mock()
+    def setUp(self, m):
+        m.get("https://api.ciscospark.com/v1/webhooks",
+              json=MockTeamsAPI.list_webhooks())
+        m.post("https://api.ciscospark.com/v1/webhooks",
+               json=MockTeamsAPI.create_webhook())
+        self.bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_bot_url="http://fakebot.com",
+            teams_bot_email="test@test.com",
+            profiler_token="letmein",
+        )
+        self.addCleanup(self.bot.profiler.stop)
+        self.addCleanup(self.bot.outbound.stop)
+        self.bot.testing = True
+        self.client = self.bot.test_client()
+        self.auth = {"Authorization": "Bearer letmein"}
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get("/profile").status_code, 401)
+        resp = self.client.get("/profile",
+                               headers={"Authorization": "Bearer nope"})
+        self.assertEqual(resp.status_code, 401)
+
+    @requests_mock.mock()
+    def test_profile_command(self, m):
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        m.get("//api.ciscospark.com/v1/messages/incoming_message_id",
+              json=MockTeamsAPI.get_message_dosomething())
+        m.post("//api.ciscospark.com/v1/messages", json={})
+        self.bot.add_command("/echo", "busy",
+                             lambda msg: busy_work(0.05) or "done")
+
+        resp = self.client.post("/profile", headers=self.auth,
+                                data=json.dumps({"command": "/echo",
+                                                 "interval": 0.001}),
+                                content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(json.loads(resp.data)["enabled"])
+
+        self.client.post("/", data=MockTeamsAPI.incoming_msg(),
+                         content_type="application/json")
+        resp = self.client.get("/profile", headers=self.auth)
+        self.assertIn(b"busy_work", resp.data)
+        resp = self.client.get("/profile?format=pstats", headers=self.auth)
+        self.assertIn(b"busy_work", resp.data)
+        resp = self.client.get("/profile?format=pstats&sort=nope",
+                               headers=self.auth)
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get("/profile?format=raw", headers=self.auth)
+        self.assertEqual(resp.content_type, "application/octet-stream")
+
+        resp = self.client.post("/profile", headers=self.auth,
+                                data=json.dumps({"enabled": False}),
+                                content_type="application/json")
+        self.assertFalse(json.loads(resp.data)["enabled"])
+        resp = self.client.delete("/profile", headers=self.auth)
+        self.assertEqual(json.loads(resp.data)["profiled"], 0)
+
+    def test_route_needs_token_configured(self):
+        with requests_mock.mock() as m:
+            m.get("https://api.ciscospark.com/v1/webhooks",
+                  json=MockTeamsAPI.list_webhooks())
+            m.post("https://api.ciscospark.com/v1/webhooks",
+                   json=MockTeamsAPI.create_webhook())
+            bot = TeamsBot("testbot", teams_bot_token="somefaketoken",
+                           teams_bot_url="http://fakebot.com",
+                           teams_bot_email="test@test.com")
+        bot.testing = True
+        resp = bot.test_client().get("/profile")
+        self.assertEqual(resp.status_code, 404)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.ratelimit`."""
+
+import threading
+import time
+import unittest
+from webexteamsbot.ratelimit import (
+    OutboundScheduler,
+    SendShed,
+    TokenBucket,
+    retry_after,
+)
+
+
+class FakeRateLimit(Exception):
+    def __init__(self, seconds):
+        super(FakeRateLimit, self).__init__("429")
+        self.retry_after = seconds
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(10, 2, now=0.0)
+        for _ in range(2):
+            self.assertEqual(bucket.delay(0.0), 0.0)
+            bucket.consume(0.0)
+        self.assertAlmostEqual(bucket.delay(0.0), 0.1)
+        self.assertEqual(bucket.delay(0.1), 0.0)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(FakeRateLimit(3)), 3.0)
+        self.assertIsNone(retry_after(ValueError()))
+
+
+class OutboundSchedulerTests(unittest.TestCase):
+    def test_sends_and_returns_result(self):
+        s = OutboundScheduler(lambda p: p["text"].upper())
+        self.assertEqual(s.send({"roomId": "a", "text": "hi"}), "HI")
+        s.stop()
+        self.assertEqual(s.stats()["sent"], 1)
+
+    def test_global_rate(self):
+        s = OutboundScheduler(lambda p: None, rate=50, burst=1)
+        start = time.monotonic()
+        futures = [s.submit({"roomId": str(i)}) for i in range(6)]
+        for f in futures:
+            f.result(5)
+        s.stop()
+        # The first send uses the burst, the other five wait 1/50s each
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        self.assertGreater(s.stats()["throttled_time"], 0)
+
+    def test_retry_after_429_keeps_room_order(self):
+        sent = []
+        failures = [FakeRateLimit(0.05)]
+
+        def send(payload):
+            if payload["n"] == 0 and failures:
+                raise failures.pop()
+            sent.append(payload["n"])
+            return payload["n"]
+
+        s = OutboundScheduler(send)
+        futures = [s.submit({"roomId": "a", "n": n}) for n in range(3)]
+        start = time.monotonic()
+        self.assertEqual([f.result(5) for f in futures], [0, 1, 2])
+        s.stop()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+        self.assertEqual(sent, [0, 1, 2])
+        stats = s.stats()
+        self.assertEqual(stats["rate_limited"], 1)
+        self.assertEqual(stats["retries"], 1)
+
+    def test_gives_up_after_max_retries(self):
+        def send(payload):
+            raise FakeRateLimit(0.01)
+
+        s = OutboundScheduler(send, max_retries=1)
+        with self.assertRaises(FakeRateLimit):
+            s.send({"roomId": "a"}, timeout=5)
+        s.stop()
+        self.assertEqual(s.stats()["failed"], 1)
+
+    def test_shed_when_full(self):
+        release = threading.Event()
+        s = OutboundScheduler(lambda p: release.wait(5), max_queue=1)
+        first = s.submit({"roomId": "a", "text": "1"})
+        # Wait for the first message to be picked up
+        while s.stats()["queued"]:
+            time.sleep(0.001)
+        second = s.submit({"roomId": "a", "text": "2"})
+        third = s.submit({"roomId": "a", "text": "3"})
+        self.assertIsInstance(third.exception(5), SendShed)
+        release.set()
+        first.result(5)
+        second.result(5)
+        s.stop()
+        self.assertEqual(s.stats()["shed"], 1)
+
+    def test_coalesce_when_full(self):
+        release = threading.Event()
+        sent = []
+
+        def send(payload):
+            release.wait(5)
+            sent.append(payload["markdown"])
+
+        s = OutboundScheduler(send, max_queue=1, overflow="coalesce")
+        s.submit({"roomId": "a", "markdown": "1"})
+        while s.stats()["queued"]:
+            time.sleep(0.001)
+        second = s.submit({"roomId": "a", "markdown": "2"})
+        third = s.submit({"roomId": "a", "markdown": "3"})
+        self.assertIs(second, third)
+        release.set()
+        third.result(5)
+        s.stop()
+        self.assertEqual(sent, ["1", "2\n\n3"])
+        self.assertEqual(s.stats()["coalesced"], 1)
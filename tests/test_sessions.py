@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.sessions`."""
+
+import json
+import time
+import unittest
+from webexteamsbot import TeamsBot
+from webexteamsbot.sessions import (MemorySessionBackend, SessionStore,
+                                    StateSessionBackend)
+from webexteamsbot.state import MemoryStateBackend
+from .fake_webex import FakeWebex
+
+
+class SessionStoreTests(unittest.TestCase):
+    def test_save_and_end(self):
+        store = SessionStore()
+        session = store.get("room", "person")
+        self.assertEqual(session, {})
+        with session:
+            session["step"] = 1
+        self.assertEqual(store.get("room", "person"), {"step": 1})
+        # Per person and per room sessions are separate
+        self.assertEqual(store.get("room", "other"), {})
+        self.assertEqual(store.get("room"), {})
+
+        # Not saved when the block fails
+        with self.assertRaises(RuntimeError):
+            with store.get("room", "person") as session:
+                session["step"] = 2
+                raise RuntimeError("boom")
+        self.assertEqual(store.get("room", "person")["step"], 1)
+
+        store.get("room", "person").end()
+        self.assertEqual(len(store.backend), 0)
+        stats = store.stats()
+        self.assertEqual((stats["hits"], stats["saves"]), (4, 1))
+
+    def test_ttl(self):
+        store = SessionStore(ttl=0.05)
+        with store.get("room") as session:
+            session["step"] = 1
+        time.sleep(0.06)
+        self.assertEqual(store.get("room"), {})
+        self.assertEqual(store.stats()["expirations"], 1)
+
+    def test_limits(self):
+        backend = MemorySessionBackend(max_sessions=2, max_bytes=40)
+        backend.save("a", '{"n":1}', 60)
+        backend.save("b", '{"n":2}', 60)
+        backend.load("a")
+        backend.save("c", '{"n":3}', 60)
+        # b was the least recently used
+        self.assertIsNone(backend.load("b"))
+        self.assertEqual(backend.bytes, 14)
+        backend.save("d", '{"text":"%s"}' % ("x" * 20), 60)
+        # Over the memory limit, so a is evicted too
+        self.assertEqual(list(backend._entries), ["c", "d"])
+        self.assertEqual(backend.bytes, 38)
+        self.assertEqual(backend.evictions, 2)
+
+    def test_state_backend(self):
+        state = MemoryStateBackend()
+        first = SessionStore(StateSessionBackend(state))
+        second = SessionStore(StateSessionBackend(state))
+        with first.get("room", "person") as session:
+            session["items"] = ["a", "b"]
+        self.assertEqual(second.get("room", "person"), {"items": ["a", "b"]})
+        self.assertEqual(json.loads(state.get("session:room:person")),
+                         {"items": ["a", "b"]})
+
+
+class TeamsBotSessionTests(unittest.TestCase):
+    def test_multi_step_command(self):
+        fake = FakeWebex().start()
+        self.addCleanup(fake.stop)
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_email="test@test.com",
+            session_ttl=60,
+        )
+        self.addCleanup(bot.outbound.stop)
+
+        def delete(message):
+            with bot.session(message) as session:
+                session["confirm"] = "delete"
+            return "Are you sure?  Reply /yes"
+
+        def yes(message):
+            session = bot.session(message)
+            action = session.get("confirm")
+            session.end()
+            return "Done: %s" % action if action else "Nothing to confirm"
+
+        bot.add_command("/delete", "Delete", delete)
+        bot.add_command("/yes", "Confirm", yes)
+        for text in ("/delete", "/yes", "/yes"):
+            message = fake.add_message("some_room_id", text)
+            bot.process_event({"resource": "messages", "event": "created",
+                               "data": {"id": message["id"],
+                                        "roomId": "some_room_id",
+                                        "personId": "some_person_id"}})
+        self.assertEqual([m["markdown"] for m in fake.sent],
+                         ["Are you sure?  Reply /yes", "Done: delete",
+                          "Nothing to confirm"])
+        self.assertIn("webexteamsbot_sessions_size 0",
+                      bot.metrics.registry.render())
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.state`."""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from webexteamsbot import TeamsBot
+from webexteamsbot.ratelimit import OutboundScheduler, SharedTokenBucket
+from webexteamsbot.state import (MemoryStateBackend, RedisStateBackend,
+                                 SQLiteStateBackend, StateError,
+                                 state_backend)
+from .fake_redis import FakeRedis, _Error as RedisError
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+from .fake_webex import FakeWebex
+from .teams_mock import MockTeamsAPI
+
+
+class BackendContract(object):
+    """Behaviour every StateBackend has."""
+
+    def make_backend(self, prefix=""):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.state = self.make_backend(prefix="bot:")
+        self.addCleanup(self.state.close)
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.state.get("k"))
+        self.state.set("k", {"a": [1, 2]})
+        self.assertEqual(self.state.get("k"), {"a": [1, 2]})
+        self.state.delete("k")
+        self.assertIsNone(self.state.get("k"))
+        self.state.delete("k")
+
+    def test_ttl(self):
+        self.state.set("k", "v", ttl=0.05)
+        self.assertTrue(self.state.add("once", 1, ttl=0.05))
+        self.assertFalse(self.state.add("once", 2, ttl=0.05))
+        self.assertEqual(self.state.get("once"), 1)
+        time.sleep(0.1)
+        self.assertIsNone(self.state.get("k"))
+        self.assertTrue(self.state.add("once", 3))
+
+    def test_incr(self):
+        self.assertEqual(self.state.incr("n"), 1)
+        self.assertEqual(self.state.incr("n", 5), 6)
+        self.assertEqual(self.state.get("n"), 6)
+        self.assertEqual(self.state.incr("temp", ttl=0.05), 1)
+        time.sleep(0.1)
+        self.assertEqual(self.state.incr("temp", ttl=0.05), 1)
+
+    def test_bucket(self):
+        self.assertEqual(self.state.bucket("b", 2, 2), 1)
+        self.assertLess(self.state.bucket("b", 2, 2), 0.5)
+        tokens = self.state.bucket("b", 2, 2)
+        self.assertLess(tokens, 0)
+        time.sleep(0.5)
+        self.assertGreaterEqual(self.state.bucket("b", 2, 2, take=0),
+                                tokens + 0.9)
+        self.assertLessEqual(self.state.bucket("b", 2, 2, take=0), 2)
+
+    def test_prefix(self):
+        other = self.make_backend(prefix="other:")
+        self.addCleanup(other.close)
+        self.state.set("k", 1)
+        self.assertIsNone(other.get("k"))
+
+    def test_concurrent_updates(self):
+        def work():
+            for _ in range(50):
+                self.state.incr("n")
+                self.state.bucket("b", 1, 1000)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.state.get("n"), 200)
+        self.assertLess(self.state.bucket("b", 1, 1000, take=0), 801)
+
+
+class MemoryStateBackendTests(BackendContract, unittest.TestCase):
+    def make_backend(self, prefix=""):
+        return MemoryStateBackend(prefix=prefix)
+
+    def test_size_limit(self):
+        state = MemoryStateBackend(max_size=2)
+        state.set("a", 1)
+        state.set("b", 2)
+        state.get("a")
+        state.set("c", 3)
+        self.assertIsNone(state.get("b"))
+        self.assertEqual(state.stats()["evictions"], 1)
+
+
+def _sqlite_worker(path, results):
+    state = SQLiteStateBackend(path, prefix="bot:")
+    added = 0
+    for i in range(100):
+        state.incr("n")
+        if state.add("event:%d" % i, os.getpid(), ttl=60):
+            added += 1
+    results.put(added)
+    state.close()
+
+
+class SQLiteStateBackendTests(BackendContract, unittest.TestCase):
+    def make_backend(self, prefix=""):
+        if not hasattr(self, "tmp"):
+            self.tmp = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, self.tmp)
+        return SQLiteStateBackend(os.path.join(self.tmp, "state.db"),
+                                  prefix=prefix)
+
+    def test_processes(self):
+        path = os.path.join(self.tmp, "state.db")
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_sqlite_worker,
+                                         args=(path, results))
+                 for _ in range(4)]
+        for p in procs:
+            p.start()
+        added = [results.get(timeout=30) for _ in procs]
+        for p in procs:
+            p.join()
+        self.assertEqual(self.state.get("n"), 400)
+        # Each event was claimed by exactly one process
+        self.assertEqual(sum(added), 100)
+        self.assertEqual(len(self.state), 101)
+
+
+@unittest.skipIf(redis is None, "redis is not installed")
+class RedisStateBackendTests(BackendContract, unittest.TestCase):
+    def make_backend(self, prefix=""):
+        if not hasattr(self, "server"):
+            self.server = FakeRedis(password="secret").start()
+            self.addCleanup(self.server.stop)
+        return RedisStateBackend(self.server.url, prefix=prefix)
+
+    def test_pooled_connections(self):
+        for i in range(20):
+            self.state.set("k%d" % i, i)
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_bucket_conflict_retried(self):
+        state = self.state
+        run = self.server.run
+
+        def run_conflicting(conn, name, args):
+            reply = run(conn, name, args)
+            if name == "WATCH" and not state.conflicts:
+                # Another process changes the bucket before EXEC
+                self.server.versions["bot:b"] = -1
+            return reply
+
+        self.server.run = run_conflicting
+        self.assertEqual(state.bucket("b", 1, 5), 4)
+        self.assertEqual(state.stats()["conflicts"], 1)
+
+    def test_errors(self):
+        with self.assertRaises(StateError):
+            RedisStateBackend(
+                "redis://:wrong@127.0.0.1:%d/0" % self.server.port
+            ).get("k")
+        self.state.set("text", "abc")
+        with self.assertRaises(StateError):
+            self.state.incr("text")
+        # The connection is still usable
+        self.assertEqual(self.state.get("text"), "abc")
+
+        server = FakeRedis().start()
+        state = RedisStateBackend(server.url, timeout=1)
+        state.set("k", 1)
+        server.stop()
+        with self.assertRaises(StateError):
+            state.get("k")
+        self.assertEqual(state.stats()["errors"], 1)
+
+    def test_bucket_errors_keep_pool(self):
+        run = self.server.run
+
+        def run_failing(conn, name, args):
+            if name == "GET" and args[0] == "bot:broken":
+                raise RedisError("WRONGTYPE")
+            return run(conn, name, args)
+
+        self.server.run = run_failing
+        self.state.get("k")
+        with self.assertRaises(StateError):
+            self.state.bucket("broken", 1, 5)
+        # The connection went back to the pool, unwatched
+        self.assertIn("UNWATCH", self.server.commands)
+        self.assertEqual(self.state.bucket("b", 1, 5), 4)
+
+        # So does it after a corrupt bucket
+        self.state.set("corrupt", "not a bucket")
+        with self.assertRaises(StateError):
+            self.state.bucket("corrupt", 1, 5)
+        self.assertEqual(self.state.get("corrupt"), "not a bucket")
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(self.state.stats()["errors"], 2)
+
+    def test_url(self):
+        self.assertIsInstance(state_backend("memory://"), MemoryStateBackend)
+        redis = state_backend("redis://h:1234/2")
+        self.assertEqual((redis.host, redis.port, redis.db), ("h", 1234, 2))
+        with self.assertRaises(ValueError):
+            state_backend("ftp://nope")
+
+
+class SharedStateBotTests(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeWebex(message_text="/echo hi").start()
+        self.addCleanup(self.fake.stop)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def make_bot(self):
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=self.fake.base_url,
+            teams_bot_email="test@test.com",
+            state_backend="sqlite:///" + os.path.join(self.tmp, "bot.db"),
+        )
+        self.addCleanup(bot.outbound.stop)
+        self.addCleanup(bot.state.close)
+        bot.testing = True
+        return bot
+
+    def test_workers_share_state(self):
+        # Two workers of the same bot
+        first = self.make_bot()
+        second = self.make_bot()
+        for bot in (first, second):
+            resp = bot.test_client().post(
+                "/", data=MockTeamsAPI.incoming_msg(),
+                content_type="application/json",
+            )
+            self.assertEqual(resp.status_code, 200)
+        # The redelivered webhook was only handled once
+        self.assertEqual(len(self.fake.sent), 1)
+        self.assertEqual(second.dedupe.stats()["hits"], 1)
+        # and only one worker looked up the bot's identity
+        first.identity.get()
+        second.identity.get()
+        self.assertEqual(first.identity.api_calls +
+                         second.identity.api_calls, 1)
+        self.assertEqual(second.identity.id, "bot_person_id")
+        self.assertIn("webexteamsbot_state_operations",
+                      second.metrics.registry.render())
+
+
+class SharedRateLimitTests(unittest.TestCase):
+    def test_schedulers_share_limit(self):
+        state = MemoryStateBackend()
+        sent = []
+        schedulers = [
+            OutboundScheduler(lambda p: sent.append(time.monotonic()),
+                              rate=20, burst=1, state=state)
+            for _ in range(2)
+        ]
+        for s in schedulers:
+            self.addCleanup(s.stop)
+        self.assertIsInstance(schedulers[0]._bucket, SharedTokenBucket)
+        start = time.monotonic()
+        futures = [s.submit({"roomId": "r%d" % i})
+                   for i in range(5) for s in schedulers]
+        for f in futures:
+            f.result(5)
+        # 10 messages at 20 per second between both schedulers, instead
+        # of 20 per second each
+        self.assertGreater(time.monotonic() - start, 0.35)
+        self.assertEqual(len(sent), 10)
+        self.assertEqual(json.loads(json.dumps(state.stats()))["size"], 1)
+
+
+class FailingStateBackend(MemoryStateBackend):
+    def __init__(self):
+        super(FailingStateBackend, self).__init__()
+        self.error = None
+
+    def bucket(self, key, rate, capacity, take=1):
+        if self.error is not None:
+            raise self.error
+        return super(FailingStateBackend, self).bucket(key, rate, capacity,
+                                                       take)
+
+
+class StateFailureTests(unittest.TestCase):
+    def setUp(self):
+        self.state = FailingStateBackend()
+        self.sent = []
+        self.scheduler = OutboundScheduler(self.sent.append, rate=100,
+                                           room_rate=100, state=self.state)
+        self.addCleanup(self.scheduler.stop)
+
+    def test_backend_errors_fall_back_to_local_buckets(self):
+        self.scheduler.send({"roomId": "r1"}, timeout=5)
+        self.state.error = StateError("connection refused")
+        self.scheduler.send({"roomId": "r1"}, timeout=5)
+        self.assertIsNotNone(self.scheduler._bucket.fallback)
+        self.assertGreater(self.scheduler._bucket.errors, 0)
+        self.state.error = None
+        self.scheduler.send({"roomId": "r2"}, timeout=5)
+        self.assertIsNone(self.scheduler._bucket.fallback)
+        self.assertEqual(len(self.sent), 3)
+        self.assertTrue(self.scheduler._thread.is_alive())
+
+    def test_dispatcher_failure_fails_queued_and_restarts(self):
+        self.state.error = RuntimeError("bug")
+        with self.assertRaises(RuntimeError):
+            self.scheduler.send({"roomId": "r1"}, timeout=5)
+        self.assertEqual(self.scheduler.stats()["failed"], 1)
+        self.state.error = None
+        self.scheduler.send({"roomId": "r1"}, timeout=5)
+        self.assertEqual(len(self.sent), 1)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.uploads`."""
+
+import io
+import os
+import tempfile
+import unittest
+from webexteamsbot import TeamsBot
+from webexteamsbot.client import create_teams_api
+from webexteamsbot.models import Response
+from webexteamsbot.uploads import (FileUpload, MultipartStream, Uploader,
+                                   UploadTooLarge)
+from .fake_webex import FakeWebex
+from .teams_mock import MockTeamsAPI
+
+
+class FileUploadTests(unittest.TestCase):
+    def test_path(self):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.write(fd, b"a,b\n" * 100)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        upload = FileUpload(path)
+        self.assertEqual(upload.filename, os.path.basename(path))
+        self.assertEqual(upload.content_type, "text/csv")
+        self.assertEqual(upload.size(), 400)
+        chunks = list(upload.chunks(150))
+        self.assertEqual([len(c) for c in chunks], [150, 150, 100])
+        # Paths can be sent again
+        self.assertEqual(b"".join(upload.chunks(150)), b"a,b\n" * 100)
+
+    def test_buffer_not_copied(self):
+        data = bytearray(b"x" * 1000)
+        upload = FileUpload(data, filename="data.bin")
+        self.assertEqual(upload.size(), 1000)
+        chunks = list(upload.chunks(400))
+        self.assertTrue(all(isinstance(c, memoryview) for c in chunks))
+        data[0:1] = b"y"
+        self.assertEqual(bytes(chunks[0][:1]), b"y")
+
+    def test_file_object(self):
+        f = io.BytesIO(b"header" + b"z" * 10)
+        f.read(6)
+        upload = FileUpload(f, filename="z.txt")
+        self.assertEqual(upload.size(), 10)
+        self.assertEqual(b"".join(upload.chunks(4)), b"z" * 10)
+        self.assertEqual(b"".join(upload.chunks(4)), b"z" * 10)
+
+    def test_generator_sent_once(self):
+        upload = FileUpload((b"log\n" for _ in range(3)), filename="app.log")
+        self.assertIsNone(upload.size())
+        self.assertEqual(b"".join(upload.chunks()), b"log\n" * 3)
+        with self.assertRaises(ValueError):
+            upload.chunks()
+        with self.assertRaises(TypeError):
+            FileUpload(42)
+
+    def test_multipart_stream(self):
+        body = MultipartStream({"roomId": "r", "attachments": [{"a": 1}]},
+                               FileUpload(b"content", filename="a.txt"))
+        data = b"".join(bytes(c) for c in body)
+        self.assertEqual(len(data), body.len)
+        self.assertIn(b'name="roomId"\r\n\r\nr\r\n', data)
+        self.assertIn(b'name="attachments"\r\n\r\n[{"a": 1}]\r\n', data)
+        self.assertIn(b'filename="a.txt"\r\nContent-Type: text/plain'
+                      b'\r\n\r\ncontent\r\n', data)
+        self.assertTrue(data.endswith(("--%s--\r\n" % body.boundary)
+                                      .encode()))
+
+
+class UploaderTests(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeWebex().start()
+        self.addCleanup(self.fake.stop)
+        self.teams = create_teams_api("somefaketoken",
+                                      base_url=self.fake.base_url)
+        self.observed = []
+        self.uploader = Uploader(
+            self.teams, max_size=1000, chunk_size=100,
+            observer=lambda *args: self.observed.append(args),
+        )
+
+    def test_upload(self):
+        progress = []
+        upload = FileUpload(b"x" * 250, filename="report.pdf",
+                            progress=lambda sent, total:
+                            progress.append((sent, total)))
+        message = self.uploader.create_message(
+            dict(roomId="r", markdown="**report**", files=[upload])
+        )
+        self.assertEqual(message.files, ["report.pdf"])
+        self.assertEqual(self.fake.sent[-1]["markdown"], "**report**")
+        self.assertEqual(self.fake.uploads[-1]["content"], b"x" * 250)
+        self.assertEqual(self.fake.uploads[-1]["content_type"],
+                         "application/pdf")
+        self.assertEqual(progress, [(100, 250), (200, 250), (250, 250)])
+        self.assertEqual(self.observed[0][1], 250)
+        self.assertIsNone(self.observed[0][3])
+        self.assertEqual(self.uploader.stats()["bytes_sent"], 250)
+
+    def test_chunked_generator(self):
+        upload = FileUpload((b"line\n" for _ in range(50)),
+                            filename="out.log")
+        self.uploader.create_message(dict(roomId="r", files=[upload]))
+        self.assertEqual(self.fake.uploads[-1]["content"], b"line\n" * 50)
+
+    def test_size_limit(self):
+        with self.assertRaises(UploadTooLarge):
+            self.uploader.create_message(
+                dict(roomId="r", files=[b"x" * 1001])
+            )
+        self.assertEqual(self.fake.requests[("POST", "messages")], 0)
+
+        # Unknown sizes are checked as the file is read
+        upload = FileUpload((b"y" * 300 for _ in range(10)), filename="y")
+        with self.assertRaises(UploadTooLarge):
+            self.uploader.create_message(dict(roomId="r", files=[upload]))
+        self.assertEqual(self.uploader.stats()["rejected"], 2)
+        self.assertEqual(self.fake.uploads, [])
+        self.assertIsInstance(self.observed[-1][3], UploadTooLarge)
+
+        # The connection pool is still usable
+        self.uploader.create_message(dict(roomId="r", files=[b"ok"]))
+        self.assertEqual(self.fake.uploads[-1]["content"], b"ok")
+
+    def test_url_sent_as_json(self):
+        self.uploader.create_message(
+            dict(roomId="r", files=["https://example.com/a.png"])
+        )
+        self.assertEqual(self.fake.sent[-1]["files"],
+                         ["https://example.com/a.png"])
+        self.assertEqual(self.fake.uploads, [])
+
+
+class TeamsBotUploadTests(unittest.TestCase):
+    def test_response_attachment(self):
+        fake = FakeWebex(message_text="/report").start()
+        self.addCleanup(fake.stop)
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_api_url=fake.base_url,
+            teams_bot_email="test@test.com",
+        )
+        self.addCleanup(bot.outbound.stop)
+
+        def report(incoming_msg):
+            r = Response(text="Here you go")
+            r.attach((b"%d\n" % i for i in range(1000)),
+                     filename="numbers.txt")
+            return r
+
+        bot.add_command("/report", "send a report", report)
+        bot.testing = True
+        resp = bot.test_client().post("/", data=MockTeamsAPI.incoming_msg(),
+                                      content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(fake.uploads[0]["filename"], "numbers.txt")
+        self.assertEqual(fake.sent[0]["roomId"], "some_room_id")
+        text = bot.metrics.registry.render()
+        self.assertIn('webexteamsbot_uploads_total{result="ok"} 1', text)
+        self.assertIn("webexteamsbot_upload_bytes_total 3890", text)
+        self.assertIn("webexteamsbot_uploads_bytes_sent 3890", text)
@@ -4,8 +4,13 @@
 """Tests for `webexteamsbot` package."""
 
 
+import json
+import threading
 import unittest
 from webexteamsbot import TeamsBot
+from webexteamsbot.models import Response
+from webexteamsbot.policy import ApprovalPolicy
+from webexteamsbot.prefilter import sign
 import requests_mock
 from .teams_mock import MockTeamsAPI
 
@@ -80,6 +85,29 @@ class TeamsBotTests(unittest.TestCase):
         bot.testing = True
         self.app = bot.test_client()
 
+    @requests_mock.mock()
+    def test_webhook_background_setup(self, m):
+        m.get(
+            "https://api.ciscospark.com/v1/webhooks",
+            json=MockTeamsAPI.list_webhooks(),
+        )
+        m.post(
+            "https://api.ciscospark.com/v1/webhooks",
+            json=MockTeamsAPI.create_webhook(),
+        )
+        bot = TeamsBot(
+            "testbot",
+            teams_bot_token="somefaketoken",
+            teams_bot_url="http://fakebot.com",
+            teams_bot_email="test@test.com",
+            webhook_background=True,
+        )
+        bot.testing = True
+        resp = bot.test_client().get("/health")
+        self.assertEqual(resp.status_code, 200)
+        bot.webhook_thread.join()
+        self.assertEqual([w.id for w in bot.webhooks], ["newwebhook"])
+
     @requests_mock.mock()
     def test_bad_config_raises_valueerror(self, m):
         with self.assertRaises(ValueError):
@@ -133,6 +161,22 @@ class TeamsBotTests(unittest.TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn(b"test@test.com", resp.data)
 
+    def test_help_cached_until_commands_change(self):
+        bot = self.app.application
+        first = bot.send_help(None)
+        self.assertIs(bot.send_help(None), first)
+        self.assertIn("* **/dosomething**: help for do something \n", first)
+
+        bot.add_command("/new", "a new command", self.do_something)
+        self.assertIn("* **/new**: a new command", bot.send_help(None))
+        bot.remove_command("/new")
+        self.assertNotIn("/new", bot.send_help(None))
+
+        bot.set_greeting(self.do_something)
+        self.assertNotIn("/greeting", bot.send_help(None))
+        bot.set_help_message("Commands:\n")
+        self.assertTrue(bot.send_help(None).startswith("Commands:\n* **"))
+
     @requests_mock.mock()
     def test_process_incoming_message_send_help(self, m):
         m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
@@ -235,6 +279,222 @@ class TeamsBotTests(unittest.TestCase):
         print(resp.data)
         self.assertIn(b"success", resp.data)
 
+    @requests_mock.mock()
+    def test_redelivered_webhook_processed_once(self, m):
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        fetch = m.get(
+            "//api.ciscospark.com/v1/messages/incoming_message_id",
+            json=MockTeamsAPI.get_message_help(),
+        )
+        sent = m.post("//api.ciscospark.com/v1/messages", json={})
+        for _ in range(2):
+            resp = self.app.post(
+                "/",
+                data=MockTeamsAPI.incoming_msg(),
+                content_type="application/json",
+            )
+            self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Duplicate", resp.data)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(sent.call_count, 1)
+        self.assertEqual(self.app.application.dedupe.stats()["hits"], 1)
+
+    @requests_mock.mock()
+    def test_unapproved_user_ignored(self, m):
+        m.get('https://api.ciscospark.com/v1/webhooks',
+              json=MockTeamsAPI.list_webhooks())
+        m.post('https://api.ciscospark.com/v1/webhooks',
+               json=MockTeamsAPI.create_webhook())
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        fetch = m.get(
+            "//api.ciscospark.com/v1/messages/incoming_message_id",
+            json=MockTeamsAPI.get_message_help(),
+        )
+        sent = m.post("//api.ciscospark.com/v1/messages", json={})
+        bot = TeamsBot("testbot",
+                       teams_bot_token="somefaketoken",
+                       teams_bot_url="http://fakebot.com",
+                       teams_bot_email="test@test.com",
+                       approved_users=["*@cisco.com", "Julie@Example.com"])
+        bot.testing = True
+        resp = bot.test_client().post(
+            "/",
+            data=MockTeamsAPI.incoming_msg(),
+            content_type="application/json",
+        )
+        self.assertIn(b"Unapproved user", resp.data)
+        self.assertEqual(sent.call_count, 0)
+        # Rejected from the webhook payload, without fetching the message
+        self.assertEqual(fetch.call_count, 0)
+        self.assertEqual(bot.event_filter.stats()["fetches_avoided"], 1)
+
+    def test_sends_to_rooms_overlap(self):
+        rooms = 16
+        # No rate limits, and more rooms than the old 4 sender threads
+        bot = TeamsBot("testbot", teams_bot_token="somefaketoken",
+                       teams_bot_email="test@test.com",
+                       http_pool_size=rooms)
+        self.addCleanup(bot.outbound.stop)
+        # Every send waits for all of them, so it only passes if they are
+        # all in flight at once
+        barrier = threading.Barrier(rooms, timeout=5)
+
+        def send(payload):
+            barrier.wait()
+            return payload["roomId"]
+
+        bot.outbound.send_func = send
+        futures = [bot.outbound.submit({"roomId": "room%d" % i, "text": "hi"})
+                   for i in range(rooms)]
+        self.assertEqual([f.result(5) for f in futures],
+                         ["room%d" % i for i in range(rooms)])
+        self.assertEqual(bot.outbound.stats()["failed"], 0)
+
+    def test_outbound_workers_default(self):
+        bot = self.app.application
+        self.assertEqual(bot.outbound.workers, 10)
+
+    def test_approved_users_reassigned(self):
+        bot = self.app.application
+        self.assertEqual(bot.approved_users, ())
+        self.assertTrue(bot.approval.is_approved("julie@example.com"))
+        bot.approved_users = ["*@cisco.com"]
+        self.assertEqual(bot.approved_users, ("*@cisco.com",))
+        self.assertFalse(bot.approval.is_approved("julie@example.com"))
+        self.assertTrue(bot.approval.is_approved("matt@cisco.com"))
+        with self.assertRaises(AttributeError):
+            bot.approved_users.append("julie@example.com")
+
+        policy = ApprovalPolicy(users=["julie@example.com"])
+        bot.approved_users = policy
+        self.assertIs(bot.approval, policy)
+        self.assertIs(bot.event_filter.approval, policy)
+        self.assertEqual(bot.approved_users, ("julie@example.com",))
+
+    @requests_mock.mock()
+    def test_own_message_not_fetched(self, m):
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        fetch = m.get(
+            "//api.ciscospark.com/v1/messages/incoming_message_id",
+            json=MockTeamsAPI.get_message_help(),
+        )
+        post_data = json.loads(MockTeamsAPI.incoming_msg())
+        post_data["data"]["personId"] = MockTeamsAPI.me()["id"]
+        resp = self.app.post(
+            "/",
+            data=json.dumps(post_data),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(fetch.call_count, 0)
+        stats = self.app.application.event_filter.stats()
+        self.assertEqual(stats["rejected_self"], 1)
+
+    @requests_mock.mock()
+    def test_webhook_signature(self, m):
+        hooks = m.get('https://api.ciscospark.com/v1/webhooks',
+                      json=MockTeamsAPI.list_webhooks())
+        create = m.post('https://api.ciscospark.com/v1/webhooks',
+                        json=MockTeamsAPI.create_webhook())
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        fetch = m.get(
+            "//api.ciscospark.com/v1/messages/incoming_message_id",
+            json=MockTeamsAPI.get_message_help(),
+        )
+        m.post("//api.ciscospark.com/v1/messages", json={})
+        bot = TeamsBot("testbot",
+                       teams_bot_token="somefaketoken",
+                       teams_bot_url="http://fakebot.com",
+                       teams_bot_email="test@test.com",
+                       webhook_secret="s3cret")
+        self.assertEqual(hooks.call_count, 1)
+        self.assertEqual(create.last_request.json()["secret"], "s3cret")
+        bot.testing = True
+        client = bot.test_client()
+
+        body = MockTeamsAPI.incoming_msg().encode("utf-8")
+        resp = client.post("/", data=body, content_type="application/json",
+                           headers={"X-Spark-Signature": "0" * 40})
+        self.assertEqual(resp.status_code, 403)
+        resp = client.post("/", data=body, content_type="application/json")
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(fetch.call_count, 0)
+
+        resp = client.post("/", data=body, content_type="application/json",
+                           headers={"X-Spark-Signature": sign("s3cret", body)})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(fetch.call_count, 1)
+        stats = bot.event_filter.stats()
+        self.assertEqual(stats["rejected_signature"], 2)
+        self.assertEqual(stats["fetches_avoided"], 2)
+
+    @requests_mock.mock()
+    def test_resource_callback_gets_shared_client(self, m):
+        m.get('https://api.ciscospark.com/v1/webhooks',
+              json=MockTeamsAPI.list_webhooks())
+        m.post('https://api.ciscospark.com/v1/webhooks',
+               json=MockTeamsAPI.create_webhook())
+        m.post('//api.ciscospark.com/v1/messages', json={})
+        bot = TeamsBot("testbot",
+                       teams_bot_token="somefaketoken",
+                       teams_bot_url="http://fakebot.com",
+                       teams_bot_email="test@test.com",
+                       webhook_resource="memberships",
+                       webhook_event="all",
+                       http_pool_size=4)
+        clients = []
+
+        def capture(api, incoming_msg):
+            clients.append(api)
+            return ""
+
+        bot.add_command('memberships', '*', capture)
+        bot.testing = True
+        app = bot.test_client()
+        for i in range(2):
+            post_data = json.loads(MockTeamsAPI.incoming_membership_pass())
+            post_data["data"]["id"] = "membership_%d" % i
+            app.post('/',
+                     data=json.dumps(post_data),
+                     content_type="application/json")
+        self.assertEqual(len(clients), 2)
+        self.assertIs(clients[0], bot.teams)
+        self.assertIs(clients[1], bot.teams)
+
+    @requests_mock.mock()
+    def test_response_list_reports_failures(self, m):
+        def create_message(request, context):
+            if request.json()["roomId"] == "bad_room":
+                context.status_code = 400
+            return {}
+
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        m.get(
+            "//api.ciscospark.com/v1/messages/incoming_message_id",
+            json=MockTeamsAPI.get_message_dosomething(),
+        )
+        sent = m.post("//api.ciscospark.com/v1/messages", json=create_message)
+
+        def replies(incoming_msg):
+            responses = []
+            for room in ("bad_room", None, None):
+                r = Response()
+                r.text = "part"
+                r.roomId = room
+                responses.append(r)
+            return responses
+
+        self.app.application.add_command("/echo", "*", replies)
+        resp = self.app.post(
+            "/",
+            data=MockTeamsAPI.incoming_msg(),
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(sent.call_count, 3)
+        self.assertIn(b"1 of 3 replies failed", resp.data)
+
     def check_membership(self, ob, incoming_msg):
         """
         Sample function to do some action.
@@ -285,5 +545,67 @@ class TeamsBotTests(unittest.TestCase):
         self.assertEqual(resp.status_code, 200)
         print(resp.data)
 
+    @requests_mock.mock()
+    def test_identity_cached_between_messages(self, m):
+        me = m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        m.get(
+            "//api.ciscospark.com/v1/messages/incoming_message_id",
+            json=MockTeamsAPI.get_message_dosomething(),
+        )
+        m.post("//api.ciscospark.com/v1/messages", json={})
+        for i in range(3):
+            # Distinct event ids so the webhooks are not deduplicated
+            m.get(
+                "//api.ciscospark.com/v1/messages/message_%d" % i,
+                json=MockTeamsAPI.get_message_dosomething(),
+            )
+            post_data = json.loads(MockTeamsAPI.incoming_msg())
+            post_data["data"]["id"] = "message_%d" % i
+            resp = self.app.post(
+                "/",
+                data=json.dumps(post_data),
+                content_type="application/json",
+            )
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(me.call_count, 1)
+        stats = self.app.application.identity.stats()
+        self.assertEqual(stats["api_calls"], 1)
+        # Checked by the pre-fetch filter and again after the fetch
+        self.assertEqual(stats["lookups"], 6)
+        self.assertEqual(stats["api_calls_saved"], 5)
+
+    @requests_mock.mock()
+    def test_webhook_workers_acknowledge_then_process(self, m):
+        m.get('https://api.ciscospark.com/v1/webhooks',
+              json=MockTeamsAPI.list_webhooks())
+        m.post('https://api.ciscospark.com/v1/webhooks',
+               json=MockTeamsAPI.create_webhook())
+        m.get("//api.ciscospark.com/v1/people/me", json=MockTeamsAPI.me())
+        m.get(
+            "//api.ciscospark.com/v1/messages/incoming_message_id",
+            json=MockTeamsAPI.get_message_help(),
+        )
+        sent = m.post("//api.ciscospark.com/v1/messages", json={})
+        bot = TeamsBot("testbot",
+                       teams_bot_token="somefaketoken",
+                       teams_bot_url="http://fakebot.com",
+                       teams_bot_email="test@test.com",
+                       webhook_workers=2)
+        bot.testing = True
+        app = bot.test_client()
+
+        resp = app.post("/",
+                        data=MockTeamsAPI.incoming_msg(),
+                        content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"Queued", resp.data)
+        bot.work_queue.join()
+        bot.work_queue.stop()
+        self.assertEqual(sent.call_count, 1)
+        self.assertEqual(bot.work_queue.stats()["processed"], 1)
+
+        resp = app.post("/", data="{}", content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
     def tearDown(self):
         pass
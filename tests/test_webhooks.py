@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.webhooks`."""
+
+import unittest
+import requests_mock
+from webexteamssdk import WebexTeamsAPI
+from webexteamsbot.webhooks import WebhookReconciler
+from .teams_mock import MockTeamsAPI
+
+API = "https://api.ciscospark.com/v1/webhooks"
+
+
+def hook(hook_id, name, target="http://fakebot.com", resource="messages",
+         event="created", status="active"):
+    return {"id": hook_id, "name": name, "targetUrl": target,
+            "resource": resource, "event": event, "status": status}
+
+
+class WebhookReconcilerTests(unittest.TestCase):
+    def setUp(self):
+        self.teams = WebexTeamsAPI(access_token="somefaketoken")
+        self.resource_events = [
+            {"resource": "messages", "event": "created"},
+            {"resource": "attachmentActions", "event": "created"},
+        ]
+
+    def reconciler(self):
+        return WebhookReconciler(self.teams, "testbot", "http://fakebot.com",
+                                 self.resource_events)
+
+    def calls(self, m):
+        return [(r.method, r.path) for r in m.request_history]
+
+    @requests_mock.mock()
+    def test_unchanged_webhooks_left_alone(self, m):
+        m.get(API, json={"items": [
+            hook("a", "testbot.messages.created"),
+            hook("b", "testbot.attachmentActions.created",
+                 resource="attachmentActions"),
+        ]})
+        r = self.reconciler()
+        webhooks = r.reconcile()
+        self.assertEqual([w.id for w in webhooks], ["a", "b"])
+        self.assertEqual(self.calls(m), [("GET", "/v1/webhooks")])
+        self.assertEqual(r.stats()["unchanged"], 2)
+
+    @requests_mock.mock()
+    def test_changed_target_url_updated_in_place(self, m):
+        m.get(API, json={"items": [
+            hook("a", "testbot", target="http://old.com"),
+        ]})
+        m.put(API + "/a", json=hook("a", "testbot.messages.created"))
+        m.post(API, json=MockTeamsAPI.create_webhook())
+        r = self.reconciler()
+        r.reconcile()
+        self.assertEqual(self.calls(m), [
+            ("GET", "/v1/webhooks"),
+            ("PUT", "/v1/webhooks/a"),
+            ("POST", "/v1/webhooks"),
+        ])
+        self.assertEqual(m.request_history[1].json(), {
+            "name": "testbot.messages.created",
+            "targetUrl": "http://fakebot.com",
+        })
+        self.assertEqual(r.stats()["updated"], 1)
+        self.assertEqual(r.stats()["created"], 1)
+
+    @requests_mock.mock()
+    def test_changed_event_and_stale_webhooks_replaced(self, m):
+        m.get(API, json={"items": [
+            hook("a", "testbot.messages.created", event="all"),
+            hook("b", "testbot.attachmentActions.created",
+                 resource="attachmentActions"),
+            hook("c", "testbot.memberships.all", resource="memberships",
+                 event="all"),
+            hook("d", "someotherbot.messages.created"),
+        ]})
+        m.delete(API + "/a", status_code=204)
+        m.delete(API + "/c", status_code=204)
+        m.post(API, json=MockTeamsAPI.create_webhook())
+        r = self.reconciler()
+        r.reconcile()
+        self.assertEqual(self.calls(m), [
+            ("GET", "/v1/webhooks"),
+            ("DELETE", "/v1/webhooks/a"),
+            ("POST", "/v1/webhooks"),
+            ("DELETE", "/v1/webhooks/c"),
+        ])
+        self.assertEqual(m.request_history[2].json()["event"], "created")
+        self.assertEqual(r.stats()["deleted"], 2)
+
+    @requests_mock.mock()
+    def test_errors_do_not_stop_reconcile(self, m):
+        m.get(API, json={"items": []})
+        m.post(API, status_code=500)
+        r = self.reconciler()
+        self.assertEqual(r.reconcile(), [])
+        self.assertEqual(r.stats()["errors"], 2)
+
+    @requests_mock.mock()
+    def test_secret_added_in_place(self, m):
+        self.resource_events = self.resource_events[:1]
+        m.get(API, json={"items": [hook("a", "testbot.messages.created")]})
+        update = m.put(API + "/a", json=hook("a", "testbot.messages.created"))
+        r = WebhookReconciler(self.teams, "testbot", "http://fakebot.com",
+                              self.resource_events, secret="s3cret")
+        r.reconcile()
+        self.assertEqual(update.last_request.json()["secret"], "s3cret")
+        self.assertEqual(r.stats()["updated"], 1)
+
+    @requests_mock.mock()
+    def test_disabled_webhook_enabled_again(self, m):
+        self.resource_events = self.resource_events[:1]
+        m.get(API, json={"items": [
+            hook("a", "testbot.messages.created", status="inactive"),
+        ]})
+        update = m.put(API + "/a", json=hook("a", "testbot.messages.created"))
+        r = self.reconciler()
+        webhooks = r.reconcile()
+        self.assertEqual(update.last_request.json(), {
+            "name": "testbot.messages.created",
+            "targetUrl": "http://fakebot.com",
+            "status": "active",
+        })
+        self.assertEqual(webhooks[0].status, "active")
+        self.assertEqual(r.stats()["updated"], 1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `webexteamsbot.workqueue`."""
+
+import threading
+import unittest
+from webexteamsbot.workqueue import WorkQueue
+
+
+class WorkQueueTests(unittest.TestCase):
+    def test_items_processed_by_workers(self):
+        seen = []
+        q = WorkQueue(seen.append, workers=2, maxsize=10)
+        q.start()
+        for i in range(5):
+            self.assertTrue(q.submit(i))
+        q.join()
+        q.stop()
+        self.assertEqual(sorted(seen), [0, 1, 2, 3, 4])
+        stats = q.stats()
+        self.assertEqual(stats["submitted"], 5)
+        self.assertEqual(stats["processed"], 5)
+        self.assertEqual(stats["depth"], 0)
+
+    def test_full_queue_drops(self):
+        release = threading.Event()
+        q = WorkQueue(lambda item: release.wait(), workers=1, maxsize=1)
+        q.start()
+        q.submit("busy")
+        # Wait for the worker to pick up the first item
+        while q.depth:
+            pass
+        self.assertTrue(q.submit("waiting"))
+        self.assertFalse(q.submit("dropped"))
+        release.set()
+        q.join()
+        q.stop()
+        self.assertEqual(q.stats()["dropped"], 1)
+
+    def test_handler_errors_counted(self):
+        def boom(item):
+            raise RuntimeError("boom")
+
+        q = WorkQueue(boom, workers=1)
+        q.start()
+        q.submit(1)
+        q.join()
+        q.stop()
+        self.assertEqual(q.stats()["errors"], 1)
+
+    def test_requires_worker(self):
+        with self.assertRaises(ValueError):
+            WorkQueue(lambda item: None, workers=0)
+
+    def test_bound_handlers_share_workers(self):
+        seen = []
+        q = WorkQueue(None, workers=2, maxsize=10)
+        q.start()
+        first = q.bind(lambda item: seen.append(("first", item)))
+        second = q.bind(lambda item: seen.append(("second", item)))
+        first.submit(1)
+        second.submit(2)
+        second.submit(3)
+        q.join()
+        q.stop()
+        self.assertEqual(sorted(seen),
+                         [("first", 1), ("second", 2), ("second", 3)])
+        self.assertEqual(first.stats()["submitted"], 1)
+        self.assertEqual(second.stats()["submitted"], 2)
+        self.assertEqual(q.stats()["processed"], 3)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""Adaptive Card submissions (attachmentActions), fetched once and routed
+to the handler registered for their card."""
+
+import json
+import threading
+import time
+
+from webexteamsbot.cache import TTLCache
+
+# Key in an Action.Submit's data naming the card, and the action on it
+CARD_KEY = "card"
+ACTION_KEY = "action"
+
+
+class AttachmentAction(object):
+    """
+    A card submission: id, type, messageId (the card's message),
+    personId, roomId, created and inputs.  Unlike webexteamssdk's models,
+    inputs is a plain dict.
+    """
+
+    def __init__(self, json_data):
+        """
+        Initialize a new AttachmentAction
+
+        :param json_data: Decoded JSON
+        """
+        self.json_data = json_data
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["json_data"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def inputs(self):
+        return self.json_data.get("inputs") or {}
+
+    def __repr__(self):
+        return "AttachmentAction(%r)" % (self.json_data,)
+
+
+def fetch_action(teams, action_id):
+    """
+    Get an attachmentAction with the bot's shared client.  webexteamssdk
+    has no attachment_actions API, so it goes through the client's
+    session, and its connection pool, directly.
+    :param teams: WebexTeamsAPI
+    :param action_id: attachmentAction id
+    :return: AttachmentAction
+    """
+    return AttachmentAction(
+        teams._session.get("attachment/actions/" + action_id)
+    )
+
+
+def tag_submit_actions(card, name):
+    """
+    Name the card in the data of each of its Action.Submit actions, so
+    submissions can be routed to the card's handler.  Actions already
+    naming a card, or with non-object data, are left alone.
+    :param card: The card, as a dict or JSON string
+    :param name: Name of the card
+    :return: A tagged copy of the card, sharing the parts without
+            Action.Submit
+    """
+    if isinstance(card, str):
+        card = json.loads(card)
+    return _tag(card, name)
+
+
+def _tag(value, name):
+    if isinstance(value, dict):
+        changed = {}
+        for k, v in value.items():
+            tagged = _tag(v, name)
+            if tagged is not v:
+                changed[k] = tagged
+        if value.get("type") == "Action.Submit":
+            data = changed.get("data", value.get("data"))
+            if data is None:
+                data = {}
+            if isinstance(data, dict) and CARD_KEY not in data:
+                changed["data"] = dict(data, **{CARD_KEY: name})
+        if not changed:
+            return value
+        return dict(value, **changed)
+    if isinstance(value, list):
+        items = [_tag(v, name) for v in value]
+        if all(a is b for a, b in zip(items, value)):
+            return value
+        return items
+    return value
+
+
+class ActionCache(object):
+    """
+    Recently fetched attachmentActions, with TTL expiry and LRU eviction.
+
+    An action never changes once created, so the TTL only bounds how long
+    it is kept.  Handlers and resource callbacks looking up the action of
+    the event being handled get the cached copy instead of calling the
+    API again.
+    """
+
+    def __init__(self, fetch, ttl=300, max_size=1000):
+        """
+        Initialize a new ActionCache
+
+        :param fetch: Called with an action id to get the action
+        :param ttl: Seconds an action is kept
+        :param max_size: Maximum number of actions kept
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_size = max_size
+        self._actions = TTLCache(max_size)
+        self._lock = threading.Lock()
+
+        # Counters
+        self.lookups = 0
+        self.api_calls = 0
+
+    @property
+    def evictions(self):
+        return self._actions.evictions
+
+    def lookup(self, action_id):
+        """
+        A cached action, without fetching it.
+        :param action_id: attachmentAction id
+        :return: AttachmentAction, or None
+        """
+        self.lookups += 1
+        with self._lock:
+            return self._actions.get(action_id, time.monotonic())
+
+    def store(self, action):
+        """
+        Cache a fetched action.
+        :param action: AttachmentAction
+        :return: The action
+        """
+        self.api_calls += 1
+        now = time.monotonic()
+        with self._lock:
+            self._actions.put(action.id, action, now + self.ttl, now)
+        return action
+
+    def get(self, action_id):
+        """
+        An action, fetched only if it isn't cached.
+        :param action_id: attachmentAction id
+        :return: AttachmentAction
+        """
+        action = self.lookup(action_id)
+        if action is None:
+            action = self.store(self.fetch(action_id))
+        return action
+
+    def __len__(self):
+        return len(self._actions)
+
+    def stats(self):
+        """
+        Counters describing cache effectiveness.
+        :return: dict of counters
+        """
+        return dict(
+            size=len(self._actions),
+            lookups=self.lookups,
+            api_calls=self.api_calls,
+            api_calls_saved=self.lookups - self.api_calls,
+            evictions=self.evictions,
+        )
+
+
+class ActionRouter(object):
+    """
+    Handlers for card submissions, by card and action name.
+
+    A submission is routed by the "card" and "action" keys of its
+    inputs, which include the data of the Action.Submit that was
+    clicked.  A handler registered for a card and action is used before
+    one registered for the whole card.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+        # Counters
+        self.routed = 0
+        self.unrouted = 0
+
+    def add(self, card, callback, action=None):
+        """
+        Register a handler.
+        :param card: Card name, as in the Action.Submit's data
+        :param callback: Called with the AttachmentAction
+        :param action: Only for submissions naming this action
+        :return:
+        """
+        self.handlers[(card, action)] = callback
+
+    def remove(self, card, action=None):
+        """
+        Remove a handler.
+        :param card: Card name
+        :param action: Action name
+        :return:
+        """
+        del self.handlers[(card, action)]
+
+    def route(self, action):
+        """
+        The handler for a submission.
+        :param action: AttachmentAction
+        :return: (card name, callback), or (None, None) if no handler is
+                registered for it
+        """
+        inputs = action.inputs
+        if isinstance(inputs, dict):
+            card = inputs.get(CARD_KEY)
+            if card is not None:
+                handlers = self.handlers
+                callback = handlers.get((card, inputs.get(ACTION_KEY))) \
+                    or handlers.get((card, None))
+                if callback is not None:
+                    self.routed += 1
+                    return card, callback
+        self.unrouted += 1
+        return None, None
+
+    def __len__(self):
+        return len(self.handlers)
+
+    def stats(self):
+        """
+        Routing counters.
+        :return: dict of counters
+        """
+        return dict(
+            handlers=len(self.handlers),
+            routed=self.routed,
+            unrouted=self.unrouted,
+        )
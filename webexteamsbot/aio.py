@@ -0,0 +1,722 @@
+# -*- coding: utf-8 -*-
+
+"""Asyncio based Webex Teams bot served over ASGI."""
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from webexteamssdk.config import DEFAULT_BASE_URL
+from webexteamssdk.models.immutable import immutable_data_factory
+from webexteamsbot.models import Response
+from webexteamsbot.commands import CommandRegistry
+from webexteamsbot.actions import ActionCache, AttachmentAction
+from webexteamsbot.arguments import UsageError, command_text
+from webexteamsbot.dedupe import DedupeCache
+from webexteamsbot.delivery import destination, reply_payload
+from webexteamsbot.policy import ApprovalPolicy
+from webexteamsbot.webhooks import WebhookReconciler, update_args
+from webexteamsbot import logs
+from webexteamsbot import uploads
+
+log = logs.get_logger(__name__)
+
+
+class AsyncApiError(Exception):
+    """Error response from the Webex Teams API."""
+
+    def __init__(self, status_code, headers, text):
+        self.status_code = status_code
+        self.headers = headers
+        self.retry_after = None
+        if status_code == 429:
+            try:
+                self.retry_after = max(1, int(headers.get("Retry-After", 15)))
+            except ValueError:
+                self.retry_after = 15
+        super(AsyncApiError, self).__init__(
+            "Response Code [{}] - {}".format(status_code, text)
+        )
+
+
+class AsyncWebexAPI(object):
+    """
+    Minimal asyncio Webex Teams API client.
+
+    All requests share one aiohttp ClientSession, and so one connection
+    pool.  Results are returned as the same webexteamssdk data objects the
+    synchronous WebexTeamsAPI returns.
+    """
+
+    def __init__(
+        self,
+        access_token,
+        base_url=None,
+        pool_size=100,
+        timeout=60,
+        wait_on_rate_limit=True,
+        max_rate_limit_retries=3,
+        upload_max_size=uploads.DEFAULT_MAX_SIZE,
+        upload_chunk_size=uploads.DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        Initialize a new AsyncWebexAPI
+
+        :param access_token: Teams Auth Token
+        :param base_url: URL to the Teams/Webex API endpoint
+        :param pool_size: Maximum number of pooled connections
+        :param timeout: Seconds to wait for a response
+        :param wait_on_rate_limit: Sleep and retry on 429 responses
+        :param max_rate_limit_retries: Retries after 429 responses
+        :param upload_max_size: Largest file, in bytes, a message may
+                attach.  None for no limit
+        :param upload_chunk_size: Bytes of an attached file read and sent
+                at a time
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "AsyncWebexAPI requires aiohttp.  "
+                "Install it with: pip install webexteamsbot[async]"
+            )
+        self.base_url = base_url or DEFAULT_BASE_URL
+        if not self.base_url.endswith("/"):
+            self.base_url += "/"
+        self.access_token = access_token
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.wait_on_rate_limit = wait_on_rate_limit
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.upload_max_size = upload_max_size
+        self.upload_chunk_size = upload_chunk_size
+        self._session = None
+
+    @property
+    def session(self):
+        """The shared aiohttp session, created on first use."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={
+                    "Authorization": "Bearer " + self.access_token,
+                    "Content-Type": "application/json;charset=utf-8",
+                },
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def abs_url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return self.base_url + path
+
+    async def _request(self, method, path, stream=None, **kwargs):
+        attempts = 0
+        while True:
+            if stream is not None:
+                # A new body for every attempt, as a sent one is used up
+                kwargs["data"] = stream()
+            async with self.session.request(
+                method, self.abs_url(path), **kwargs
+            ) as response:
+                status = response.status
+                if status >= 400:
+                    error = AsyncApiError(status, response.headers,
+                                          await response.text())
+                    if status == 429 and self.wait_on_rate_limit \
+                            and attempts < self.max_rate_limit_retries:
+                        attempts += 1
+                        await asyncio.sleep(error.retry_after)
+                        continue
+                    raise error
+                body = await response.read()
+                data = json.loads(body.decode("utf-8")) if body else None
+                next_link = response.links.get("next")
+                next_url = str(next_link["url"]) if next_link else None
+                return data, next_url
+
+    async def request(self, method, path, **kwargs):
+        """
+        Make an API request.
+        :param method: HTTP method
+        :param path: Path relative to the API base URL
+        :param kwargs: Passed to aiohttp
+        :return: Decoded JSON response, or None if there is no body
+        """
+        data, _ = await self._request(method, path, **kwargs)
+        return data
+
+    async def get(self, path, params=None):
+        return await self.request("GET", path, params=params)
+
+    async def post(self, path, json=None):
+        return await self.request("POST", path, json=json)
+
+    async def put(self, path, json=None):
+        return await self.request("PUT", path, json=json)
+
+    async def delete(self, path):
+        return await self.request("DELETE", path)
+
+    async def list_items(self, path, params=None):
+        """
+        Get all items from a list endpoint, following pagination links.
+        :param path: Path relative to the API base URL
+        :param params: Query parameters
+        :return: List of item dicts
+        """
+        items = []
+        data, next_url = await self._request("GET", path, params=params)
+        items.extend((data or {}).get("items", []))
+        while next_url:
+            data, next_url = await self._request("GET", next_url)
+            items.extend((data or {}).get("items", []))
+        return items
+
+    async def get_message(self, message_id):
+        data = await self.get("messages/" + message_id)
+        return immutable_data_factory("message", data)
+
+    async def create_message(self, **kwargs):
+        files = kwargs.get("files")
+        upload = uploads.as_upload(files[0]) if files else None
+        if upload is None:
+            data = await self.post("messages", json=kwargs)
+        elif len(files) != 1:
+            raise ValueError("Only one file may be sent per message")
+        else:
+            fields = {k: v for k, v in kwargs.items() if k != "files"}
+            data = await self.upload("messages", fields, upload)
+        return immutable_data_factory("message", data or {})
+
+    async def upload(self, path, fields, upload):
+        """
+        Post a multipart/form-data body, streaming the file instead of
+        reading it into memory.
+        :param path: Path relative to the API base URL
+        :param fields: Other message fields
+        :param upload: FileUpload
+        :return: Decoded JSON response
+        """
+        size = upload.size()
+        if self.upload_max_size is not None and size is not None \
+                and size > self.upload_max_size:
+            raise uploads.UploadTooLarge("{} is larger than {} bytes".format(
+                upload.filename, self.upload_max_size
+            ))
+        headers = {}
+
+        def stream():
+            body = uploads.MultipartStream(fields, upload,
+                                           self.upload_chunk_size,
+                                           self.upload_max_size)
+            headers["Content-Type"] = body.content_type
+            if body.len:
+                headers["Content-Length"] = str(body.len)
+            return _read_async(body)
+
+        data, _ = await self._request("POST", path, stream=stream,
+                                      headers=headers)
+        return data
+
+    async def get_attachment_action(self, action_id):
+        data = await self.get("attachment/actions/" + action_id)
+        return AttachmentAction(data)
+
+    async def me(self):
+        data = await self.get("people/me")
+        return immutable_data_factory("person", data)
+
+    async def list_webhooks(self):
+        items = await self.list_items("webhooks")
+        return [immutable_data_factory("webhook", h) for h in items]
+
+    async def create_webhook(self, **kwargs):
+        data = await self.post("webhooks", json=kwargs)
+        return immutable_data_factory("webhook", data)
+
+    async def update_webhook(self, webhook_id, **kwargs):
+        data = await self.put("webhooks/" + webhook_id, json=kwargs)
+        return immutable_data_factory("webhook", data)
+
+    async def delete_webhook(self, webhook_id):
+        await self.delete("webhooks/" + webhook_id)
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def _read_async(body):
+    # Files are read on the default executor, so disk reads and generators
+    # don't block the event loop
+    loop = asyncio.get_running_loop()
+    chunks = iter(body)
+    while True:
+        chunk = await loop.run_in_executor(None, next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class AsyncTeamsBot(CommandRegistry):
+    """
+    An instance of a Webex Teams Bot running on asyncio.
+
+    AsyncTeamsBot is an ASGI application, served by any ASGI server, e.g.
+    ``uvicorn sample:bot``.  It has the same command API as TeamsBot, but
+    command callbacks may be ``async def`` functions, and every Teams API
+    call is made with a non-blocking HTTP client.  Plain functions are run
+    in a thread pool so they cannot stall the event loop.
+    """
+
+    def __init__(
+        self,
+        teams_bot_name,
+        teams_bot_token=None,
+        teams_api_url=None,
+        teams_bot_email=None,
+        teams_bot_url=None,
+        default_action="/help",
+        webhook_resource_event=None,
+        webhook_resource="messages",
+        webhook_event="created",
+        approved_users=[],
+        debug=False,
+        identity_ttl=3600,
+        dedupe_ttl=300,
+        http_pool_size=100,
+        http_timeout=60,
+        setup_webhooks=True,
+        log_level=None,
+        log_format="text",
+        log_sample_rate=1.0,
+        action_cache_ttl=300,
+        action_cache_size=1000,
+        upload_max_size=uploads.DEFAULT_MAX_SIZE,
+        upload_chunk_size=uploads.DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        Initialize a new AsyncTeamsBot
+
+        :param teams_bot_name: Friendly name for this Bot (webhook name)
+        :param teams_bot_token: Teams Auth Token for Bot Account
+        :param teams_api_url: URL to the Teams/Webex API endpoint
+        :param teams_bot_email: Teams Bot Email Address
+        :param teams_bot_url: WebHook URL for this Bot
+        :param default_action: What action to take if no command found.
+                Defaults to /help
+        :param webhook_resource_event: List of dicts for which resource/events
+                to create webhooks for.
+        :param webhook_resource: What resource to trigger webhook on
+                Defaults to messages
+        :param webhook_event: What resource event to trigger webhook on
+                Defaults to created
+        :param approved_users: List of approved users (by email), or an
+                ApprovalPolicy.  Default all users.
+        :param debug: boolean value for debug messages
+        :param identity_ttl: Seconds to cache the bot's own identity
+        :param dedupe_ttl: Seconds to remember processed webhook events.
+                0 disables.  Defaults to 300
+        :param http_pool_size: Maximum connections to the Teams API
+        :param http_timeout: Seconds to wait for a Teams API response
+        :param setup_webhooks: Reconcile the webhooks on ASGI startup
+        :param log_level: Level of the "webexteamsbot" logger
+        :param log_format: "text" or "json"
+        :param log_sample_rate: Fraction of events whose informational
+                records are logged
+        :param action_cache_ttl: Seconds a fetched card submission is
+                cached
+        :param action_cache_size: Maximum card submissions cached
+        :param upload_max_size: Largest file, in bytes, a Response may
+                attach.  Defaults to 100MB
+        :param upload_chunk_size: Bytes of an attached file read and sent
+                at a time.  Defaults to 64KB
+        """
+        if None in (teams_bot_name, teams_bot_token, teams_bot_email):
+            raise ValueError(
+                "AsyncTeamsBot requires teams_bot_name, "
+                "teams_bot_token, teams_bot_email, teams_bot_url"
+            )
+
+        self.DEBUG = debug
+        if log_level is None and debug:
+            log_level = logging.DEBUG
+        logs.default_logging(log_level, json_lines=log_format == "json")
+        self.log_sampler = logs.LogSampler(log_sample_rate)
+        self.teams_bot_name = teams_bot_name
+        self.teams_bot_token = teams_bot_token
+        self.teams_bot_email = teams_bot_email
+        self.teams_bot_url = teams_bot_url
+        self.default_action = default_action
+        self.webhook_resource_event = webhook_resource_event or [
+            {"resource": webhook_resource, "event": webhook_event}
+        ]
+        self.setup_webhooks = setup_webhooks
+        self.identity_ttl = identity_ttl
+
+        self.teams = AsyncWebexAPI(
+            teams_bot_token,
+            base_url=teams_api_url,
+            pool_size=http_pool_size,
+            timeout=http_timeout,
+            upload_max_size=upload_max_size,
+            upload_chunk_size=upload_chunk_size,
+        )
+
+        if isinstance(approved_users, ApprovalPolicy):
+            self.approval = approved_users
+        else:
+            self.approval = ApprovalPolicy(users=approved_users)
+        self.dedupe = DedupeCache(ttl=dedupe_ttl) if dedupe_ttl else None
+        self.webhooks = None
+
+        self._me = None
+        self._me_fetched = 0
+        self._me_lookup = None
+
+        self._init_commands()
+        # Fetched card submissions, looked up and stored without the
+        # cache's blocking fetch
+        self.actions = ActionCache(None, ttl=action_cache_ttl,
+                                   max_size=action_cache_size)
+
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/config"): self.config_bot,
+            ("POST", "/"): self.process_incoming_message,
+        }
+
+    # *** ASGI application
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed",
+                                "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+
+        func = self.routes.get((scope["method"], scope["path"]))
+        if func is None:
+            result = ("Not Found", 404)
+        else:
+            try:
+                result = await self._call(func, body)
+            except Exception as e:
+                log.error("Error processing request", path=scope["path"],
+                          error=str(e))
+                result = ("Internal Server Error", 500)
+
+        status = 200
+        if isinstance(result, tuple):
+            result, status = result
+        if result is None:
+            result = ""
+        if not isinstance(result, bytes):
+            result = str(result).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        })
+        await send({"type": "http.response.body", "body": result})
+
+    async def startup(self):
+        """
+        Reconcile the webhooks.  Called on ASGI lifespan startup.
+        :return:
+        """
+        if self.setup_webhooks and self.teams_bot_url:
+            self.webhooks = await self.setup_webhook()
+
+    async def shutdown(self):
+        """
+        Close the HTTP client.  Called on ASGI lifespan shutdown.
+        :return:
+        """
+        await self.teams.aclose()
+
+    # noinspection PyMethodMayBeStatic
+    async def _call(self, func, *args):
+        if inspect.iscoroutinefunction(func):
+            return await func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(func, *args)
+        )
+
+    def add_new_url(self, path, ep, func, methods=("GET", "POST", "PUT")):
+        """
+        Add a route.  The function receives the raw request body.
+        :param path: URL path
+        :param ep: Endpoint name (kept for TeamsBot compatibility)
+        :param func: Function or coroutine function handling the request
+        :param methods: HTTP methods to route
+        :return:
+        """
+        for method in methods:
+            self.routes[(method, path)] = func
+
+    # *** Bot Setup and Core Processing Functions
+    async def setup_webhook(self):
+        """
+        Create, update or delete webhooks so they match the configuration.
+        :return: List of WebHooks
+        """
+        reconciler = WebhookReconciler(
+            None, self.teams_bot_name, self.teams_bot_url,
+            self.webhook_resource_event
+        )
+        existing = await self.teams.list_webhooks()
+        result = []
+        for action, want, have in reconciler.plan(existing):
+            try:
+                if action == "keep":
+                    wh = have
+                elif action == "update":
+                    wh = await self.teams.update_webhook(
+                        have.id, **update_args(want, have)
+                    )
+                else:
+                    if have is not None:
+                        await self.teams.delete_webhook(have.id)
+                    if action == "delete":
+                        continue
+                    args = {k: v for k, v in want.items() if v is not None}
+                    wh = await self.teams.create_webhook(**args)
+            except AsyncApiError as e:
+                log.error("Encountered an error updating webhook",
+                          error=str(e))
+                wh = have
+            if wh is not None:
+                result.append(wh)
+        return result
+
+    async def health(self, body):
+        return "I'm Alive"
+
+    async def config_bot(self, body):
+        return json.dumps(dict(
+            SPARK_BOT_EMAIL=self.teams_bot_email,
+            SPARK_BOT_TOKEN="--Redacted--",
+            SPARK_BOT_URL=self.teams_bot_url,
+            SPARK_BOT_NAME=self.teams_bot_name,
+        ))
+
+    async def me(self):
+        """
+        The bot's own person object, cached for identity_ttl seconds.
+        Concurrent callers share a single lookup.
+        :return: Person
+        """
+        expired = self.identity_ttl and \
+            time.monotonic() - self._me_fetched > self.identity_ttl
+        if self._me is not None and not expired:
+            return self._me
+        if self._me_lookup is None:
+            self._me_lookup = asyncio.ensure_future(self.teams.me())
+        lookup = self._me_lookup
+        try:
+            me = await lookup
+        finally:
+            if self._me_lookup is lookup:
+                self._me_lookup = None
+        self._me = me
+        self._me_fetched = time.monotonic()
+        return me
+
+    async def process_incoming_message(self, body):
+        """
+        Process an incoming webhook, determine the command and action,
+        and send the reply.
+        :param body: Raw request body
+        :return: Reply
+        """
+        try:
+            post_data = json.loads(body.decode("utf-8"))
+        except ValueError:
+            return "Invalid webhook", 400
+        if self.dedupe is not None and self.dedupe.seen(post_data):
+            return "Duplicate"
+        with self.log_sampler.event():
+            try:
+                return await self.handle_event(post_data)
+            except Exception:
+                if self.dedupe is not None:
+                    self.dedupe.forget(post_data)
+                log.exception("Error handling event")
+                raise
+
+    async def handle_event(self, post_data):
+        """
+        Process a webhook payload, determine the command and action,
+        and send the reply.
+        :param post_data: Decoded webhook payload
+        :return: Reply
+        """
+        reply = None
+        room_id = post_data["data"].get("roomId")
+        logs.bind(resource=post_data["resource"], room=room_id)
+
+        if post_data["resource"] != "messages":
+            cmdcheck = post_data["resource"].lower()
+            card = callback = None
+            if cmdcheck == "attachmentactions" and len(self.card_actions):
+                action = await self.get_action(post_data["data"]["id"])
+                card, callback = self.card_actions.route(action)
+            if callback is not None:
+                logs.bind(person=action.personId, card=card)
+                reply = await self._call(callback, action)
+            elif cmdcheck in self.commands:
+                reply = await self._call(
+                    self.commands[cmdcheck]["callback"], self.teams,
+                    post_data
+                )
+            else:
+                return ""
+        else:
+            message = await self.teams.get_message(post_data["data"]["id"])
+            logs.bind(message=message.id, person=message.personEmail)
+            if log.enabled(logging.DEBUG):
+                log.debug("Message content", content=str(message))
+
+            # Avoid the bot talking to itself
+            me = await self.me()
+            if message.personId == me.id:
+                return ""
+
+            log.info("Message received")
+            if not self.approval.is_approved(message.personEmail):
+                log.info("User is not approved to interact with bot. "
+                         "Ignoring.")
+                return "Unapproved user"
+
+            command = self.find_command(message.text)
+            if command:
+                log.debug("Found command", command=command)
+            elif self.default_action:
+                command = self.default_action
+            if command in self.commands:
+                info = self.commands[command]
+                args = (message,)
+                spec = info.get("args")
+                if spec is not None:
+                    try:
+                        args += (spec.parse(command_text(command,
+                                                         message.text)),)
+                    except UsageError as e:
+                        return await self.send_reply(
+                            "%s  \nUsage: `%s`" % (e, spec.usage(command)),
+                            room_id,
+                        )
+                start = time.perf_counter()
+                reply = await self._call(info["callback"], *args)
+                elapsed = time.perf_counter() - start
+                log.info("Command handled", command=command,
+                         duration_ms=round(elapsed * 1000, 3))
+
+        return await self.send_reply(reply, room_id)
+
+    async def send_reply(self, reply, room_id):
+        """
+        Send a callback's reply: a string, a Response or a list of Responses.
+        Lists are sent in order within each room, and to different rooms
+        concurrently.
+        :param reply: Callback result
+        :param room_id: Room the event came from
+        :return: Reply
+        """
+        if reply and isinstance(reply, Response):
+            await self.teams.create_message(**reply_payload(reply, room_id))
+            return "ok"
+        if reply and isinstance(reply, list):
+            rooms = {}
+            for response in reply:
+                if isinstance(response, Response):
+                    payload = reply_payload(response, room_id)
+                    rooms.setdefault(destination(payload), []).append(payload)
+
+            async def send_all(payloads):
+                failed = 0
+                for payload in payloads:
+                    try:
+                        await self.teams.create_message(**payload)
+                    except Exception as e:
+                        # Including connection errors and timeouts, so one
+                        # room's failure doesn't cancel the other rooms'
+                        failed += 1
+                        log.error("Error sending reply",
+                                  to=payload.get("roomId"), error=str(e))
+                return failed
+
+            results = await asyncio.gather(
+                *[send_all(p) for p in rooms.values()]
+            )
+            failed = sum(results)
+            if failed:
+                total = sum(len(p) for p in rooms.values())
+                return "{} of {} replies failed".format(failed, total)
+            return "ok"
+        if reply:
+            await self.teams.create_message(roomId=room_id, markdown=reply)
+        return reply
+
+    async def get_action(self, action_id):
+        """
+        A card submission, fetched only if it isn't cached.
+        :param action_id: attachmentAction id
+        :return: AttachmentAction
+        """
+        action = self.actions.lookup(action_id)
+        if action is None:
+            action = self.actions.store(
+                await self.teams.get_attachment_action(action_id)
+            )
+        return action
+
+    # *** Default Commands included in Bot
+    async def send_help(self, post_data):
+        """
+        Construct a help message for users.
+        :param post_data:
+        :return:
+        """
+        return self.help_text()
+
+    async def send_echo(self, post_data):
+        """
+        Sample command function that just echos back the sent message
+        :param post_data:
+        :return:
+        """
+        return self.extract_message("/echo", post_data.text)
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""Typed command arguments, parsed before the command's callback runs."""
+
+import re
+
+# Default of arguments that must be given
+REQUIRED = object()
+
+# A "double quoted" or 'single quoted' string, or a run of non-spaces
+_TOKEN_RE = re.compile(r'"([^"]*)"|\'([^\']*)\'|(\S+)')
+
+
+class UsageError(ValueError):
+    """The arguments of a command did not match its specification."""
+
+
+class Arguments(dict):
+    """Parsed arguments, by name, also readable as attributes."""
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Arg(object):
+    """A positional argument."""
+
+    def __init__(self, name, type=str, choices=None, default=REQUIRED,
+                 rest=False):
+        """
+        Initialize a new Arg
+
+        :param name: Name of the argument
+        :param type: Function converting the text, e.g. int or float
+        :param choices: Allowed values, matched without regard to case
+        :param default: Value when the argument is left out.  Without a
+                default the argument is required
+        :param rest: Take the rest of the message, spaces included.  Only
+                for the last positional argument
+        """
+        self.name = name
+        self.type = type
+        self.choices = choices
+        self.default = default
+        self.rest = rest
+
+    @property
+    def required(self):
+        return self.default is REQUIRED
+
+    def usage(self):
+        text = self.name + ("..." if self.rest else "")
+        if self.choices:
+            text = "|".join(str(c) for c in self.choices)
+        return "<%s>" % text if self.required else "[%s]" % text
+
+
+class Option(Arg):
+    """An optional --name value, or a --name flag."""
+
+    def __init__(self, name, type=str, choices=None, default=None,
+                 short=None, flag=False):
+        """
+        Initialize a new Option
+
+        :param name: Name of the option, given as --name
+        :param type: Function converting the text, e.g. int or float
+        :param choices: Allowed values, matched without regard to case
+        :param default: Value when the option is left out
+        :param short: Single letter alias, given as -s
+        :param flag: The option takes no value and is True when given
+        """
+        super(Option, self).__init__(name, type=type, choices=choices,
+                                     default=False if flag else default)
+        self.short = short
+        self.flag = flag
+
+    def usage(self):
+        text = "--" + self.name
+        if not self.flag:
+            text += " " + ("|".join(str(c) for c in self.choices)
+                           if self.choices else self.name.upper())
+        return "[%s]" % text
+
+
+def _converter(arg):
+    # One function per argument doing the type conversion and the choices
+    # check, so parse() only calls it
+    convert = arg.type
+    kind = getattr(convert, "__name__", "value")
+    choices = None
+    if arg.choices:
+        choices = dict((str(c).lower(), c) for c in arg.choices)
+
+    def converted(text):
+        if choices is not None:
+            try:
+                return choices[text.lower()]
+            except KeyError:
+                raise UsageError(
+                    "%s must be one of %s" % (arg.name, ", ".join(
+                        str(c) for c in arg.choices
+                    ))
+                )
+        try:
+            return convert(text)
+        except (TypeError, ValueError):
+            raise UsageError("%s must be %s %s, not %r" % (
+                arg.name, "an" if kind[:1] in "aeiou" else "a", kind, text
+            ))
+
+    if convert is str and choices is None:
+        return str
+    return converted
+
+
+class ArgumentSpec(object):
+    """
+    A command's arguments, compiled once into lookup tables so that parsing
+    a message is a single pass over its words.
+    """
+
+    def __init__(self, args):
+        """
+        Initialize a new ArgumentSpec
+
+        :param args: List of Arg and Option
+        """
+        self.args = list(args)
+        self.positional = [a for a in self.args if not isinstance(a, Option)]
+        self.options = [a for a in self.args if isinstance(a, Option)]
+
+        names = [a.name for a in self.args]
+        if len(set(names)) != len(names):
+            raise ValueError("Argument names must be unique")
+        for arg in self.positional[:-1]:
+            if arg.rest:
+                raise ValueError("Only the last argument can take the rest")
+        seen_optional = False
+        for arg in self.positional:
+            if arg.required and seen_optional:
+                raise ValueError("Required argument %r follows an optional "
+                                 "one" % arg.name)
+            seen_optional = seen_optional or not arg.required
+
+        # "--name" and "-s": (name, converter or None for flags)
+        self._options = {}
+        for option in self.options:
+            entry = (option.name, None if option.flag else _converter(option))
+            self._options["--" + option.name] = entry
+            if option.short:
+                self._options["-" + option.short] = entry
+        self._positional = [(a.name, _converter(a), a.rest)
+                            for a in self.positional]
+        self._required = sum(1 for a in self.positional if a.required)
+        self._defaults = dict((a.name, a.default) for a in self.args
+                              if not a.required)
+
+    def usage(self, command):
+        """
+        Usage line of the command.
+        :param command: The command, example "/roll"
+        :return: str
+        """
+        return " ".join([command] + [a.usage() for a in self.args])
+
+    def parse(self, text):
+        """
+        Parse the text following a command.
+        :param text: Message text after the command
+        :return: Arguments
+        :raises UsageError: If the text does not match the specification
+        """
+        ret = Arguments(self._defaults)
+        positional = self._positional
+        index = 0
+        tokens = _TOKEN_RE.finditer(text or "")
+        for match in tokens:
+            token = match.group(3)
+            if token is not None and token.startswith("-") and \
+                    len(token) > 1 and not _is_number(token):
+                value = None
+                if "=" in token:
+                    token, value = token.split("=", 1)
+                entry = self._options.get(token)
+                if entry is None:
+                    raise UsageError("Unknown option %s" % token)
+                name, convert = entry
+                if convert is None:
+                    if value is not None:
+                        raise UsageError("%s takes no value" % token)
+                    ret[name] = True
+                    continue
+                if value is None:
+                    following = next(tokens, None)
+                    if following is None:
+                        raise UsageError("%s needs a value" % token)
+                    value = _text(following)
+                ret[name] = convert(value)
+                continue
+
+            if index >= len(positional):
+                raise UsageError("Unexpected argument %r" % _text(match))
+            name, convert, rest = positional[index]
+            index += 1
+            if rest:
+                ret[name] = convert(text[match.start():].strip())
+                break
+            ret[name] = convert(_text(match))
+
+        if index < self._required:
+            raise UsageError("Missing %s" % positional[index][0])
+        return ret
+
+
+def _text(match):
+    for group in match.groups():
+        if group is not None:
+            return group
+    return ""
+
+
+def _is_number(token):
+    # "-5" is a negative number rather than an option
+    try:
+        float(token)
+    except ValueError:
+        return False
+    return True
+
+
+def compile_arguments(args):
+    """
+    The ArgumentSpec of an add_command() args parameter.
+    :param args: ArgumentSpec, or list of Arg and Option
+    :return: ArgumentSpec, or None for commands without arguments
+    """
+    if args is None or isinstance(args, ArgumentSpec):
+        return args
+    return ArgumentSpec(args)
+
+
+def command_usage(command, spec):
+    """
+    Usage line of a command, for the help message.
+    :param command: The command
+    :param spec: Its ArgumentSpec, or None
+    :return: str
+    """
+    return spec.usage(command) if spec is not None else command
+
+
+def command_text(command, text):
+    """
+    The text following a command in a message, matching the command
+    without regard to case.
+    :param command: The command, lower case
+    :param text: Message text
+    :return: str
+    """
+    text = text or ""
+    at = text.lower().find(command)
+    return text[at + len(command):] if at != -1 else ""
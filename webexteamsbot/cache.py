@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""The TTL and LRU bookkeeping shared by the bot's in-process caches."""
+
+from collections import OrderedDict
+
+
+class _Entry(object):
+    __slots__ = ("value", "expires", "size")
+
+    def __init__(self, value, expires, size):
+        self.value = value
+        self.expires = expires
+        self.size = size
+
+
+class TTLCache(object):
+    """
+    Entries with an expiry time, kept in least recently used order, with a
+    cap on their number and optionally on their total size.
+
+    Expired entries are dropped when they are looked up, or when they reach
+    the least recently used end while an entry is stored, so there is no
+    sweep over every entry.  The cache does no locking of its own: callers
+    hold their lock around each call, which lets them combine calls into
+    one atomic operation.  Times come from the caller too, so each cache
+    can use the clock that suits it.
+    """
+
+    def __init__(self, max_size, max_bytes=None):
+        """
+        Initialize a new TTLCache
+
+        :param max_size: Maximum number of entries kept
+        :param max_bytes: Maximum total size of the entries, as given to
+                put().  None for no limit
+        """
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, now, default=None):
+        """
+        An unexpired entry's value, marking it as recently used.
+        :param key: Key
+        :param now: Current time
+        :param default: Returned if the key is absent or expired
+        :return: The value
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry.expires is not None and entry.expires <= now:
+            self._drop(key)
+            self.expirations += 1
+            return default
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def expires(self, key):
+        """
+        When an entry expires.
+        :param key: Key of a present entry
+        :return: Time, or None if it doesn't
+        """
+        return self._entries[key].expires
+
+    def put(self, key, value, expires, now, size=0):
+        """
+        Store an entry, then drop expired entries from the least recently
+        used end and evict entries beyond the caps.  The entry just stored
+        is kept even if it is over the size limit on its own.
+        :param key: Key
+        :param value: Value
+        :param expires: Time the entry expires, or None
+        :param now: Current time
+        :param size: Size counted against max_bytes
+        :return:
+        """
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = _Entry(value, expires, size)
+        self.bytes += size
+        while self._entries:
+            oldest, entry = next(iter(self._entries.items()))
+            expired = entry.expires is not None and entry.expires <= now
+            over = len(self._entries) > self.max_size or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            )
+            if not (expired or over) or oldest == key:
+                break
+            self._drop(oldest)
+            if expired:
+                self.expirations += 1
+            else:
+                self.evictions += 1
+
+    def pop(self, key):
+        """
+        Remove an entry, if present.
+        :param key: Key
+        :return:
+        """
+        if key in self._entries:
+            self._drop(key)
+
+    def _drop(self, key):
+        self.bytes -= self._entries.pop(key).size
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        # Keys, least recently used first
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
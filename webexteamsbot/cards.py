@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""Adaptive Card templates, compiled once and rendered per message."""
+
+import json
+import re
+
+from webexteamsbot.models import Response
+
+CONTENT_TYPE = "application/vnd.microsoft.card.adaptive"
+
+# ${name} or ${dotted.path}
+_SLOT_RE = re.compile(r"\$\{([A-Za-z_][\w.]*)\}")
+
+
+class CardDataError(KeyError):
+    """Data for a card binding slot is missing."""
+
+
+class _Slot(object):
+    """A string that is exactly one slot, replaced by the value as is."""
+
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+    def render(self, data):
+        return _lookup(data, self.path)
+
+
+class _Text(object):
+    """A string with slots inside it, rendered as a string."""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, parts):
+        # Literal strings and slot paths (tuples), alternating
+        self.parts = parts
+
+    def render(self, data):
+        return "".join(
+            p if isinstance(p, str) else _text(_lookup(data, p))
+            for p in self.parts
+        )
+
+
+class _Dict(object):
+    """A dict with slots somewhere below it."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        # (key, compiled value, whether the value has slots)
+        self.items = items
+
+    def render(self, data):
+        return {k: v.render(data) if dynamic else v
+                for k, v, dynamic in self.items}
+
+
+class _List(object):
+    """A list with slots somewhere below it."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+    def render(self, data):
+        return [v.render(data) if dynamic else v for v, dynamic in self.items]
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return ""
+    return str(value)
+
+
+def _lookup(data, path):
+    value = data
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, TypeError, IndexError):
+            try:
+                value = getattr(value, key)
+            except AttributeError:
+                raise CardDataError(
+                    "No card data for ${{{}}}".format(".".join(path))
+                )
+    return value
+
+
+def _path(name):
+    return tuple(int(p) if p.isdigit() else p for p in name.split("."))
+
+
+def compile_template(value):
+    """
+    Compile a JSON value with ${...} binding slots.  Parts without slots
+    are kept as they are and shared by every render.
+    :param value: Decoded JSON
+    :return: (compiled, whether it has slots)
+    """
+    if isinstance(value, str):
+        matches = list(_SLOT_RE.finditer(value))
+        if not matches:
+            return value, False
+        if len(matches) == 1 and matches[0].group(0) == value:
+            return _Slot(_path(matches[0].group(1))), True
+        parts = []
+        pos = 0
+        for m in matches:
+            if m.start() > pos:
+                parts.append(value[pos:m.start()])
+            parts.append(_path(m.group(1)))
+            pos = m.end()
+        if pos < len(value):
+            parts.append(value[pos:])
+        return _Text(tuple(parts)), True
+    if isinstance(value, dict):
+        items = []
+        for k, v in value.items():
+            items.append((k,) + compile_template(v))
+        if not any(dynamic for _, _, dynamic in items):
+            return value, False
+        return _Dict(tuple(items)), True
+    if isinstance(value, list):
+        items = [compile_template(v) for v in value]
+        if not any(dynamic for _, dynamic in items):
+            return value, False
+        return _List(tuple(items)), True
+    return value, False
+
+
+class CardTemplate(object):
+    """
+    An Adaptive Card with ${name} binding slots.
+
+    A string that is exactly one slot, like "${facts}", is replaced by the
+    value as is, so lists and objects can be bound.  Slots inside longer
+    strings are replaced by the value as text.  Dotted names look up
+    nested keys or attributes: "${user.name}".
+
+    The card is compiled once.  Rendering only rebuilds the dicts and
+    lists that contain slots, and shares everything else with the
+    template, so rendered cards must not be modified.
+    """
+
+    def __init__(self, name, card, fallback=None):
+        """
+        Initialize a new CardTemplate
+
+        :param name: Name of the card
+        :param card: The card, as a dict or JSON string: either the
+                AdaptiveCard itself or an attachment with contentType and
+                content
+        :param fallback: Markdown sent along with the card for clients that
+                cannot show cards.  May contain slots too.
+        """
+        if isinstance(card, str):
+            card = json.loads(card)
+        if "contentType" not in card:
+            card = {"contentType": CONTENT_TYPE, "content": card}
+        self.name = name
+        self.attachment, self.dynamic = compile_template(card)
+        self.fallback, self.dynamic_fallback = compile_template(
+            fallback or ""
+        )
+        self._response = None
+        if not self.dynamic and not self.dynamic_fallback:
+            self._response = Response.template(
+                markdown=self.fallback or None,
+                attachments=[self.attachment],
+            )
+
+    def render(self, data=None, **kwargs):
+        """
+        The card attachment with the slots filled in.
+        :param data: dict, or object with attributes, of slot values
+        :param kwargs: More slot values
+        :return: Attachment dict, for Response.attachments
+        """
+        if not self.dynamic:
+            return self.attachment
+        return self.attachment.render(_data(data, kwargs))
+
+    def response(self, data=None, **kwargs):
+        """
+        A Response sending the rendered card, with the rendered fallback
+        as its markdown.
+        :param data: Slot values
+        :param kwargs: More slot values
+        :return: Response
+        """
+        if self._response is not None:
+            return self._response.clone()
+        data = _data(data, kwargs)
+        fallback = self.fallback
+        if self.dynamic_fallback:
+            fallback = fallback.render(data)
+        attachment = self.attachment.render(data) if self.dynamic \
+            else self.attachment
+        return Response(markdown=fallback or None, attachments=[attachment])
+
+
+def _data(data, kwargs):
+    if not kwargs:
+        return data if data is not None else {}
+    if data is None:
+        return kwargs
+    merged = dict(data)
+    merged.update(kwargs)
+    return merged
+
+
+class CardRegistry(object):
+    """Card templates by name."""
+
+    def __init__(self):
+        self.templates = {}
+
+    def register(self, name, card, fallback=None):
+        """
+        Compile and register a card.
+        :param name: Name of the card
+        :param card: The card, as a dict or JSON string
+        :param fallback: Markdown for clients that cannot show cards
+        :return: CardTemplate
+        """
+        template = CardTemplate(name, card, fallback=fallback)
+        self.templates[name] = template
+        return template
+
+    def get(self, name):
+        """
+        A registered card.
+        :param name: Name of the card
+        :return: CardTemplate
+        """
+        try:
+            return self.templates[name]
+        except KeyError:
+            raise KeyError("No card named {!r}".format(name))
+
+    def render(self, name, data=None, **kwargs):
+        """
+        Render a registered card.
+        :param name: Name of the card
+        :param data: Slot values
+        :param kwargs: More slot values
+        :return: Attachment dict
+        """
+        return self.get(name).render(data, **kwargs)
+
+    def response(self, name, data=None, **kwargs):
+        """
+        A Response sending a registered card.  Return it from a command,
+        or set its roomId first to send it elsewhere.
+        :param name: Name of the card
+        :param data: Slot values
+        :param kwargs: More slot values
+        :return: Response
+        """
+        return self.get(name).response(data, **kwargs)
+
+    def __contains__(self, name):
+        return name in self.templates
+
+    def __len__(self):
+        return len(self.templates)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""Shared, connection pooled Webex Teams API client."""
+
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from webexteamssdk import WebexTeamsAPI
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with separate connect and read timeouts.
+
+    webexteamssdk only supports a single timeout value per request, so the
+    adapter replaces it with a (connect, read) pair when either is set.
+
+    Since every request made through the shared client passes through the
+    adapter, it can also report each request to an ``observer``, called
+    with (request, response, seconds).  response is None if the request
+    failed without one.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None,
+                 observer=None, **kwargs):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.observer = observer
+        super(PooledHTTPAdapter, self).__init__(**kwargs)
+
+    def resolve_timeout(self, timeout):
+        """
+        Combine the configured timeouts with the one given for a request.
+        :param timeout: Timeout passed in with the request
+        :return: Timeout to use for the request
+        """
+        if self.connect_timeout is None and self.read_timeout is None:
+            return timeout
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+        else:
+            connect = read = timeout
+        if self.connect_timeout is not None:
+            connect = self.connect_timeout
+        if self.read_timeout is not None:
+            read = self.read_timeout
+        return (connect, read)
+
+    def send(self, request, timeout=None, **kwargs):
+        if self.observer is None:
+            return super(PooledHTTPAdapter, self).send(
+                request, timeout=self.resolve_timeout(timeout), **kwargs
+            )
+        start = time.perf_counter()
+        response = None
+        try:
+            response = super(PooledHTTPAdapter, self).send(
+                request, timeout=self.resolve_timeout(timeout), **kwargs
+            )
+            return response
+        finally:
+            self.observer(request, response, time.perf_counter() - start)
+
+
+def create_http_adapter(
+    pool_size=10,
+    connect_timeout=None,
+    read_timeout=None,
+    max_retries=0,
+    retry_backoff=0.5,
+):
+    """
+    Create the connection pool used by one or more WebexTeamsAPI objects.
+
+    :param pool_size: Maximum number of pooled connections per host
+    :param connect_timeout: Seconds to wait for a connection
+    :param read_timeout: Seconds to wait for a response
+    :param max_retries: Retries for failed connections and 5xx responses
+            on idempotent requests
+    :param retry_backoff: Backoff factor between retries
+    :return: PooledHTTPAdapter
+    """
+    retries = Retry(
+        total=max_retries,
+        backoff_factor=retry_backoff,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False,
+    )
+    return PooledHTTPAdapter(
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retries,
+    )
+
+
+def create_teams_api(
+    access_token,
+    base_url=None,
+    pool_size=10,
+    keep_alive=True,
+    connect_timeout=None,
+    read_timeout=None,
+    max_retries=0,
+    retry_backoff=0.5,
+    wait_on_rate_limit=True,
+    adapter=None,
+):
+    """
+    Create a WebexTeamsAPI object whose HTTP session uses a tuned
+    connection pool.  One of these should be shared by everything in a bot.
+
+    :param access_token: Teams Auth Token
+    :param base_url: URL to the Teams/Webex API endpoint
+    :param pool_size: Maximum number of pooled connections per host
+    :param keep_alive: Reuse connections between requests
+    :param connect_timeout: Seconds to wait for a connection
+    :param read_timeout: Seconds to wait for a response
+    :param max_retries: Retries for failed connections and 5xx responses
+            on idempotent requests
+    :param retry_backoff: Backoff factor between retries
+    :param wait_on_rate_limit: Let webexteamssdk sleep and retry on 429
+    :param adapter: Existing adapter to share a connection pool with.
+            The pool settings above are ignored when given.
+    :return: WebexTeamsAPI
+    """
+    kwargs = dict(access_token=access_token,
+                  wait_on_rate_limit=wait_on_rate_limit)
+    if base_url:
+        kwargs["base_url"] = base_url
+    api = WebexTeamsAPI(**kwargs)
+
+    if adapter is None:
+        adapter = create_http_adapter(
+            pool_size=pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_retries=max_retries,
+            retry_backoff=retry_backoff,
+        )
+
+    # webexteamssdk does not expose its requests session
+    session = api._session._req_session
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return api
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""Command and Adaptive Card registry shared by TeamsBot and AsyncTeamsBot."""
+
+from webexteamsbot.actions import ActionRouter, tag_submit_actions
+from webexteamsbot.arguments import command_usage, compile_arguments
+from webexteamsbot.cards import CardRegistry
+from webexteamsbot.matcher import CommandMatcher
+
+
+class CommandRegistry(object):
+    """
+    Mixin keeping a bot's commands, help message and cards.
+
+    The bot provides send_echo() and send_help(), plain functions or
+    coroutine functions, and calls _init_commands() while it initializes.
+    """
+
+    def _init_commands(self):
+        # A dictionary of commands this bot listens to
+        # Each key in the dictionary is a command, with associated help
+        # text and callback function
+        # By default supports 2 command, /echo and /help
+        self.commands = {
+            "/echo": {
+                "help": "Reply back with the same message sent.",
+                "callback": self.send_echo,
+            },
+            "/help": {"help": "Get help.", "callback": self.send_help},
+        }
+        # Compiled matcher and rendered help for the commands, rebuilt
+        # when the commands change
+        self._command_matcher = None
+        self._help_text = None
+        self._help_size = 0
+
+        # Adaptive Card templates, compiled when they are added, and the
+        # handlers their submissions are routed to by card name
+        self.cards = CardRegistry()
+        self.card_actions = ActionRouter()
+
+        # Set default help message
+        self.help_message = "Hello!  I understand the following commands:  \n"
+
+    def add_command(self, command, help_message, callback, args=None):
+        """
+        Add a new command to the bot
+        :param command: The command string, example "/status"
+        :param help_message: A Help string for this command
+        :param callback: The function to run when this command is given.
+                AsyncTeamsBot also takes coroutine functions
+        :param args: List of Arg and Option from webexteamsbot.arguments.
+                When given, the callback is called with the message and
+                the parsed Arguments, and messages whose arguments don't
+                match get a usage error instead
+        :return:
+        """
+        self.commands[command.lower()] = {"help": help_message,
+                                          "callback": callback,
+                                          "args": compile_arguments(args)}
+        self._commands_changed()
+
+    def add_card(self, name, card, fallback=None, on_submit=None):
+        """
+        Register an Adaptive Card template.  Return
+        bot.cards.response(name, data) from a command to send it.
+        :param name: Name of the card
+        :param card: The card, as a dict or JSON string, with ${name}
+                binding slots
+        :param fallback: Markdown for clients that cannot show cards
+        :param on_submit: Called with the AttachmentAction when the card
+                is submitted.  The card's Action.Submit actions are tagged
+                with its name so submissions find their way back here.
+        :return: CardTemplate
+        """
+        if on_submit is not None:
+            card = tag_submit_actions(card, name)
+            self.card_actions.add(name, on_submit)
+        return self.cards.register(name, card, fallback=fallback)
+
+    def add_card_action(self, card, callback, action=None):
+        """
+        Handle submissions of a card.  Submissions are routed by the
+        "card" and "action" keys of the Action.Submit data, e.g.
+        {"type": "Action.Submit", "data": {"card": "vote", "action": "yes"}}
+        :param card: Card name
+        :param callback: Called with the AttachmentAction, returns a reply
+                like a command callback
+        :param action: Only handle submissions with this action name
+        :return:
+        """
+        self.card_actions.add(card, callback, action=action)
+
+    def remove_command(self, command):
+        """
+        Remove a command from the bot
+        :param command: The command string, example "/status"
+        :return:
+        """
+        del self.commands[command]
+        self._commands_changed()
+
+    def _commands_changed(self):
+        self._command_matcher = None
+        self._help_text = None
+
+    def find_command(self, text):
+        """
+        Find the command contained in a message, if any.  When several
+        commands are present the first one in sorted order wins.
+        :param text: Message text to search
+        :return: The command string, or "" if no command was found
+        """
+        matcher = self._command_matcher
+        # Rebuild after add_command/remove_command, or if self.commands
+        # was modified directly
+        if matcher is None or len(matcher) != len(self.commands):
+            matcher = CommandMatcher(self.commands.keys())
+            self._command_matcher = matcher
+        return matcher.match((text or "").lower()) or ""
+
+    # noinspection PyMethodMayBeStatic
+    def extract_message(self, command, text):
+        """
+        Return message contents following a given command.
+        :param command: Command to search for.  Example "/echo"
+        :param text: text to search within.
+        :return:
+        """
+        cmd_loc = text.find(command)
+        message = text[cmd_loc + len(command):]
+        return message
+
+    def set_greeting(self, callback):
+        """
+        Configure the response provided by the bot when no command is found.
+        :param callback: The function to run to create and return the greeting.
+        :return:
+        """
+        self.add_command(
+            command="/greeting", help_message="*", callback=callback
+        )
+        self.default_action = "/greeting"
+
+    def set_help_message(self, msg):
+        """
+        Configure the banner for the help message.
+        Command list will be appended to this later.
+        :return:
+        """
+        self.help_message = msg
+        self._help_text = None
+
+    def help_text(self):
+        """
+        The help message: the banner followed by the commands' usage.
+        :return: str
+        """
+        message = self._help_text
+        # Rebuild after the commands or banner change, including when
+        # self.commands was modified directly
+        if message is None or self._help_size != len(self.commands):
+            message = self.help_message + "".join(
+                "* **%s**: %s \n" % (
+                    command_usage(command, info.get("args")), info["help"]
+                )
+                for command, info in sorted(self.commands.items())
+                if not info["help"].startswith("*")
+            )
+            self._help_size = len(self.commands)
+            self._help_text = message
+        return message
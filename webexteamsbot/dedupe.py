@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""Detect redelivered webhooks so each event is processed once."""
+
+import threading
+import time
+
+from webexteamsbot.cache import TTLCache
+
+
+class DedupeBackend(object):
+    """
+    Storage for seen event keys.
+
+    Backends must make add() atomic so that two workers receiving the same
+    event at once cannot both process it.
+    """
+
+    def add(self, key, ttl):
+        """
+        Record a key unless it is already present and unexpired.
+        :param key: Event key
+        :param ttl: Seconds to remember the key
+        :return: True if the key was added, False if it was already present
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Forget a key.
+        :param key: Event key
+        :return:
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+
+class MemoryDedupeBackend(DedupeBackend):
+    """In-process backend with TTL expiry and LRU eviction."""
+
+    def __init__(self, max_size=10000):
+        """
+        Initialize a new MemoryDedupeBackend
+
+        :param max_size: Maximum number of keys remembered
+        """
+        self.max_size = max_size
+        self._keys = TTLCache(max_size)
+        self._lock = threading.Lock()
+
+    @property
+    def evictions(self):
+        return self._keys.evictions
+
+    def add(self, key, ttl):
+        now = time.monotonic()
+        with self._lock:
+            if self._keys.get(key, now) is not None:
+                return False
+            self._keys.put(key, True, now + ttl, now)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._keys.pop(key)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class StateDedupeBackend(DedupeBackend):
+    """
+    Backend keeping seen events in a StateBackend, so worker processes
+    sharing it process each event once between them.
+    """
+
+    def __init__(self, state, prefix="dedupe:"):
+        """
+        Initialize a new StateDedupeBackend
+
+        :param state: StateBackend
+        :param prefix: Prefix of the event keys
+        """
+        self.state = state
+        self.prefix = prefix
+
+    def add(self, key, ttl):
+        return self.state.add(self.prefix + key, 1, ttl)
+
+    def delete(self, key):
+        self.state.delete(self.prefix + key)
+
+
+class DedupeCache(object):
+    """
+    Remember which webhook events have been processed.
+
+    Events are identified by resource, event and the id of the data they
+    refer to, so a redelivery of the same webhook is recognised even though
+    Webex gives each delivery the same payload.
+    """
+
+    def __init__(self, backend=None, ttl=300, max_size=10000):
+        """
+        Initialize a new DedupeCache
+
+        :param backend: DedupeBackend.  Defaults to a MemoryDedupeBackend
+        :param ttl: Seconds to remember an event
+        :param max_size: Size of the default in-memory backend
+        """
+        if backend is None:
+            backend = MemoryDedupeBackend(max_size=max_size)
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    # noinspection PyMethodMayBeStatic
+    def key(self, post_data):
+        """
+        Key identifying the event in a webhook payload.
+        :param post_data: Decoded webhook payload
+        :return: Key string, or None if the payload has no data id
+        """
+        try:
+            return "%s:%s:%s" % (
+                post_data["resource"],
+                post_data.get("event"),
+                post_data["data"]["id"],
+            )
+        except (KeyError, TypeError, AttributeError):
+            return None
+
+    def seen(self, post_data):
+        """
+        Check whether an event was already processed, recording it if not.
+        :param post_data: Decoded webhook payload
+        :return: True if the event is a duplicate
+        """
+        key = self.key(post_data)
+        if key is None:
+            return False
+        if self.backend.add(key, self.ttl):
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def forget(self, post_data):
+        """
+        Forget an event, so a redelivery is processed again.
+        :param post_data: Decoded webhook payload
+        :return:
+        """
+        key = self.key(post_data)
+        if key is not None:
+            self.backend.delete(key)
+
+    def stats(self):
+        """
+        Dedupe counters.
+        :return: dict
+        """
+        total = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=float(self.hits) / total if total else 0.0,
+            size=len(self.backend),
+            evictions=getattr(self.backend, "evictions", 0),
+        )
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent delivery of reply messages with per-room ordering."""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+
+def destination(payload):
+    """
+    The conversation a message payload is sent to.
+    :param payload: messages.create() keyword arguments
+    :return: Hashable destination key
+    """
+    for key in ("roomId", "toPersonId", "toPersonEmail"):
+        if payload.get(key):
+            return (key, payload[key])
+    return None
+
+
+def reply_payload(response, room_id):
+    """
+    The messages.create() arguments for a Response returned by a command.
+    Responses without a destination are sent to the room the command
+    came from.  The Response itself is not changed, so templates and
+    Responses reused across events can be returned as they are.
+    :param response: Response
+    :param room_id: Room the event came from
+    :return: dict
+    """
+    payload = response.as_dict()
+    if destination(payload) is None:
+        payload = dict(payload, roomId=room_id)
+    return payload
+
+
+class DeliveryResult(object):
+    """Outcome of sending one message."""
+
+    __slots__ = ("payload", "message", "error")
+
+    def __init__(self, payload, message=None, error=None):
+        self.payload = payload
+        self.message = message
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "DeliveryResult(ok)"
+        return "DeliveryResult(error=%r)" % (self.error,)
+
+
+class DeliveryEngine(object):
+    """
+    Send a batch of messages concurrently.
+
+    Messages for the same room are sent one after another, in order, while
+    messages for different rooms are sent in parallel on a thread pool.  A
+    failed send is recorded in its DeliveryResult and does not stop the
+    remaining messages.
+    """
+
+    def __init__(self, send, workers=4, executor=None):
+        """
+        Initialize a new DeliveryEngine
+
+        :param send: Function called with the keyword arguments for one
+                message, returning the created message
+        :param workers: Maximum number of rooms sent to in parallel
+        :param executor: Executor shared with other engines, used instead
+                of a pool of our own.  It is not shut down by shutdown().
+        """
+        self.send = send
+        self.workers = workers
+        self.shared_executor = executor
+        self._executor = executor
+        self._lock = threading.Lock()
+
+        # Counters
+        self.sent = 0
+        self.failed = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers
+                )
+            return self._executor
+
+    def _send_all(self, payloads):
+        results = []
+        for payload in payloads:
+            try:
+                results.append(DeliveryResult(payload, self.send(payload)))
+            except Exception as e:
+                results.append(DeliveryResult(payload, error=e))
+        return results
+
+    def deliver(self, payloads):
+        """
+        Send messages, keeping the order within each room.
+        :param payloads: List of messages.create() keyword argument dicts
+        :return: List of DeliveryResult in the same order as payloads
+        """
+        # Group by destination, remembering each message's position
+        groups = {}
+        order = []
+        for i, payload in enumerate(payloads):
+            key = destination(payload)
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(i)
+
+        # Other rooms go to the pool, the first is sent on this thread
+        futures = []
+        if len(order) > 1 and self.workers > 1:
+            pool = self._pool()
+            for key in order[1:]:
+                batch = [payloads[i] for i in groups[key]]
+                futures.append((key, pool.submit(self._send_all, batch)))
+            order = order[:1]
+
+        results = [None] * len(payloads)
+        for key in order:
+            sent = self._send_all([payloads[i] for i in groups[key]])
+            for i, result in zip(groups[key], sent):
+                results[i] = result
+        for key, future in futures:
+            for i, result in zip(groups[key], future.result()):
+                results[i] = result
+
+        failed = sum(1 for r in results if not r.ok)
+        with self._lock:
+            self.sent += len(results) - failed
+            self.failed += failed
+        return results
+
+    def shutdown(self):
+        """
+        Stop the thread pool once pending sends finish.
+        :return:
+        """
+        with self._lock:
+            executor, self._executor = self._executor, self.shared_executor
+        if executor is not None and executor is not self.shared_executor:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        """
+        Delivery counters.
+        :return: dict of counters
+        """
+        with self._lock:
+            return dict(sent=self.sent, failed=self.failed,
+                        workers=self.workers)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""Serve many bots from one process."""
+
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+
+from flask import Flask, abort
+from webexteamsbot import logs
+from webexteamsbot.client import create_http_adapter
+from webexteamsbot.metrics import MetricsRegistry, render_registries
+from webexteamsbot.state import state_backend as create_state_backend
+from webexteamsbot.webexteamsbot import TeamsBot
+from webexteamsbot.workqueue import WorkQueue
+
+log = logs.get_logger(__name__)
+
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+
+class BotHost(Flask):
+    """
+    A web app hosting any number of bots, each with its own token.
+
+    Every bot's webhooks are received at <url>/<path>, and each keeps its
+    own commands, cards, caches and rate limits.  The expensive parts are
+    shared instead of created per bot: the HTTP connection pool, the
+    threads sending messages, the webhook queue and its workers, the
+    state backend (keys are prefixed by bot name) and the /metrics page,
+    where each bot's samples carry a bot label.  Idle bots keep no threads
+    of their own running.
+    """
+
+    def __init__(
+        self,
+        name="webexteamsbot",
+        url=None,
+        teams_api_url=None,
+        http_pool_size=10,
+        http_connect_timeout=None,
+        http_read_timeout=None,
+        http_max_retries=0,
+        http_retry_backoff=0.5,
+        webhook_workers=4,
+        webhook_queue_size=1000,
+        send_workers=8,
+        delivery_workers=8,
+        state_backend=None,
+        idle_timeout=30,
+    ):
+        """
+        Initialize a new BotHost
+
+        :param name: Name of the Flask app
+        :param url: Public URL of the host.  The bots' webhooks are created
+                at <url>/<path>.  When not set no webhooks are created.
+        :param teams_api_url: URL to the Teams/Webex API endpoint
+        :param http_pool_size: Maximum pooled connections to the Teams API,
+                shared by every bot.  Defaults to 10
+        :param http_connect_timeout: Seconds to wait for a connection
+        :param http_read_timeout: Seconds to wait for a response
+        :param http_max_retries: Retries for failed connections and 5xx
+                responses on idempotent requests.  Defaults to 0
+        :param http_retry_backoff: Backoff factor between retries
+        :param webhook_workers: Threads processing every bot's webhooks
+                from one queue.  0 processes them inline.  Defaults to 4
+        :param webhook_queue_size: Maximum webhooks waiting for a worker.
+                Defaults to 1000
+        :param send_workers: Threads sending every bot's messages.
+                Defaults to 8
+        :param delivery_workers: Threads sending lists of Responses to
+                several rooms, for every bot.  Defaults to 8
+        :param state_backend: StateBackend, or its URL, used by every bot
+                unless given its own.  Defaults to None (in memory)
+        :param idle_timeout: Seconds a bot's outbound dispatcher thread
+                waits for messages before exiting.  Defaults to 30
+        """
+        super(BotHost, self).__init__(name)
+        self.url = url.rstrip("/") if url else None
+        self.teams_api_url = teams_api_url
+        self.idle_timeout = idle_timeout
+        self.bots = {}
+        self._paths = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+        if isinstance(state_backend, str):
+            state_backend = create_state_backend(state_backend)
+        self.state = state_backend
+
+        # One connection pool for every bot.  Requests are timed into the
+        # metrics of the bot whose token made them.
+        self.http_adapter = create_http_adapter(
+            pool_size=http_pool_size,
+            connect_timeout=http_connect_timeout,
+            read_timeout=http_read_timeout,
+            max_retries=http_max_retries,
+            retry_backoff=http_retry_backoff,
+        )
+        self.http_adapter.observer = self._api_request
+
+        # Outbound sends and multi-room deliveries get separate pools, as
+        # deliveries wait on sends
+        self.send_executor = ThreadPoolExecutor(
+            max_workers=send_workers, thread_name_prefix=name + "-send"
+        )
+        self.delivery_executor = ThreadPoolExecutor(
+            max_workers=delivery_workers,
+            thread_name_prefix=name + "-delivery",
+        )
+
+        self.work_queue = None
+        if webhook_workers:
+            self.work_queue = WorkQueue(
+                None,
+                workers=webhook_workers,
+                maxsize=webhook_queue_size,
+                name=name,
+            )
+            self.work_queue.start()
+
+        # Host wide metrics, rendered with every bot's
+        self.registry = MetricsRegistry()
+        self.registry.collector("host", self.stats)
+        self.registry.collector("host_work_queue", self._queue_stats)
+
+        self.add_url_rule("/health", "health", self.health)
+        self.add_url_rule("/metrics", "metrics", self.export_metrics)
+        self.add_url_rule("/<path:bot_path>", "bot", self.process_webhook,
+                          methods=["POST"])
+
+    def add_bot(self, name, token, email, path=None, **kwargs):
+        """
+        Add a bot to the host.
+
+        :param name: Friendly name for the bot (webhook name), unique
+                within the host
+        :param token: Teams Auth Token for the bot account
+        :param email: Teams Bot Email Address
+        :param path: Path the bot's webhooks are received at.  Defaults to
+                the name, lower cased with runs of other characters
+                replaced by "-"
+        :param kwargs: Other TeamsBot options
+        :return: TeamsBot
+        """
+        path = (path or _SLUG_RE.sub("-", name.lower())).strip("/")
+        if not path:
+            raise ValueError("Bot %r needs a path" % name)
+        with self._lock:
+            if name in self.bots:
+                raise ValueError("A bot named %r already exists" % name)
+            if path in self._paths:
+                raise ValueError("Path %r is used by bot %r"
+                                 % (path, self._paths[path].teams_bot_name))
+            if token in self._tokens:
+                raise ValueError("Token is used by bot %r"
+                                 % self._tokens[token].teams_bot_name)
+            # Reserved before the bot is created, as that may take a while
+            self.bots[name] = self._paths[path] = self._tokens[token] = None
+
+        kwargs.setdefault("teams_api_url", self.teams_api_url)
+        if self.url:
+            kwargs.setdefault("teams_bot_url", self.url + "/" + path)
+        try:
+            bot = TeamsBot(name, teams_bot_token=token,
+                           teams_bot_email=email, host=self, **kwargs)
+        except Exception:
+            with self._lock:
+                del self.bots[name], self._paths[path], self._tokens[token]
+            raise
+        with self._lock:
+            self.bots[name] = self._paths[path] = self._tokens[token] = bot
+        log.info("Bot added to host", name=name, path="/" + path)
+        return bot
+
+    def bot_for_path(self, path):
+        """
+        The bot receiving webhooks at a path.
+        :param path: Path, without the leading /
+        :return: TeamsBot or None
+        """
+        return self._paths.get(path.strip("/"))
+
+    def process_webhook(self, bot_path):
+        """
+        Hand a webhook to the bot it was sent to.
+        :param bot_path: Path the webhook was posted to
+        :return:
+        """
+        bot = self.bot_for_path(bot_path)
+        if bot is None:
+            abort(404)
+        return bot.process_incoming_message()
+
+    def _api_request(self, request, response, seconds):
+        auth = request.headers.get("Authorization", "")
+        bot = self._tokens.get(auth[7:] if auth.startswith("Bearer ")
+                               else auth)
+        if bot is not None:
+            bot.metrics.api_request(request, response, seconds)
+
+    def _queue_stats(self):
+        return self.work_queue.stats() if self.work_queue else None
+
+    def health(self):
+        """
+        Flask App Health Check to verify Web App is up.
+        :return:
+        """
+        return "I'm Alive"
+
+    def render_metrics(self):
+        """
+        The host's and every bot's metrics, in the Prometheus text format.
+        :return: str
+        """
+        registries = [(self.registry, None)]
+        for name, bot in sorted(self.bots.items()):
+            if bot is not None:
+                registries.append((bot.metrics.registry, {"bot": name}))
+        return render_registries(registries)
+
+    def export_metrics(self):
+        """
+        Metrics in the Prometheus text format.
+        :return:
+        """
+        return (
+            self.render_metrics(),
+            200,
+            {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    def stop(self):
+        """
+        Send the messages still queued, then stop the shared threads.
+        :return:
+        """
+        if self.work_queue is not None:
+            self.work_queue.stop()
+        for bot in list(self.bots.values()):
+            if bot is not None:
+                bot.outbound.stop()
+                bot.delivery.shutdown()
+        self.delivery_executor.shutdown(wait=True)
+        self.send_executor.shutdown(wait=True)
+
+    def stats(self):
+        """
+        Number of bots and live threads.
+        :return: dict of counters
+        """
+        return dict(bots=len(self.bots), threads=threading.active_count())
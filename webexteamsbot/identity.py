@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Cached identity of the bot account."""
+
+import threading
+import time
+
+from webexteamssdk.models.immutable import immutable_data_factory
+
+
+class BotIdentity(object):
+    """
+    Lazily resolved, cached copy of the bot's own person record.
+
+    The record is fetched with people.me() the first time it is needed and
+    then reused until it is older than ``ttl`` seconds or until refresh()
+    or invalidate() is called explicitly.  With a StateBackend, processes
+    sharing it fetch the record once between them.
+    """
+
+    def __init__(self, teams, ttl=3600, state=None, state_key="identity"):
+        """
+        Initialize a new BotIdentity
+
+        :param teams: WebexTeamsAPI object used to look up the bot account
+        :param ttl: Seconds before the cached identity is refreshed.
+                None or 0 keeps it until refreshed explicitly.
+        :param state: StateBackend to share the record through
+        :param state_key: Key of the record in ``state``
+        """
+        self.teams = teams
+        self.ttl = ttl
+        self.state = state
+        self.state_key = state_key
+        self._person = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+
+        # Counters
+        self.lookups = 0
+        self.api_calls = 0
+
+    def _expired(self):
+        if self._person is None:
+            return True
+        if not self.ttl:
+            return False
+        return time.time() - self._fetched_at > self.ttl
+
+    def refresh(self):
+        """
+        Fetch the bot identity from Webex Teams, replacing the cached copy.
+        :return: The bot's person object
+        """
+        with self._lock:
+            return self._refresh(shared=False)
+
+    def _refresh(self, shared=True):
+        person = None
+        if shared and self.state is not None:
+            data = self.state.get(self.state_key)
+            if data is not None:
+                person = immutable_data_factory("person", data)
+        if person is None:
+            person = self.teams.people.me()
+            self.api_calls += 1
+            if self.state is not None:
+                self.state.set(self.state_key, person.to_dict(),
+                               ttl=self.ttl or None)
+        self._person = person
+        self._fetched_at = time.time()
+        return person
+
+    def invalidate(self):
+        """
+        Drop the cached identity so the next lookup fetches it again.
+        :return:
+        """
+        with self._lock:
+            self._person = None
+            self._fetched_at = 0
+            if self.state is not None:
+                self.state.delete(self.state_key)
+
+    def get(self):
+        """
+        Return the bot's person object, fetching it only when needed.
+        :return: The bot's person object
+        """
+        self.lookups += 1
+        person = self._person
+        if not self._expired():
+            return person
+        with self._lock:
+            # Another thread may have refreshed while we waited
+            if self._expired():
+                return self._refresh()
+            return self._person
+
+    @property
+    def id(self):
+        return self.get().id
+
+    @property
+    def emails(self):
+        return self.get().emails
+
+    @property
+    def display_name(self):
+        return self.get().displayName
+
+    def is_self(self, person_id):
+        """
+        Check whether a personId belongs to the bot itself.
+        :param person_id: personId to check
+        :return: True if the id is the bot's own id
+        """
+        return person_id == self.id
+
+    @property
+    def api_calls_saved(self):
+        """Number of lookups answered from the cache."""
+        return self.lookups - self.api_calls
+
+    def stats(self):
+        """
+        Counters describing cache effectiveness.
+        :return: dict of counters
+        """
+        return dict(
+            lookups=self.lookups,
+            api_calls=self.api_calls,
+            api_calls_saved=self.api_calls_saved,
+        )
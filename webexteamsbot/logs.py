@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+"""Structured logging, written out by a background thread."""
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+
+# Parent of every logger in the package
+LOGGER_NAME = "webexteamsbot"
+
+# The event being handled in the current thread or task
+_EVENT = contextvars.ContextVar("webexteamsbot_log_event", default=None)
+
+
+class _Event(object):
+    __slots__ = ("sampled", "fields")
+
+    def __init__(self, sampled, fields):
+        self.sampled = sampled
+        self.fields = fields
+
+
+def get_logger(name):
+    """
+    Logger for a module of the package.
+    :param name: Module name
+    :return: EventLogger
+    """
+    return EventLogger(logging.getLogger(name))
+
+
+def bind(**fields):
+    """
+    Add fields to every record logged for the current event.
+    :param fields: Field names and values
+    :return:
+    """
+    event = _EVENT.get()
+    if event is not None:
+        event.fields.update(fields)
+
+
+class EventLogger(object):
+    """
+    Wraps a logging.Logger to take structured fields as keyword arguments:
+
+        log.info("Message received", room=room_id, person=email)
+
+    Records logged while an event is handled carry the fields bound to the
+    event as well.  Records below WARNING are dropped before anything is
+    formatted when the level is disabled or the event was not sampled.
+    """
+
+    __slots__ = ("logger",)
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def enabled(self, level):
+        """
+        Whether a record at this level would be logged for the current
+        event.  Use it to skip building expensive fields.
+        :param level: logging level
+        :return: bool
+        """
+        if level < logging.WARNING:
+            event = _EVENT.get()
+            if event is not None and not event.sampled:
+                return False
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, exc_info=None, **fields):
+        if not self.enabled(level):
+            return
+        event = _EVENT.get()
+        if event is not None and event.fields:
+            fields = dict(event.fields, **fields)
+        self.logger.log(level, msg, exc_info=exc_info,
+                        extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self.log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg, **fields):
+        self.log(logging.INFO, msg, **fields)
+
+    def warning(self, msg, **fields):
+        self.log(logging.WARNING, msg, **fields)
+
+    def error(self, msg, **fields):
+        self.log(logging.ERROR, msg, **fields)
+
+    def exception(self, msg, **fields):
+        self.log(logging.ERROR, msg, exc_info=True, **fields)
+
+
+class LogSampler(object):
+    """
+    Decides per event whether its informational records are logged, so a
+    busy bot can log a fraction of its events in full.  Warnings and
+    errors are always logged.
+    """
+
+    def __init__(self, rate=1.0):
+        """
+        Initialize a new LogSampler
+
+        :param rate: Fraction of events to log, 0.0 to 1.0
+        """
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError("log sample rate must be between 0 and 1")
+        self.rate = rate
+
+        # Counters
+        self.events = 0
+        self.sampled = 0
+
+    def event(self, **fields):
+        """
+        Context manager for handling one event.
+        :param fields: Fields for every record logged for the event
+        :return: Context manager
+        """
+        sampled = self.rate >= 1.0 or random.random() < self.rate
+        self.events += 1
+        if sampled:
+            self.sampled += 1
+        return _EventScope(_Event(sampled, fields))
+
+    def stats(self):
+        """
+        Sampling counters.
+        :return: dict
+        """
+        return dict(rate=self.rate, events=self.events, sampled=self.sampled)
+
+
+class _EventScope(object):
+    __slots__ = ("event", "token")
+
+    def __init__(self, event):
+        self.event = event
+
+    def __enter__(self):
+        self.token = _EVENT.set(self.event)
+        return self.event
+
+    def __exit__(self, *exc):
+        _EVENT.reset(self.token)
+        return False
+
+
+def _text_value(value):
+    value = str(value)
+    if not value or any(c in value for c in ' "=\n'):
+        return json.dumps(value)
+    return value
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a record and its fields either as text,
+
+        2019-10-03 12:00:00,000 INFO webexteamsbot: Message received room=abc
+
+    or as one JSON object per line.
+    """
+
+    def __init__(self, json_lines=False, datefmt=None):
+        """
+        Initialize a new StructuredFormatter
+
+        :param json_lines: Write JSON objects instead of text
+        :param datefmt: strftime format for the time
+        """
+        super(StructuredFormatter, self).__init__(datefmt=datefmt)
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if self.json_lines:
+            data = dict(
+                time=self.formatTime(record, self.datefmt),
+                level=record.levelname,
+                logger=record.name,
+                message=record.getMessage(),
+            )
+            data.update(fields)
+            if record.exc_text:
+                data["exc_info"] = record.exc_text
+            return json.dumps(data, default=str)
+
+        line = "%s %s %s: %s" % (
+            self.formatTime(record, self.datefmt), record.levelname,
+            record.name, record.getMessage(),
+        )
+        if fields:
+            line += " " + " ".join(
+                "%s=%s" % (k, _text_value(v)) for k, v in fields.items()
+            )
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class StderrHandler(logging.StreamHandler):
+    """Writes to whatever sys.stderr is when a record is emitted."""
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a thread that passes them on to the real handlers,
+    so threads handling events never wait on log I/O.  When the queue is
+    full records are dropped and counted instead.
+    """
+
+    def __init__(self, handlers, queue_size=10000):
+        """
+        Initialize a new BackgroundHandler
+
+        :param handlers: Handlers the thread writes records to
+        :param queue_size: Maximum records waiting to be written
+        """
+        super(BackgroundHandler, self).__init__(queue.Queue(queue_size))
+        self.handlers = list(handlers)
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.handlers, respect_handler_level=True
+        )
+        self.running = False
+        self._lock = threading.Lock()
+
+        # Counters
+        self.dropped = 0
+
+    def start(self):
+        with self._lock:
+            if not self.running:
+                self.listener.start()
+                self.running = True
+
+    def stop(self):
+        """
+        Write out the queued records and stop the thread.
+        :return:
+        """
+        with self._lock:
+            if self.running:
+                self.listener.stop()
+                self.running = False
+
+    def flush(self):
+        """
+        Wait until the queued records have been written.
+        :return:
+        """
+        if self.running:
+            self.queue.join()
+        for handler in self.handlers:
+            handler.flush()
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, as the arguments may
+        # change before the thread gets to the record
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info
+            )
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        """
+        Queue counters.
+        :return: dict
+        """
+        return dict(queued=self.queue.qsize(), dropped=self.dropped)
+
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def configure_logging(level=logging.INFO, json_lines=False, stream=None,
+                      queue_size=10000):
+    """
+    Log the package's records through a BackgroundHandler.  Replaces the
+    handler from an earlier call.
+    :param level: Level for the package's logger
+    :param json_lines: Write JSON objects instead of text
+    :param stream: Stream to write to.  Defaults to sys.stderr.
+    :param queue_size: Maximum records waiting to be written
+    :return: The BackgroundHandler
+    """
+    global _handler
+    logger = logging.getLogger(LOGGER_NAME)
+    target = logging.StreamHandler(stream) if stream else StderrHandler()
+    target.setFormatter(StructuredFormatter(json_lines))
+    handler = BackgroundHandler([target], queue_size=queue_size)
+    handler.start()
+    with _handler_lock:
+        old, _handler = _handler, handler
+        logger.addHandler(handler)
+        if old is not None:
+            logger.removeHandler(old)
+        else:
+            atexit.register(_stop)
+        logger.setLevel(level)
+    if old is not None:
+        old.stop()
+    return handler
+
+
+def default_logging(level=None, json_lines=False):
+    """
+    Set up logging for a bot.  Records go to stderr through a
+    BackgroundHandler, unless the application has configured logging
+    itself.
+    :param level: Level for the package's logger, if not the default
+    :param json_lines: Write JSON objects instead of text
+    :return:
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    if _handler is None and not logger.handlers \
+            and not logging.getLogger().handlers:
+        configure_logging(level or logging.INFO, json_lines)
+    elif level is not None:
+        logger.setLevel(level)
+
+
+def _stop():
+    if _handler is not None:
+        _handler.stop()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""Multi-pattern matcher used to find commands in message text."""
+
+from collections import deque
+
+# Up to this many commands, checking each with str.find() beats walking
+# the automaton in Python (see benchmarks/bench_matcher.py)
+SCAN_THRESHOLD = 80
+
+
+class CommandMatcher(object):
+    """
+    Aho-Corasick automaton over a set of command strings.
+
+    match() scans the text once and returns the command that sorts first
+    among all commands found anywhere in the text, which is the same result
+    as checking each command in sorted order with str.find().
+
+    str.find() runs in C, so for a few commands checking each in turn is
+    faster than the automaton, which is only built for more than
+    ``threshold`` commands.
+    """
+
+    def __init__(self, commands=(), threshold=SCAN_THRESHOLD):
+        """
+        Initialize a new CommandMatcher
+
+        :param commands: Iterable of command strings to match
+        :param threshold: Largest number of commands checked one by one
+                instead of with the automaton
+        """
+        self.threshold = threshold
+        self.build(commands)
+
+    def build(self, commands):
+        """
+        (Re)compile the automaton for a set of commands.
+        :param commands: Iterable of command strings to match
+        :return:
+        """
+        patterns = sorted(set(commands))
+        self.patterns = patterns
+        self._goto = None
+        if len(patterns) <= self.threshold:
+            return
+        none = len(patterns)
+
+        # Trie of the patterns.  best[state] is the rank (position in
+        # sorted order) of the lowest ranked pattern ending at that state.
+        goto = [{}]
+        best = [none]
+        for rank, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    best.append(none)
+                state = nxt
+            if rank < best[state]:
+                best[state] = rank
+
+        # Failure links, breadth first so parents are done before children.
+        # Each state also inherits the best rank of its failure state so a
+        # single lookup covers every pattern that is a suffix of it.
+        fail = [0] * len(goto)
+        todo = deque(goto[0].values())
+        while todo:
+            state = todo.popleft()
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(ch, 0)
+                fail[nxt] = f
+                if best[f] < best[nxt]:
+                    best[nxt] = best[f]
+                todo.append(nxt)
+
+        self._goto = goto
+        self._fail = fail
+        self._best = best
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def match(self, text):
+        """
+        Find the first command, in sorted order, contained in the text.
+        :param text: Text to search.  Must already be lower case if the
+                commands are.
+        :return: The matching command or None
+        """
+        if not self.patterns:
+            return None
+
+        goto = self._goto
+        if goto is None:
+            for pattern in self.patterns:
+                if pattern in text:
+                    return pattern
+            return None
+
+        fail = self._fail
+        best = self._best
+        found = best[0]
+        if found == 0:
+            return self.patterns[0]
+
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            rank = best[state]
+            if rank < found:
+                found = rank
+                if found == 0:
+                    break
+
+        if found < len(self.patterns):
+            return self.patterns[found]
+        return None
@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+
+"""Counters and latency histograms, exported in Prometheus text format."""
+
+from bisect import bisect_left
+from collections import OrderedDict
+import re
+import threading
+import time
+
+from webexteamsbot.uploads import UploadTooLarge
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# Label values used once a metric has too many distinct label sets
+OVERFLOW = "other"
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _labels(names, values, *extra):
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    pairs.extend(e for e in extra if e)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _constant(labels):
+    # Constant labels, e.g. {"bot": "name"}, formatted once per render
+    return ",".join('%s="%s"' % (n, _escape(v))
+                    for n, v in sorted((labels or {}).items()))
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, help_text, labels=(), max_series=1000):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.max_series = max_series
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, values):
+        # Called with self._lock held.  Caps the number of label sets so a
+        # stream of unexpected values cannot grow memory without bound.
+        if values in self._series or len(self._series) < self.max_series:
+            return values
+        return (OVERFLOW,) * len(self.label_names)
+
+    def header(self):
+        return ["# HELP %s %s" % (self.name, self.help),
+                "# TYPE %s %s" % (self.name, self.kind)]
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, optionally per label set."""
+
+    kind = "counter"
+
+    def inc(self, *labels):
+        """
+        Add one.
+        :param labels: Label values, in the order of the label names
+        :return:
+        """
+        self.add(1, *labels)
+
+    def add(self, amount, *labels):
+        """
+        Add an amount.
+        :param amount: Amount to add
+        :param labels: Label values
+        :return:
+        """
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._series.get(labels, 0)
+
+    def render(self, constant=""):
+        return self.header() + self.samples(constant)
+
+    def samples(self, constant=""):
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = []
+        for values, count in series:
+            lines.append("%s%s %s" % (
+                self.name, _labels(self.label_names, values, constant),
+                _number(count)
+            ))
+        return lines
+
+
+class _HistogramSeries(object):
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. durations in seconds."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS,
+                 max_series=1000):
+        super(Histogram, self).__init__(name, help_text, labels, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        """
+        Record a value.
+        :param value: Observed value
+        :param labels: Label values
+        :return:
+        """
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(
+                    len(self.buckets) + 1
+                )
+            series.counts[i] += 1
+            series.sum += value
+            series.count += 1
+
+    def time(self, *labels):
+        """
+        Context manager recording how long its block takes.
+        :param labels: Label values
+        :return: Context manager
+        """
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series.count if series else 0
+
+    def render(self, constant=""):
+        return self.header() + self.samples(constant)
+
+    def samples(self, constant=""):
+        with self._lock:
+            series = sorted(
+                (values, list(s.counts), s.sum, s.count)
+                for values, s in self._series.items()
+            )
+        lines = []
+        bounds = self.buckets + (float("inf"),)
+        for values, counts, total, count in series:
+            cumulative = 0
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                lines.append("%s_bucket%s %d" % (
+                    self.name,
+                    _labels(self.label_names, values, constant,
+                            'le="%s"' % _number(bound)),
+                    cumulative,
+                ))
+            labels = _labels(self.label_names, values, constant)
+            lines.append("%s_sum%s %s" % (self.name, labels, repr(total)))
+            lines.append("%s_count%s %d" % (self.name, labels, count))
+        return lines
+
+
+class _Timer(object):
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start,
+                               *self.labels)
+
+
+class MetricsRegistry(object):
+    """
+    A set of metrics rendered together.
+
+    Besides counters and histograms, components that already keep their
+    own counters can be registered as collectors: a function returning a
+    dict of numbers, read only when the metrics are rendered.
+    """
+
+    def __init__(self, prefix="webexteamsbot"):
+        """
+        Initialize a new MetricsRegistry
+
+        :param prefix: Prefix for every metric name
+        """
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+
+    def _name(self, name):
+        return _NAME_RE.sub("_", "%s_%s" % (self.prefix, name))
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(self._name(name), help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self._name(name), help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name, func):
+        """
+        Export the numeric values of a stats() style dict as gauges named
+        <prefix>_<name>_<key>.
+        :param name: Component name
+        :param func: Function returning a dict
+        :return:
+        """
+        self._collectors.append((self._name(name), func))
+
+    def families(self, labels=None):
+        """
+        The metrics, as (name, header lines, sample lines).
+        :param labels: dict of constant labels added to every sample
+        :return: List
+        """
+        constant = _constant(labels)
+        ret = []
+        for metric in self._metrics:
+            ret.append((metric.name, metric.header(),
+                        metric.samples(constant)))
+        suffix = "{%s}" % constant if constant else ""
+        for name, func in self._collectors:
+            try:
+                stats = func()
+            except Exception:
+                continue
+            for key in sorted(stats or {}):
+                value = stats[key]
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                gauge = _NAME_RE.sub("_", "%s_%s" % (name, key))
+                ret.append((gauge, ["# TYPE %s gauge" % gauge],
+                            ["%s%s %s" % (gauge, suffix, _number(value))]))
+        return ret
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        :return: str
+        """
+        return render_registries([(self, None)])
+
+
+def render_registries(registries):
+    """
+    Several registries as one page, e.g. for the bots of a BotHost.  Each
+    metric is rendered once, with the samples of every registry that has
+    it, so the registries' samples must differ by their constant labels.
+    :param registries: List of (MetricsRegistry, dict of constant labels)
+    :return: str
+    """
+    families = OrderedDict()
+    for registry, labels in registries:
+        for name, header, samples in registry.families(labels):
+            family = families.get(name)
+            if family is None:
+                families[name] = (header, samples)
+            else:
+                family[1].extend(samples)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def api_call_name(method, url):
+    """
+    Name a Webex API request after the webexteamssdk call that makes it,
+    e.g. "messages.get", "messages.create" or "people.me".
+    :param method: HTTP method
+    :param url: Request URL
+    :return: str
+    """
+    path = url.split("?", 1)[0]
+    marker = path.find("/v1/")
+    path = path[marker + 4:] if marker != -1 else path.rsplit("/", 1)[-1]
+    parts = [p for p in path.split("/") if p]
+    if parts[:2] == ["attachment", "actions"]:
+        parts = ["attachmentActions"] + parts[2:]
+    if not parts:
+        return "other"
+    resource = parts[0]
+    if len(parts) > 1 and parts[1] == "me":
+        return resource + ".me"
+    if len(parts) == 1:
+        verb = {"GET": "list", "POST": "create"}.get(method, method.lower())
+    else:
+        verb = {"GET": "get", "PUT": "update",
+                "DELETE": "delete"}.get(method, method.lower())
+    return resource + "." + verb
+
+
+class BotMetrics(object):
+    """The metrics a bot records while handling events."""
+
+    def __init__(self, registry=None):
+        """
+        Initialize a new BotMetrics
+
+        :param registry: MetricsRegistry to record into
+        """
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.webhooks = r.counter(
+            "webhooks_received_total", "Webhooks received.",
+            ("resource", "event"),
+        )
+        self.commands = r.counter(
+            "commands_total", "Commands run.", ("command",)
+        )
+        self.command_seconds = r.histogram(
+            "command_duration_seconds", "Command callback duration.",
+            ("command",),
+        )
+        self.api_seconds = r.histogram(
+            "api_request_duration_seconds", "Webex API request duration.",
+            ("call",),
+        )
+        self.api_errors = r.counter(
+            "api_errors_total", "Webex API requests that failed.",
+            ("call", "status"),
+        )
+        self.errors = r.counter(
+            "errors_total", "Errors while handling events.", ("stage",)
+        )
+        self.uploads = r.counter(
+            "uploads_total", "File uploads.", ("result",)
+        )
+        self.upload_bytes = r.counter(
+            "upload_bytes_total", "Bytes of files uploaded."
+        )
+        self.upload_seconds = r.histogram(
+            "upload_duration_seconds", "File upload duration.",
+            buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+        )
+
+    def webhook_received(self, post_data):
+        """
+        Count a webhook.
+        :param post_data: Decoded webhook payload
+        :return:
+        """
+        if isinstance(post_data, dict):
+            self.webhooks.inc(str(post_data.get("resource")),
+                              str(post_data.get("event")))
+        else:
+            self.webhooks.inc("invalid", "invalid")
+
+    def command(self, name):
+        """
+        Context manager counting and timing a command callback.
+        :param name: Command
+        :return: Context manager
+        """
+        return _CommandTimer(self, name)
+
+    def api_request(self, request, response, seconds):
+        """
+        Record a Webex API request.  Used as the HTTP adapter's observer.
+        :param request: requests.PreparedRequest
+        :param response: requests.Response, or None if there was none
+        :param seconds: Request duration
+        :return:
+        """
+        call = api_call_name(request.method, request.url)
+        self.api_seconds.observe(seconds, call)
+        if response is None:
+            self.api_errors.inc(call, "none")
+        elif response.status_code >= 400:
+            self.api_errors.inc(call, str(response.status_code))
+
+    def upload(self, upload, sent, seconds, error):
+        """
+        Record a file upload.  Used as the Uploader's observer.
+        :param upload: FileUpload
+        :param sent: Bytes sent
+        :param seconds: Upload duration
+        :param error: Exception, or None if it succeeded
+        :return:
+        """
+        if error is None:
+            result = "ok"
+        elif isinstance(error, UploadTooLarge):
+            result = "too_large"
+        else:
+            result = "failed"
+        self.uploads.inc(result)
+        self.upload_bytes.add(sent)
+        if result != "too_large":
+            self.upload_seconds.observe(seconds)
+
+
+class _CommandTimer(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.commands.inc(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.command_seconds.observe(
+            time.perf_counter() - self.start, self.name
+        )
+        if exc_type is not None:
+            self.metrics.errors.inc("command")
@@ -1,64 +1,282 @@
 import json
 
+from webexteamsbot.uploads import FileUpload
 
-class Response(object):
-    def __init__(self, attributes=None):
-        if attributes:
-            self.attributes = attributes
+# Message fields a Response can set, in the order they are serialized
+FIELDS = ("roomId", "toPersonId", "toPersonEmail", "parentId", "text",
+          "markdown", "html", "files", "attachments")
+
+# Fields holding lists
+LIST_FIELDS = ("files", "attachments")
+
+FROZEN = "Response template is immutable, use clone() to change it"
+
+
+class _Field(object):
+    """A Response field, clearing the cached payloads when it is set."""
+
+    __slots__ = ("name", "slot", "member")
+
+    def __init__(self, name):
+        self.name = name
+        self.slot = "_" + name
+        # The slot's member descriptor, set once the class exists
+        self.member = None
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return self.member.__get__(obj)
+
+    def __set__(self, obj, val):
+        if obj._frozen:
+            raise AttributeError(FROZEN)
+        obj._dict = obj._json = None
+        self.member.__set__(obj, val)
+
+
+class _ListField(_Field):
+    """
+    A list field.  Setting it to a list or tuple replaces the list, and
+    setting it to anything else appends to it:
+
+        response.files = "https://example.com/report.pdf"
+    """
+
+    __slots__ = ()
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        val = self.member.__get__(obj)
+        if type(val) is list:
+            return val
+        if obj._frozen:
+            return val or ()
+        # Created on first use, or copied from a template's tuple
+        val = list(val or ())
+        self.member.__set__(obj, val)
+        return val
+
+    def __set__(self, obj, val):
+        if obj._frozen:
+            raise AttributeError(FROZEN)
+        obj._dict = obj._json = None
+        if isinstance(val, (list, tuple)):
+            self.member.__set__(obj, list(val))
         else:
-            self.attributes = dict()
-            self.attributes["text"] = None
-            self.attributes["roomId"] = None
-            self.attributes["markdown"] = None
-            self.attributes["html"] = None
-            self.attributes["files"] = list()
+            self.__get__(obj).append(val)
 
-    @property
-    def text(self):
-        return self.attributes["text"]
 
-    @text.setter
-    def text(self, val):
-        self.attributes["text"] = val
+class Response(object):
+    """
+    A message for the bot to send, returned from a command callback.
 
-    @property
-    def files(self):
-        return self.attributes["files"]
+    Payloads are built once and cached until a field changes.  Replies
+    sent many times, e.g. to several rooms, can be made into immutable
+    templates and cloned for each destination:
 
-    @files.setter
-    def files(self, val):
-        self.attributes["files"].append(val)
+        notice = Response.template(markdown="**Maintenance at 5pm**")
+        return [notice.clone(roomId=room) for room in rooms]
 
-    @property
-    def roomId(self):
-        return self.attributes["roomId"]
+    The lists in files and attachments are not watched, so set the field
+    again (response.files = [...]) after changing them in place.
+    """
 
-    @roomId.setter
-    def roomId(self, val):
-        self.attributes["roomId"] = val
+    __slots__ = tuple("_" + f for f in FIELDS) + (
+        "_extra", "_frozen", "_dict", "_json"
+    )
 
-    @property
-    def markdown(self):
-        return self.attributes["markdown"]
+    roomId = _Field("roomId")
+    toPersonId = _Field("toPersonId")
+    toPersonEmail = _Field("toPersonEmail")
+    parentId = _Field("parentId")
+    text = _Field("text")
+    markdown = _Field("markdown")
+    html = _Field("html")
+    files = _ListField("files")
+    attachments = _ListField("attachments")
+
+    def __init__(self, attributes=None, **fields):
+        """
+        Initialize a new Response
+
+        :param attributes: dict of message fields.  Fields not known to
+                Response are sent as they are.
+        :param fields: Message fields as keyword arguments
+        """
+        self._roomId = self._toPersonId = self._toPersonEmail = None
+        self._parentId = self._text = self._markdown = self._html = None
+        self._files = self._attachments = None
+        self._extra = self._dict = self._json = None
+        self._frozen = False
+        if attributes:
+            fields = dict(attributes, **fields)
+        for name, val in fields.items():
+            if name in FIELDS:
+                setattr(self, name, val)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[name] = val
 
-    @markdown.setter
-    def markdown(self, val):
-        self.attributes["markdown"] = val
+    @classmethod
+    def template(cls, attributes=None, **fields):
+        """
+        An immutable Response, for cloning.
+        :param attributes: dict of message fields
+        :param fields: Message fields as keyword arguments
+        :return: Frozen Response
+        """
+        return cls(attributes, **fields).freeze()
+
+    def freeze(self):
+        """
+        Make this Response immutable.  Setting a field raises
+        AttributeError afterwards.
+        :return: self
+        """
+        self._files = _frozen_list(self._files)
+        self._attachments = _frozen_list(self._attachments)
+        self._frozen = True
+        # Built now so every clone can start from it
+        self.as_dict()
+        return self
 
     @property
-    def html(self):
-        return self.attributes["html"]
+    def frozen(self):
+        return self._frozen
+
+    def clone(self, **changes):
+        """
+        A mutable copy of this Response.
+        :param changes: Fields to change in the copy, e.g. roomId
+        :return: Response
+        """
+        new = _new(Response)
+        new._roomId = self._roomId
+        new._toPersonId = self._toPersonId
+        new._toPersonEmail = self._toPersonEmail
+        new._parentId = self._parentId
+        new._text = self._text
+        new._markdown = self._markdown
+        new._html = self._html
+        # Lists are copied when the clone first uses them
+        new._files = _frozen_list(self._files)
+        new._attachments = _frozen_list(self._attachments)
+        new._extra = dict(self._extra) if self._extra else None
+        new._frozen = False
+        new._json = None
+
+        cached = self._dict
+        if cached is not None and _SCALAR_FIELDS.issuperset(changes):
+            # Derive the payload from ours instead of building it again
+            cached = dict(cached)
+            for name, val in changes.items():
+                _MEMBERS[name].__set__(new, val)
+                if val:
+                    cached[name] = val
+                else:
+                    cached.pop(name, None)
+            new._dict = cached
+            return new
+        new._dict = None
+        for name, val in changes.items():
+            setattr(new, name, val)
+        return new
 
-    @html.setter
-    def html(self, val):
-        self.attributes["html"] = val
+    def attach(self, source, filename=None, content_type=None, size=None,
+               progress=None):
+        """
+        Attach a file, streamed from disk or memory when the message is
+        sent.
+        :param source: Path, file-like object, bytes-like buffer or
+                iterable of bytes chunks
+        :param filename: Name shown for the file
+        :param content_type: MIME type, guessed from the filename by default
+        :param size: Size in bytes, if the source can't tell
+        :param progress: Called with (bytes sent, total bytes or None) as
+                the file is sent
+        :return: The FileUpload
+        """
+        upload = FileUpload(source, filename=filename,
+                            content_type=content_type, size=size,
+                            progress=progress)
+        self.files = upload
+        return upload
+
+    @property
+    def attributes(self):
+        """
+        Every message field, including unset ones.
+        :return: dict
+        """
+        ret = {f: getattr(self, "_" + f) for f in FIELDS}
+        if self._extra:
+            ret.update(self._extra)
+        return ret
 
     def as_dict(self):
-        ret = dict()
-        for k, v in self.attributes.items():
-            if v:
-                ret[k] = v
+        """
+        The fields that are set, as keyword arguments for
+        messages.create().  The dict is cached and must not be modified.
+        :return: dict
+        """
+        ret = self._dict
+        if ret is None:
+            ret = {}
+            # Unrolled, this is built for every message sent
+            if self._roomId:
+                ret["roomId"] = self._roomId
+            if self._toPersonId:
+                ret["toPersonId"] = self._toPersonId
+            if self._toPersonEmail:
+                ret["toPersonEmail"] = self._toPersonEmail
+            if self._parentId:
+                ret["parentId"] = self._parentId
+            if self._text:
+                ret["text"] = self._text
+            if self._markdown:
+                ret["markdown"] = self._markdown
+            if self._html:
+                ret["html"] = self._html
+            if self._files:
+                ret["files"] = list(self._files)
+            if self._attachments:
+                ret["attachments"] = list(self._attachments)
+            if self._extra:
+                for k, v in self._extra.items():
+                    if v:
+                        ret[k] = v
+            self._dict = ret
         return ret
 
     def json(self):
-        return json.dumps(self.attributes)
+        """
+        The fields that are set, serialized as JSON.
+        :return: str
+        """
+        ret = self._json
+        if ret is None:
+            ret = json.dumps(self.as_dict())
+            self._json = ret
+        return ret
+
+    def __repr__(self):
+        return "Response(%r)" % (self.as_dict(),)
+
+
+_new = object.__new__
+
+# Slot member descriptors, for reading and writing fields without going
+# through the _Field descriptors
+_MEMBERS = {f: Response.__dict__["_" + f] for f in FIELDS}
+for _f in FIELDS:
+    Response.__dict__[_f].member = _MEMBERS[_f]
+del _f
+
+_SCALAR_FIELDS = frozenset(FIELDS) - frozenset(LIST_FIELDS)
+
+
+def _frozen_list(val):
+    return tuple(val) if val else None
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""Decide which users are approved to interact with the bot."""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+from webexteamsbot import logs
+
+log = logs.get_logger(__name__)
+
+
+class _Rules(object):
+    """Immutable snapshot of the approval rules, swapped in atomically."""
+
+    __slots__ = ("emails", "domains")
+
+    def __init__(self, entries=()):
+        emails = set()
+        domains = set()
+        for entry in entries:
+            entry = entry.strip().lower()
+            if not entry or entry.startswith("#"):
+                continue
+            if entry.startswith("*@"):
+                domains.add(entry[2:])
+            elif entry.startswith("@"):
+                domains.add(entry[1:])
+            else:
+                emails.add(entry)
+        self.emails = frozenset(emails)
+        self.domains = frozenset(domains)
+
+    def __len__(self):
+        return len(self.emails) + len(self.domains)
+
+    def match(self, email):
+        if email in self.emails:
+            return True
+        at = email.rfind("@")
+        return at != -1 and email[at + 1:] in self.domains
+
+
+class ApprovalPolicy(object):
+    """
+    Approved user policy.
+
+    A user is approved if their email address is listed, if their domain is
+    listed as "*@example.com", or, when approved rooms are configured, if
+    they are a member of one of those rooms.  Email lookups are hashed and
+    case-insensitive.  Rules can be loaded from a file, one entry per line,
+    which is reloaded automatically when it changes.  If no rules are
+    configured at all every user is approved.
+    """
+
+    def __init__(
+        self,
+        users=(),
+        path=None,
+        rooms=(),
+        teams=None,
+        membership_ttl=300,
+        membership_cache_size=10000,
+        reload_interval=5,
+    ):
+        """
+        Initialize a new ApprovalPolicy
+
+        :param users: Approved email addresses and "*@domain" rules
+        :param path: File of approved addresses and rules, one per line.
+                Blank lines and lines starting with # are ignored.
+        :param rooms: Room ids whose members are approved
+        :param teams: WebexTeamsAPI object, needed for room membership
+        :param membership_ttl: Seconds to cache room membership results
+        :param membership_cache_size: Maximum membership results cached
+        :param reload_interval: Minimum seconds between checks of the
+                rules file for changes
+        """
+        self.users = list(users or [])
+        self.path = path
+        self.rooms = list(rooms or [])
+        self.teams = teams
+        self.membership_ttl = membership_ttl
+        self.membership_cache_size = membership_cache_size
+        self.reload_interval = reload_interval
+
+        self._rules = _Rules(self.users)
+        self._mtime = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self._membership = OrderedDict()
+
+        # Counters
+        self.approved = 0
+        self.denied = 0
+        self.reloads = 0
+        self.membership_lookups = 0
+        self.membership_cache_hits = 0
+
+        if self.path:
+            self.reload()
+
+    @property
+    def enabled(self):
+        """True if any rule restricts who may use the bot."""
+        return bool(self.path or self.rooms or len(self._rules))
+
+    def load(self, entries):
+        """
+        Replace the rules with a new list of entries.
+        :param entries: Approved email addresses and "*@domain" rules
+        :return:
+        """
+        rules = _Rules(entries)
+        with self._lock:
+            self._rules = rules
+            self._membership.clear()
+
+    def set_users(self, users):
+        """
+        Replace the approved users given in ``users``, keeping the rules
+        file's entries.
+        :param users: Approved email addresses and "*@domain" rules
+        :return:
+        """
+        self.users = list(users or [])
+        if not (self.path and self.reload()):
+            self.load(self.users)
+
+    def reload(self):
+        """
+        Load the rules file, replacing the current rules once it has been
+        read completely.  Entries given in ``users`` are kept.
+        :return: True if the rules were loaded
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path) as f:
+                entries = f.read().splitlines()
+        except (IOError, OSError) as e:
+            log.error("Could not load approved users", path=self.path,
+                      error=str(e))
+            return False
+        self.load(self.users + entries)
+        self._mtime = mtime
+        self.reloads += 1
+        return True
+
+    def _check_file(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except (IOError, OSError):
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def _cached_member(self, email, now):
+        # Cached membership result, or None if it has to be looked up
+        cached = self._membership.get(email)
+        if cached is not None and cached[1] > now:
+            self.membership_cache_hits += 1
+            return cached[0]
+        return None
+
+    def _is_member(self, email):
+        now = time.monotonic()
+        cached = self._cached_member(email, now)
+        if cached is not None:
+            return cached
+
+        member = False
+        for room in self.rooms:
+            self.membership_lookups += 1
+            memberships = self.teams.memberships.list(
+                roomId=room, personEmail=email
+            )
+            if any(True for _ in memberships):
+                member = True
+                break
+
+        with self._lock:
+            self._membership[email] = (member, now + self.membership_ttl)
+            self._membership.move_to_end(email)
+            while len(self._membership) > self.membership_cache_size:
+                self._membership.popitem(last=False)
+        return member
+
+    def is_approved(self, email, allow_lookup=True):
+        """
+        Check whether a user may interact with the bot.
+        :param email: The user's email address
+        :param allow_lookup: Look up room membership with the Teams API
+                when it isn't cached.  When False, users whose membership
+                isn't cached are approved for now, so that the check can
+                be made again later without blocking.
+        :return: True if approved
+        """
+        if self.path:
+            self._check_file()
+        if not self.enabled:
+            return True
+
+        email = (email or "").lower()
+        if self._rules.match(email):
+            approved = True
+        elif not (self.rooms and email):
+            approved = False
+        elif allow_lookup:
+            approved = self._is_member(email)
+        else:
+            approved = self._cached_member(email, time.monotonic())
+            if approved is None:
+                # Undecided until the membership is looked up
+                return True
+        if approved:
+            self.approved += 1
+        else:
+            self.denied += 1
+        return approved
+
+    def __contains__(self, email):
+        return self.is_approved(email)
+
+    def stats(self):
+        """
+        Policy counters.
+        :return: dict
+        """
+        rules = self._rules
+        return dict(
+            emails=len(rules.emails),
+            domains=len(rules.domains),
+            approved=self.approved,
+            denied=self.denied,
+            reloads=self.reloads,
+            membership_lookups=self.membership_lookups,
+            membership_cache_hits=self.membership_cache_hits,
+        )
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+"""Receive messages by polling the Teams API instead of webhooks."""
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import islice
+import threading
+import time
+
+from webexteamsbot import logs
+
+log = logs.get_logger(__name__)
+
+# Mark for rooms with no messages before polling started
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class _RoomState(object):
+    __slots__ = ("mark", "mark_ids", "interval", "due", "group")
+
+    def __init__(self, mark=None, interval=0.0, due=0.0):
+        self.mark = mark
+        self.mark_ids = frozenset()
+        self.interval = interval
+        self.due = due
+        self.group = None
+
+
+class MessagePoller(object):
+    """
+    Poll the messages list API for new messages and hand each one to a
+    handler as if it had arrived by webhook.
+
+    By default the rooms to poll are discovered with a single rooms list
+    sorted by last activity, so one request covers every room the bot is
+    in and only rooms with new activity have their messages listed.  With
+    an explicit list of rooms each room is polled on its own schedule,
+    backing off while it is idle.  Every room has a high-water mark so
+    each message is handed over once, and messages sent before polling
+    started are skipped.
+    """
+
+    def __init__(
+        self,
+        teams,
+        handler,
+        rooms=None,
+        min_interval=1.0,
+        max_interval=30.0,
+        backoff=2.0,
+        room_batch=100,
+        max_room_polls=20,
+        max_messages=50,
+        max_backlog=1000,
+        max_rooms=10000,
+        name="webexteamsbot",
+    ):
+        """
+        Initialize a new MessagePoller
+
+        :param teams: WebexTeamsAPI object
+        :param handler: Function called with (post_data, message) for each
+                new message.  post_data looks like a messages/created
+                webhook payload.
+        :param rooms: Room ids to poll.  Defaults to every room the bot is
+                a member of, discovered by last activity.
+        :param min_interval: Seconds between polls while there is activity
+        :param max_interval: Longest wait between polls while idle
+        :param backoff: Factor the wait grows by after each idle poll
+        :param room_batch: Rooms fetched per rooms list request
+        :param max_room_polls: Most rooms whose messages are listed in one
+                cycle.  Further active rooms wait for the next cycle.
+        :param max_messages: Messages fetched per messages list request.
+                A room with more new messages is paged back to its
+                high-water mark.
+        :param max_backlog: Most new messages handed over from one room in
+                one poll.  Older ones are skipped, logged and counted.
+        :param max_rooms: Number of room high-water marks remembered
+        :param name: Prefix for the polling thread name
+        """
+        self.teams = teams
+        self.handler = handler
+        self.rooms = list(rooms) if rooms else None
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.room_batch = room_batch
+        self.max_room_polls = max_room_polls
+        self.max_messages = max_messages
+        self.max_backlog = max_backlog
+        self.max_rooms = max_rooms
+        self.name = name
+
+        self.interval = min_interval
+        self._rooms = OrderedDict()
+        self._pending = OrderedDict()
+        self._activity_mark = None
+        self._primed = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        if self.rooms:
+            for room in self.rooms:
+                self._rooms[room] = _RoomState(interval=min_interval)
+
+        # Counters
+        self.cycles = 0
+        self.idle_cycles = 0
+        self.room_list_calls = 0
+        self.message_list_calls = 0
+        self.room_lookups = 0
+        self.messages = 0
+        self.messages_skipped = 0
+        self.errors = 0
+
+    # *** Running
+    def start(self):
+        """
+        Start polling on a background thread.
+        :return:
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run, name=self.name + "-poller"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop polling after the current cycle.
+        :param timeout: Seconds to wait for the polling thread
+        :return:
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run(self):
+        """
+        Poll until stop() is called.
+        :return:
+        """
+        while not self._stop.is_set():
+            try:
+                wait = self.poll_once()
+            except Exception as e:
+                self.errors += 1
+                log.error("Error polling for messages", error=str(e))
+                wait = self.max_interval
+            self._stop.wait(wait)
+
+    def poll_once(self):
+        """
+        Run one polling cycle.
+        :return: Seconds until the next cycle is due
+        """
+        self.cycles += 1
+        if self.rooms:
+            found = self._poll_rooms()
+            wait = self._next_due() - time.monotonic()
+        else:
+            found = self._poll_active()
+            if found or self._pending:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff,
+                                    self.max_interval)
+            wait = self.interval
+        if not found:
+            self.idle_cycles += 1
+        return max(0.0, wait)
+
+    def stats(self):
+        """
+        Polling counters.
+        :return: dict
+        """
+        return dict(
+            cycles=self.cycles,
+            idle_cycles=self.idle_cycles,
+            room_list_calls=self.room_list_calls,
+            message_list_calls=self.message_list_calls,
+            room_lookups=self.room_lookups,
+            messages=self.messages,
+            messages_skipped=self.messages_skipped,
+            errors=self.errors,
+            interval=self.interval,
+            rooms=len(self._rooms),
+            pending=len(self._pending),
+        )
+
+    # *** Discovery by room activity
+    def _poll_active(self):
+        # Rooms come newest activity first, so stop at the first room with
+        # nothing new.  An idle cycle costs a single request.
+        self.room_list_calls += 1
+        newest = None
+        rooms = self.teams.rooms.list(sortBy="lastactivity",
+                                      max=self.room_batch)
+        for room in rooms:
+            activity = room.lastActivity
+            if newest is None:
+                newest = activity
+            if not self._primed or (self._activity_mark is not None
+                                    and activity <= self._activity_mark):
+                break
+            state = self._room(room.id)
+            state.group = room.type == "group"
+            if state.mark is None:
+                # First activity seen, anything after the last cycle is new
+                state.mark = self._activity_mark or _EPOCH
+                state.mark_ids = None
+            self._pending[room.id] = True
+            self._pending.move_to_end(room.id)
+
+        if not self._primed:
+            # The first cycle only records where polling starts from
+            self._primed = True
+            self._activity_mark = newest
+            return 0
+        if newest is not None and (self._activity_mark is None
+                                   or newest > self._activity_mark):
+            self._activity_mark = newest
+
+        found = 0
+        for _ in range(min(self.max_room_polls, len(self._pending))):
+            room_id, _ = self._pending.popitem(last=False)
+            found += self._poll_room(room_id, self._room(room_id))
+        return found
+
+    def _room(self, room_id):
+        state = self._rooms.get(room_id)
+        if state is None:
+            state = self._rooms[room_id] = _RoomState()
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+        else:
+            self._rooms.move_to_end(room_id)
+        return state
+
+    # *** Explicit rooms, each backing off on its own
+    def _poll_rooms(self):
+        now = time.monotonic()
+        due = [r for r, s in self._rooms.items() if s.due <= now]
+        due.sort(key=lambda r: self._rooms[r].due)
+        found = 0
+        for room_id in due[:self.max_room_polls]:
+            state = self._rooms[room_id]
+            if state.group is None:
+                self.room_lookups += 1
+                state.group = self.teams.rooms.get(room_id).type == "group"
+            new = self._poll_room(room_id, state)
+            if new:
+                state.interval = self.min_interval
+            else:
+                state.interval = min(state.interval * self.backoff,
+                                     self.max_interval)
+            state.due = time.monotonic() + state.interval
+            found += new
+        self.interval = min(s.interval for s in self._rooms.values())
+        return found
+
+    def _next_due(self):
+        return min(s.due for s in self._rooms.values())
+
+    # *** Fetching one room's new messages
+    def _poll_room(self, room_id, state):
+        """
+        List a room's messages back to its high-water mark, a page at a
+        time, and hand the new ones over oldest first.
+        :return: Number of new messages
+        """
+        new = []
+        skipped = 0
+        before = None
+        while True:
+            page = self._list_messages(room_id, state, before)
+            for message in page:
+                if self._seen(state, message):
+                    break
+                if state.mark is None or len(new) < self.max_backlog:
+                    new.append(message)
+                else:
+                    skipped += 1
+            else:
+                # A full page without reaching the mark, there may be more
+                if len(page) == self.max_messages and state.mark is not None:
+                    before = page[-1].id
+                    continue
+            break
+
+        if state.mark is None:
+            # First poll of an explicit room: start after its latest message
+            if new:
+                self._advance(state, new[:1])
+            else:
+                state.mark = _EPOCH
+            return 0
+
+        if skipped:
+            self.messages_skipped += skipped
+            log.warning("Too many new messages to hand over, skipping the "
+                        "oldest", room=room_id, skipped=skipped,
+                        max_backlog=self.max_backlog)
+        self._advance(state, new)
+        for message in reversed(new):
+            self._dispatch(message)
+        return len(new)
+
+    def _list_messages(self, room_id, state, before=None):
+        # One page of messages, newest first
+        kwargs = dict(roomId=room_id, max=self.max_messages)
+        if state.group:
+            # Bots may only list group messages that mention them
+            kwargs["mentionedPeople"] = "me"
+        if before is not None:
+            kwargs["beforeMessage"] = before
+        self.message_list_calls += 1
+        return list(islice(self.teams.messages.list(**kwargs),
+                           self.max_messages))
+
+    # noinspection PyMethodMayBeStatic
+    def _seen(self, state, message):
+        created = message.created
+        return state.mark is not None and (
+            created < state.mark
+            or (created == state.mark and (
+                state.mark_ids is None or message.id in state.mark_ids
+            ))
+        )
+
+    # noinspection PyMethodMayBeStatic
+    def _advance(self, state, new):
+        if not new:
+            return
+        mark = new[0].created
+        ids = set(m.id for m in new if m.created == mark)
+        if mark == state.mark and state.mark_ids:
+            ids |= state.mark_ids
+        state.mark = mark
+        state.mark_ids = frozenset(ids)
+
+    def _dispatch(self, message):
+        post_data = {
+            "id": "polling",
+            "resource": "messages",
+            "event": "created",
+            "data": {
+                "id": message.id,
+                "roomId": message.roomId,
+                "roomType": message.roomType,
+                "personId": message.personId,
+                "personEmail": message.personEmail,
+            },
+        }
+        self.messages += 1
+        try:
+            self.handler(post_data, message)
+        except Exception as e:
+            self.errors += 1
+            log.error("Error processing polled message", message=message.id,
+                      error=str(e))
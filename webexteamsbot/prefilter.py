@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""Reject webhook events from their payload, before fetching anything."""
+
+import hashlib
+import hmac
+
+# Header Webex puts the HMAC-SHA1 signature of the payload in
+SIGNATURE_HEADER = "X-Spark-Signature"
+
+# Reasons an event is rejected
+SIGNATURE = "signature"
+SELF = "self"
+UNAPPROVED = "unapproved"
+
+
+def sign(secret, body):
+    """
+    HMAC-SHA1 signature Webex sends for a payload.
+    :param secret: Webhook secret
+    :param body: Raw request body
+    :return: Hex digest
+    """
+    if not isinstance(secret, bytes):
+        secret = secret.encode("utf-8")
+    return hmac.new(secret, body, hashlib.sha1).hexdigest()
+
+
+class EventFilter(object):
+    """
+    Decide from a webhook's payload and headers alone whether to process it.
+
+    Message webhooks carry the sender's personId and personEmail, so
+    messages from the bot itself or from unapproved users can be dropped
+    without fetching the message first.  With a webhook secret, payloads
+    whose signature does not match are dropped as well.  Anything the
+    payload cannot decide is let through to the normal checks.
+    """
+
+    def __init__(self, identity=None, approval=None, secret=None):
+        """
+        Initialize a new EventFilter
+
+        :param identity: BotIdentity, to recognise the bot's own messages
+        :param approval: ApprovalPolicy, to recognise unapproved users
+        :param secret: Webhook secret, to verify payload signatures
+        """
+        self.identity = identity
+        self.approval = approval
+        self.secret = secret
+
+        # Counters
+        self.checked = 0
+        self.passed = 0
+        self.rejected = {SIGNATURE: 0, SELF: 0, UNAPPROVED: 0}
+        self.fetches_avoided = 0
+
+    def verify(self, body, signature):
+        """
+        Check a payload's signature.
+        :param body: Raw request body
+        :param signature: Value of the X-Spark-Signature header
+        :return: True if there is no secret or the signature matches
+        """
+        if not self.secret:
+            return True
+        if not signature:
+            return False
+        return hmac.compare_digest(sign(self.secret, body),
+                                   signature.strip().lower())
+
+    def reason(self, post_data, body=None, signature=None):
+        """
+        Why an event should be rejected.
+        :param post_data: Decoded webhook payload
+        :param body: Raw request body, when signatures are checked
+        :param signature: Value of the X-Spark-Signature header
+        :return: SIGNATURE, SELF or UNAPPROVED, or None to process it
+        """
+        if body is not None and not self.verify(body, signature):
+            return SIGNATURE
+        try:
+            if post_data["resource"] != "messages":
+                return None
+            data = post_data["data"]
+            person_id = data.get("personId")
+            person_email = data.get("personEmail")
+        except (KeyError, TypeError, AttributeError):
+            return None
+
+        if person_id and self.identity is not None \
+                and self.identity.is_self(person_id):
+            return SELF
+        # Decided from the approval rules and cached room memberships
+        # only, as this runs before the webhook is acknowledged
+        if person_email and self.approval is not None \
+                and not self.approval.is_approved(person_email,
+                                                  allow_lookup=False):
+            return UNAPPROVED
+        return None
+
+    def check(self, post_data, body=None, signature=None):
+        """
+        Filter an event, counting the result.
+        :param post_data: Decoded webhook payload
+        :param body: Raw request body, when signatures are checked
+        :param signature: Value of the X-Spark-Signature header
+        :return: None if the event should be processed, otherwise the
+                reason it was rejected
+        """
+        reason = self.reason(post_data, body, signature)
+        self.checked += 1
+        if reason is None:
+            self.passed += 1
+            return None
+        self.rejected[reason] += 1
+        if isinstance(post_data, dict) \
+                and post_data.get("resource") == "messages":
+            # handle_event would have fetched the message
+            self.fetches_avoided += 1
+        return reason
+
+    def stats(self):
+        """
+        Filter counters.
+        :return: dict
+        """
+        return dict(
+            checked=self.checked,
+            passed=self.passed,
+            rejected_signature=self.rejected[SIGNATURE],
+            rejected_self=self.rejected[SELF],
+            rejected_unapproved=self.rejected[UNAPPROVED],
+            fetches_avoided=self.fetches_avoided,
+        )
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+"""On-demand profiling of event handling in a running bot."""
+
+import cProfile
+from collections import Counter
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+
+# Stack used once the number of distinct stacks reaches max_stacks
+OVERFLOW_STACK = "[other]"
+
+
+class _NullContext(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+class Profiler(object):
+    """
+    Profile a sampled fraction of events, or every run of one command.
+
+    While an event is being profiled, a sampler thread records the stack
+    of the thread handling it every ``interval`` seconds, and the event is
+    also run under cProfile.  Stacks are aggregated in collapsed format,
+    one "frame;frame;frame count" line per stack, which flame graph tools
+    read directly.  cProfile results are merged into one pstats.Stats.
+
+    Profiling is off until start() is called, and costs a single attribute
+    check per event while off.
+    """
+
+    def __init__(self, interval=0.005, max_stacks=10000):
+        """
+        Initialize a new Profiler
+
+        :param interval: Seconds between stack samples
+        :param max_stacks: Maximum distinct stacks kept
+        """
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.command = None
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active = {}
+        self._stacks = Counter()
+        self._stats = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        # Counters
+        self.profiled = 0
+        self.samples = 0
+
+    # *** Control
+    def start(self, sample_rate=None, command=None, interval=None):
+        """
+        Start profiling.
+        :param sample_rate: Fraction of events to profile, 0.0 to 1.0
+        :param command: Profile every run of this command
+        :param interval: Seconds between stack samples
+        :return:
+        """
+        if sample_rate is not None:
+            if not 0.0 <= sample_rate <= 1.0:
+                raise ValueError("sample_rate must be between 0 and 1")
+            self.sample_rate = sample_rate
+        if command is not None:
+            self.command = command or None
+        if interval is not None:
+            self.interval = interval
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._sample, name="webexteamsbot-profiler"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+            self.enabled = True
+
+    def stop(self):
+        """
+        Stop profiling.  Results are kept until reset().
+        :return:
+        """
+        with self._lock:
+            self.enabled = False
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        if thread is not None:
+            thread.join()
+
+    def reset(self):
+        """
+        Discard the results so far.
+        :return:
+        """
+        with self._lock:
+            self._stacks.clear()
+            self._stats = None
+            self.profiled = 0
+            self.samples = 0
+
+    def status(self):
+        """
+        Current settings and counters.
+        :return: dict
+        """
+        return dict(
+            enabled=self.enabled,
+            sample_rate=self.sample_rate,
+            command=self.command,
+            interval=self.interval,
+            profiled=self.profiled,
+            samples=self.samples,
+            stacks=len(self._stacks),
+        )
+
+    # *** Recording
+    def event(self):
+        """
+        Context manager profiling an event if it is sampled.
+        :return: Context manager
+        """
+        if not self.enabled or not self.sample_rate:
+            return _NULL
+        if random.random() >= self.sample_rate:
+            return _NULL
+        return _Profile(self)
+
+    def run_command(self, command):
+        """
+        Context manager profiling a command callback if it is the command
+        being profiled.
+        :param command: Command being run
+        :return: Context manager
+        """
+        if not self.enabled or command != self.command:
+            return _NULL
+        return _Profile(self)
+
+    def _begin(self):
+        if getattr(self._local, "profile", None) is not None:
+            # Already inside a profiled event
+            return False
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows only one)
+            profile = False
+        self._local.profile = profile
+        with self._lock:
+            self._active[threading.get_ident()] = True
+        return True
+
+    def _end(self):
+        profile = self._local.profile
+        self._local.profile = None
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+        if profile:
+            profile.disable()
+            profile.create_stats()
+        with self._lock:
+            self.profiled += 1
+            if profile:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = list(self._active)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            stacks = [self._collapse(frames[t]) for t in threads
+                      if t in frames]
+            with self._lock:
+                for stack in stacks:
+                    if stack not in self._stacks and \
+                            len(self._stacks) >= self.max_stacks:
+                        stack = OVERFLOW_STACK
+                    self._stacks[stack] += 1
+                    self.samples += 1
+
+    # noinspection PyMethodMayBeStatic
+    def _collapse(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("%s (%s:%d)" % (
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno,
+            ))
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+    # *** Results
+    def collapsed(self):
+        """
+        Sampled stacks in collapsed format, for flame graphs.
+        :return: str
+        """
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        return "".join("%s %d\n" % (s, n) for s, n in stacks)
+
+    def pstats_text(self, sort="cumulative", limit=50):
+        """
+        cProfile results as a text report.
+        :param sort: pstats sort key
+        :param limit: Number of functions to list
+        :return: str
+        """
+        out = io.StringIO()
+        with self._lock:
+            if self._stats is None:
+                return "No profiled events.\n"
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def pstats_dump(self):
+        """
+        cProfile results in the binary format written by
+        pstats.Stats.dump_stats(), for tools like snakeviz.
+        :return: bytes
+        """
+        with self._lock:
+            if self._stats is None:
+                return b""
+            return marshal.dumps(self._stats.stats)
+
+
+class _Profile(object):
+    __slots__ = ("profiler", "started")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.started = self.profiler._begin()
+        return self
+
+    def __exit__(self, *exc):
+        if self.started:
+            self.profiler._end()
+        return False
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+
+"""Rate limit aware scheduler for outbound messages."""
+
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+from webexteamsbot import logs
+from webexteamsbot.delivery import destination
+from webexteamsbot.state import StateError
+
+log = logs.get_logger(__name__)
+
+# Message fields that can be merged when coalescing plain replies
+COALESCE_FIELDS = ("text", "markdown")
+DESTINATION_FIELDS = ("roomId", "toPersonId", "toPersonEmail")
+
+
+class SendShed(Exception):
+    """Raised for a message dropped because the outbound queue is full."""
+
+
+def retry_after(error):
+    """
+    Seconds to wait before retrying, if an error is a 429 response.
+    :param error: Exception raised while sending
+    :return: Seconds, or None if the error was not rate limiting
+    """
+    wait = getattr(error, "retry_after", None)
+    if wait is not None:
+        return float(wait)
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        try:
+            return float(response.headers.get("Retry-After", 15))
+        except ValueError:
+            return 15.0
+    return None
+
+
+class TokenBucket(object):
+    """Token bucket allowing ``rate`` events per second with bursts."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity=None, now=None):
+        """
+        Initialize a new TokenBucket
+
+        :param rate: Tokens added per second
+        :param capacity: Maximum tokens held.  Defaults to max(1, rate)
+        :param now: Current monotonic time
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+    def delay(self, now):
+        """
+        Seconds until a token is available.
+        :param now: Current monotonic time
+        :return: 0 if a token is available now
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        """
+        Take a token.  Call after delay() returned 0.
+        :param now: Current monotonic time
+        :return:
+        """
+        self._refill(now)
+        self.tokens -= 1
+
+
+class SharedTokenBucket(object):
+    """
+    A TokenBucket kept in a StateBackend, shared by every process using
+    the backend.  Processes taking the last token at the same time can
+    both succeed, leaving the bucket in debt, so the rate holds over time
+    even though a burst may be exceeded by one message per process.
+
+    While the backend fails, a bucket in this process limits the rate
+    instead, so messages keep being sent.
+    """
+
+    __slots__ = ("state", "key", "rate", "capacity", "fallback", "errors")
+
+    def __init__(self, state, key, rate, capacity=None):
+        """
+        Initialize a new SharedTokenBucket
+
+        :param state: StateBackend
+        :param key: Key of the bucket
+        :param rate: Tokens added per second
+        :param capacity: Maximum tokens held.  Defaults to max(1, rate)
+        """
+        self.state = state
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        # Used while the backend fails
+        self.fallback = None
+        self.errors = 0
+
+    def _take(self, take, now):
+        # Tokens left, from the backend or else the local fallback
+        try:
+            tokens = self.state.bucket(self.key, self.rate, self.capacity,
+                                       take)
+        except StateError as e:
+            self.errors += 1
+            if self.fallback is None:
+                log.warning("State backend failed, rate limiting in this "
+                            "process", key=self.key, error=str(e))
+                self.fallback = TokenBucket(self.rate, self.capacity, now)
+            self.fallback._refill(now)
+            self.fallback.tokens -= take
+            return self.fallback.tokens
+        if self.fallback is not None:
+            log.info("State backend recovered", key=self.key)
+            self.fallback = None
+        return tokens
+
+    def delay(self, now):
+        """
+        Seconds until a token is available.
+        :param now: Current monotonic time, for the local fallback.  The
+                backend uses its own clock
+        :return: 0 if a token is available now
+        """
+        tokens = self._take(0, now)
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate
+
+    def consume(self, now):
+        """
+        Take a token.  Call after delay() returned 0.
+        :param now: Current monotonic time
+        :return:
+        """
+        self._take(1, now)
+
+
+class _Entry(object):
+    __slots__ = ("payload", "future", "queued_at", "attempts")
+
+    def __init__(self, payload, future, queued_at):
+        self.payload = payload
+        self.future = future
+        self.queued_at = queued_at
+        self.attempts = 0
+
+
+class OutboundScheduler(object):
+    """
+    Queue outbound messages and send them within rate limits.
+
+    Sends are admitted by a global token bucket and a token bucket per
+    room.  Messages for the same room are sent one at a time, in order.  A
+    429 response pauses all sending for the Retry-After period and the
+    message is retried.  When the queue is full new messages are either
+    shed (SendShed is raised) or, with ``overflow="coalesce"``, merged into
+    a plain text message still waiting for the same room.
+    """
+
+    def __init__(
+        self,
+        send,
+        rate=None,
+        burst=None,
+        room_rate=None,
+        room_burst=None,
+        max_queue=1000,
+        overflow="shed",
+        workers=4,
+        max_retries=3,
+        max_rooms=10000,
+        state=None,
+        state_key="outbound",
+        executor=None,
+        idle_timeout=None,
+    ):
+        """
+        Initialize a new OutboundScheduler
+
+        :param send: Function called with a messages.create() payload dict
+        :param rate: Global messages per second, None for no limit
+        :param burst: Global burst size.  Defaults to max(1, rate)
+        :param room_rate: Messages per second to a single room
+        :param room_burst: Burst size for a single room
+        :param max_queue: Maximum messages waiting to be sent
+        :param overflow: "shed" or "coalesce" when the queue is full
+        :param workers: Threads making the HTTP calls
+        :param max_retries: Retries of a message after 429 responses
+        :param max_rooms: Number of idle per-room buckets to remember
+        :param state: StateBackend to keep the buckets in, so every
+                process sending with the same token shares the limits.
+                Defaults to buckets in this process.
+        :param state_key: Prefix of the buckets' keys in ``state``
+        :param executor: Executor making the HTTP calls, shared with
+                other schedulers, instead of a pool of ``workers`` threads
+                of our own.  It is not shut down by stop().
+        :param idle_timeout: Seconds with nothing to send before the
+                dispatcher thread, and our own pool, exit.  They start
+                again with the next message.  None keeps them running.
+        """
+        if overflow not in ("shed", "coalesce"):
+            raise ValueError('overflow must be "shed" or "coalesce"')
+
+        self.send_func = send
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_rooms = max_rooms
+        self.state = state
+        self.state_key = state_key
+        self.shared_executor = executor
+        self.idle_timeout = idle_timeout
+
+        self._bucket = None
+        if rate:
+            self._bucket = self._new_bucket("global", rate, burst)
+        self._room_buckets = OrderedDict()
+        self._rooms = OrderedDict()
+        self._busy = set()
+        self._queued = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._stopping = False
+
+        # Counters
+        self.sent = 0
+        self.failed = 0
+        self.shed = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.throttled_time = 0.0
+        self.queue_time_total = 0.0
+
+    # *** Public interface
+    def submit(self, payload):
+        """
+        Queue a message for sending.
+        :param payload: messages.create() keyword argument dict
+        :return: Future resolving to the created message
+        """
+        future = Future()
+        room = destination(payload)
+        with self._cond:
+            if self._queued >= self.max_queue:
+                merged = self._coalesce(room, payload)
+                if merged is not None:
+                    return merged
+                self.shed += 1
+                future.set_exception(SendShed("Outbound queue full"))
+                return future
+            self._rooms.setdefault(room, deque()).append(
+                _Entry(payload, future, time.monotonic())
+            )
+            self._queued += 1
+            self._start()
+            self._cond.notify()
+        return future
+
+    def send(self, payload, timeout=None):
+        """
+        Queue a message and wait for it to be sent.
+        :param payload: messages.create() keyword argument dict
+        :param timeout: Seconds to wait
+        :return: The created message
+        """
+        return self.submit(payload).result(timeout)
+
+    def stop(self):
+        """
+        Stop the scheduler once queued messages are sent.
+        :return:
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        if self._executor is not None and \
+                self._executor is not self.shared_executor:
+            self._executor.shutdown(wait=True)
+        with self._cond:
+            self._thread = None
+            self._executor = None
+            self._stopping = False
+
+    def stats(self):
+        """
+        Scheduler counters and gauges.
+        :return: dict
+        """
+        with self._cond:
+            return dict(
+                queued=self._queued,
+                in_flight=len(self._busy),
+                sent=self.sent,
+                failed=self.failed,
+                shed=self.shed,
+                coalesced=self.coalesced,
+                rate_limited=self.rate_limited,
+                retries=self.retries,
+                throttled_time=self.throttled_time,
+                queue_time_total=self.queue_time_total,
+            )
+
+    # *** Internals, called with self._cond held
+    def _start(self):
+        if self._thread is None:
+            self._executor = self.shared_executor or \
+                ThreadPoolExecutor(max_workers=self.workers)
+            self._thread = threading.Thread(
+                target=self._dispatch, name="webexteamsbot-outbound"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _coalesce(self, room, payload):
+        if self.overflow != "coalesce" or not self._plain(payload):
+            return None
+        pending = self._rooms.get(room)
+        if not pending:
+            return None
+        # The head of the queue may be about to be sent, use the tail
+        tail = pending[-1]
+        if tail.attempts or not self._plain(tail.payload):
+            return None
+        if set(tail.payload) - set(DESTINATION_FIELDS) != \
+                set(payload) - set(DESTINATION_FIELDS):
+            return None
+        merged = dict(tail.payload)
+        for field in COALESCE_FIELDS:
+            if field in payload:
+                merged[field] = merged[field] + "\n\n" + payload[field]
+        tail.payload = merged
+        self.coalesced += 1
+        return tail.future
+
+    # noinspection PyMethodMayBeStatic
+    def _plain(self, payload):
+        return all(k in COALESCE_FIELDS or k in DESTINATION_FIELDS
+                   for k in payload)
+
+    def _new_bucket(self, name, rate, burst):
+        if self.state is None:
+            return TokenBucket(rate, burst)
+        return SharedTokenBucket(self.state, self.state_key + ":" + name,
+                                 rate, burst)
+
+    def _room_bucket(self, room):
+        if not self.room_rate:
+            return None
+        bucket = self._room_buckets.get(room)
+        if bucket is None:
+            bucket = self._new_bucket("room:%s" % (room,), self.room_rate,
+                                      self.room_burst)
+            self._room_buckets[room] = bucket
+            # Forget the least recently used rooms
+            while len(self._room_buckets) > self.max_rooms:
+                self._room_buckets.popitem(last=False)
+        else:
+            self._room_buckets.move_to_end(room)
+        return bucket
+
+    def _next(self, now):
+        """
+        Pick the next message allowed to be sent.
+        :return: (room, entry) or (None, seconds to wait)
+        """
+        wait = None
+        if self._paused_until > now:
+            return None, self._paused_until - now
+        for room, pending in self._rooms.items():
+            if room in self._busy or not pending:
+                continue
+            bucket = self._room_bucket(room)
+            delay = bucket.delay(now) if bucket else 0.0
+            if delay:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if self._bucket is not None:
+                delay = self._bucket.delay(now)
+                if delay:
+                    return None, delay
+                self._bucket.consume(now)
+            if bucket:
+                bucket.consume(now)
+            return room, pending.popleft()
+        return None, wait
+
+    def _dispatch(self):
+        error = None
+        try:
+            self._dispatch_loop()
+        except Exception as e:
+            log.exception("Outbound dispatcher failed")
+            error = e
+        finally:
+            with self._cond:
+                if error is not None:
+                    # Don't leave senders waiting on a dead thread
+                    self._fail_queued(error)
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                    if self._executor is not self.shared_executor:
+                        self._executor.shutdown(wait=False)
+                    self._executor = None
+                    # Messages queued while exiting need a new thread
+                    if self._queued and not self._stopping:
+                        self._start()
+                self._cond.notify_all()
+
+    def _fail_queued(self, error):
+        for pending in self._rooms.values():
+            for entry in pending:
+                self.failed += 1
+                entry.future.set_exception(error)
+        self._rooms.clear()
+        self._queued = 0
+
+    def _dispatch_loop(self):
+        idle_since = None
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                room, entry = self._next(now)
+                if room is None and self._stopping and not self._queued \
+                        and not self._busy:
+                    return
+                if room is None and entry is None and self.idle_timeout \
+                        and not self._queued and not self._busy:
+                    # Nothing to send.  Exit once idle for long enough,
+                    # submit() starts us again.
+                    if idle_since is None:
+                        idle_since = now
+                    elif now - idle_since >= self.idle_timeout:
+                        return
+                    self._cond.wait(self.idle_timeout)
+                    continue
+                idle_since = None
+                if room is None:
+                    # entry is the time until sending is allowed again,
+                    # or None when there is nothing to send
+                    self._cond.wait(entry)
+                    if entry is not None:
+                        self.throttled_time += time.monotonic() - now
+                    continue
+
+                pending = self._rooms[room]
+                if not pending:
+                    del self._rooms[room]
+                else:
+                    # Round robin between rooms
+                    self._rooms.move_to_end(room)
+                self._queued -= 1
+                self._busy.add(room)
+                self.queue_time_total += now - entry.queued_at
+                self._executor.submit(self._send, room, entry)
+
+    def _send(self, room, entry):
+        error = None
+        result = None
+        try:
+            result = self.send_func(entry.payload)
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            self._busy.discard(room)
+            wait = retry_after(error) if error is not None else None
+            if wait is not None:
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until,
+                                         time.monotonic() + wait)
+                if entry.attempts < self.max_retries:
+                    # Put it back at the front to keep the room's order
+                    entry.attempts += 1
+                    self.retries += 1
+                    self._rooms.setdefault(room, deque()).appendleft(entry)
+                    self._queued += 1
+                    self._cond.notify()
+                    return
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._cond.notify()
+
+        if error is None:
+            entry.future.set_result(result)
+        else:
+            entry.future.set_exception(error)
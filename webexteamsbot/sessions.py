@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""Conversation state kept between messages, per room or per person."""
+
+import json
+import threading
+import time
+
+from webexteamsbot.cache import TTLCache
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(",", ":"), sort_keys=True)
+
+
+class SessionBackend(object):
+    """
+    Storage for sessions, as compact JSON strings.
+
+    Backends expire sessions after their ttl.  Expired sessions may be
+    removed lazily, as long as load() no longer returns them.
+    """
+
+    def load(self, key):
+        """
+        A stored session.
+        :param key: Session key
+        :return: JSON string, or None if absent or expired
+        """
+        raise NotImplementedError
+
+    def save(self, key, data, ttl):
+        """
+        Store a session, replacing any previous one.
+        :param key: Session key
+        :param data: JSON string
+        :param ttl: Seconds to keep the session
+        :return:
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Remove a session.
+        :param key: Session key
+        :return:
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    In-process backend with TTL expiry, and LRU eviction once there are
+    too many sessions or they take too much memory.
+
+    Sessions are kept as their JSON text, which is both compact and an
+    exact measure of their size.
+    """
+
+    def __init__(self, max_sessions=10000, max_bytes=16 * 1024 * 1024):
+        """
+        Initialize a new MemorySessionBackend
+
+        :param max_sessions: Maximum number of sessions kept
+        :param max_bytes: Maximum total size of the sessions' JSON text.
+                None for no limit
+        """
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._entries = TTLCache(max_sessions, max_bytes=max_bytes)
+        self._lock = threading.Lock()
+
+    @property
+    def bytes(self):
+        return self._entries.bytes
+
+    @property
+    def evictions(self):
+        return self._entries.evictions
+
+    @property
+    def expirations(self):
+        return self._entries.expirations
+
+    def load(self, key):
+        with self._lock:
+            return self._entries.get(key, time.monotonic())
+
+    def save(self, key, data, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._entries.put(key, data, now + ttl, now, size=len(data))
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class StateSessionBackend(SessionBackend):
+    """
+    Backend keeping sessions in a StateBackend, so a conversation can
+    continue on any of the worker processes sharing it.
+    """
+
+    def __init__(self, state, prefix="session:"):
+        """
+        Initialize a new StateSessionBackend
+
+        :param state: StateBackend
+        :param prefix: Prefix of the session keys
+        """
+        self.state = state
+        self.prefix = prefix
+
+    def load(self, key):
+        return self.state.get(self.prefix + key)
+
+    def save(self, key, data, ttl):
+        self.state.set(self.prefix + key, data, ttl=ttl)
+
+    def delete(self, key):
+        self.state.delete(self.prefix + key)
+
+
+class Session(dict):
+    """
+    The state of one conversation, a dict of JSON serializable values.
+
+    Changes are kept once saved, with save() or by using the session as a
+    context manager, which saves it unless the block raises.
+    """
+
+    __slots__ = ("store", "key")
+
+    def __init__(self, store, key, data=None):
+        super(Session, self).__init__(data or {})
+        self.store = store
+        self.key = key
+
+    def save(self):
+        """
+        Keep the session's data, restarting its ttl.
+        :return:
+        """
+        self.store.save(self)
+
+    def end(self):
+        """
+        Clear and remove the session.
+        :return:
+        """
+        self.clear()
+        self.store.delete(self.key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.save()
+
+
+class SessionStore(object):
+    """
+    Sessions for multi-step commands, per room or per person in a room.
+
+    A command starting a flow stores what it needs in the session, and the
+    commands that follow read it back, instead of keeping global dicts
+    that grow without limit.  Sessions expire ttl seconds after they were
+    last saved.
+    """
+
+    def __init__(self, backend=None, ttl=600, max_sessions=10000,
+                 max_bytes=16 * 1024 * 1024):
+        """
+        Initialize a new SessionStore
+
+        :param backend: SessionBackend.  Defaults to a MemorySessionBackend
+        :param ttl: Seconds a session is kept after it was last saved
+        :param max_sessions: Sessions kept by the default backend
+        :param max_bytes: Memory limit of the default backend
+        """
+        if backend is None:
+            backend = MemorySessionBackend(max_sessions=max_sessions,
+                                           max_bytes=max_bytes)
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+
+    # noinspection PyMethodMayBeStatic
+    def key(self, room_id, person_id=None):
+        """
+        Key of a session.
+        :param room_id: Room of the conversation
+        :param person_id: Person in the room, or None for the whole room
+        :return: Key string
+        """
+        if person_id is None:
+            return room_id
+        return "%s:%s" % (room_id, person_id)
+
+    def get(self, room_id, person_id=None):
+        """
+        The session of a room, or of one person in a room.  A new, empty
+        session if there is none.
+        :param room_id: Room of the conversation
+        :param person_id: Person in the room, or None for the whole room
+        :return: Session
+        """
+        key = self.key(room_id, person_id)
+        data = self.backend.load(key)
+        if data is None:
+            self.misses += 1
+            return Session(self, key)
+        self.hits += 1
+        return Session(self, key, json.loads(data))
+
+    def save(self, session):
+        """
+        Keep a session's data.  Empty sessions are removed instead.
+        :param session: Session
+        :return:
+        """
+        if not session:
+            self.backend.delete(session.key)
+            return
+        self.backend.save(session.key, _dumps(session), self.ttl)
+        self.saves += 1
+
+    def delete(self, key):
+        """
+        Remove a session.
+        :param key: Session key
+        :return:
+        """
+        self.backend.delete(key)
+
+    def stats(self):
+        """
+        Session counters.
+        :return: dict
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            saves=self.saves,
+            size=len(self.backend),
+            bytes=getattr(self.backend, "bytes", 0),
+            evictions=getattr(self.backend, "evictions", 0),
+            expirations=getattr(self.backend, "expirations", 0),
+        )
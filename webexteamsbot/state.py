@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared state for caches, dedupe keys, counters and rate limit buckets, so
+the worker processes of one bot can cooperate.
+"""
+
+import json
+import random
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from webexteamsbot.cache import TTLCache
+
+# Default of TTLCache.get() telling a missing key from a None value
+_MISSING = object()
+
+
+class StateError(Exception):
+    """A state backend could not complete a request."""
+
+
+def refill(tokens, updated, rate, capacity, take, now):
+    """
+    Update a token bucket.
+    :param tokens: Tokens held, or None for a new, full bucket
+    :param updated: When the bucket was last updated
+    :param rate: Tokens added per second
+    :param capacity: Maximum tokens held
+    :param take: Tokens to take.  The bucket may go negative, making the
+            following takes wait for longer.
+    :param now: Current time
+    :return: (tokens left, seconds until the bucket is full again)
+    """
+    if tokens is None:
+        tokens = capacity
+    elif now > updated:
+        tokens = min(capacity, tokens + (now - updated) * rate)
+    tokens -= take
+    return tokens, (capacity - tokens) / rate
+
+
+class StateBackend(object):
+    """
+    Key value storage shared by a bot's worker processes.
+
+    Values must be JSON serializable.  Times are wall clock seconds, so
+    every process sharing a backend should have a synchronized clock.
+    Every key is prefixed with ``prefix``, so several bots can share one
+    store.
+    """
+
+    def __init__(self, prefix=""):
+        """
+        Initialize a new StateBackend
+
+        :param prefix: Prepended to every key
+        """
+        self.prefix = prefix
+        self.operations = 0
+        self.errors = 0
+
+    def get(self, key):
+        """
+        Get a value.
+        :param key: Key
+        :return: The value, or None if the key is missing or expired
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """
+        Set a value.
+        :param key: Key
+        :param value: JSON serializable value
+        :param ttl: Seconds to keep it, None to keep it until deleted
+        :return:
+        """
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        """
+        Set a value, unless the key is already present and unexpired.
+        Atomic, so of several workers adding the same key only one
+        succeeds.
+        :param key: Key
+        :param value: JSON serializable value
+        :param ttl: Seconds to keep it
+        :return: True if the value was set
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Delete a key.
+        :param key: Key
+        :return:
+        """
+        raise NotImplementedError
+
+    def incr(self, key, amount=1, ttl=None):
+        """
+        Atomically add to a counter, creating it at 0.
+        :param key: Key
+        :param amount: Amount to add
+        :param ttl: Seconds to keep a counter created by this call
+        :return: The new value
+        """
+        raise NotImplementedError
+
+    def bucket(self, key, rate, capacity, take=1):
+        """
+        Atomically take tokens from a token bucket, created full.
+        :param key: Key
+        :param rate: Tokens added per second
+        :param capacity: Maximum tokens held
+        :param take: Tokens to take.  0 only looks at the bucket.
+        :return: Tokens left, which is negative when more were taken
+                than were available
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Release connections.
+        :return:
+        """
+
+    def __len__(self):
+        return 0
+
+    def stats(self):
+        """
+        Backend counters.
+        :return: dict
+        """
+        return dict(operations=self.operations, errors=self.errors)
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    State kept in this process, with TTL expiry and LRU eviction.  The
+    default, for bots running in a single process.
+    """
+
+    def __init__(self, max_size=100000, prefix=""):
+        """
+        Initialize a new MemoryStateBackend
+
+        :param max_size: Maximum number of keys kept
+        :param prefix: Prepended to every key
+        """
+        super(MemoryStateBackend, self).__init__(prefix)
+        self.max_size = max_size
+        self._data = TTLCache(max_size)
+        self._lock = threading.Lock()
+
+    @property
+    def evictions(self):
+        return self._data.evictions
+
+    def get(self, key):
+        self.operations += 1
+        with self._lock:
+            return self._data.get(self.prefix + key, time.time())
+
+    def set(self, key, value, ttl=None):
+        self.operations += 1
+        now = time.time()
+        with self._lock:
+            self._data.put(self.prefix + key, value,
+                           now + ttl if ttl else None, now)
+
+    def add(self, key, value, ttl=None):
+        self.operations += 1
+        key = self.prefix + key
+        now = time.time()
+        with self._lock:
+            if self._data.get(key, now, _MISSING) is not _MISSING:
+                return False
+            self._data.put(key, value, now + ttl if ttl else None, now)
+            return True
+
+    def delete(self, key):
+        self.operations += 1
+        with self._lock:
+            self._data.pop(self.prefix + key)
+
+    def incr(self, key, amount=1, ttl=None):
+        self.operations += 1
+        key = self.prefix + key
+        now = time.time()
+        with self._lock:
+            value = self._data.get(key, now, _MISSING)
+            if value is _MISSING:
+                value = amount
+                expires = now + ttl if ttl else None
+            else:
+                value += amount
+                expires = self._data.expires(key)
+            self._data.put(key, value, expires, now)
+            return value
+
+    def bucket(self, key, rate, capacity, take=1):
+        self.operations += 1
+        key = self.prefix + key
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._data.get(key, now, (None, 0))
+            tokens, full_in = refill(tokens, updated, rate, capacity, take,
+                                     now)
+            # A full bucket is the same as a missing one
+            self._data.put(key, (tokens, now), now + full_in + 1, now)
+            return tokens
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        ret = super(MemoryStateBackend, self).stats()
+        ret.update(size=len(self._data), evictions=self.evictions,
+                   expirations=self._data.expirations)
+        return ret
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    State in an SQLite database, shared by the processes of one host,
+    e.g. the workers of gunicorn.  The database is in WAL mode, so
+    readers don't wait for writers, and each thread has its own
+    connection.
+    """
+
+    # Expired rows are deleted after this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, prefix="", timeout=5.0):
+        """
+        Initialize a new SQLiteStateBackend
+
+        :param path: Database file, created if it doesn't exist
+        :param prefix: Prepended to every key
+        :param timeout: Seconds to wait for another process's write
+        """
+        super(SQLiteStateBackend, self).__init__(prefix)
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.purged = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL, expires REAL) WITHOUT ROWID"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit, transactions are started explicitly
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _run(self, func, *args):
+        self.operations += 1
+        try:
+            return func(self._connect(), *args)
+        except sqlite3.Error as e:
+            self.errors += 1
+            raise StateError(str(e))
+
+    def _wrote(self, conn, now):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            cursor = conn.execute(
+                "DELETE FROM state WHERE expires <= ?", (now,)
+            )
+            self.purged += cursor.rowcount
+
+    def get(self, key):
+        return self._run(self._do_get, self.prefix + key)
+
+    # noinspection PyMethodMayBeStatic
+    def _do_get(self, conn, key):
+        row = conn.execute(
+            "SELECT value FROM state WHERE key = ? AND "
+            "(expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._run(self._do_set, self.prefix + key, value, ttl)
+
+    def _do_set(self, conn, key, value, ttl):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+            (key, json.dumps(value), now + ttl if ttl else None),
+        )
+        self._wrote(conn, now)
+
+    def add(self, key, value, ttl=None):
+        return self._run(self._do_add, self.prefix + key, value, ttl)
+
+    def _do_add(self, conn, key, value, ttl):
+        now = time.time()
+        # One statement, so it is atomic: it only replaces expired rows
+        cursor = conn.execute(
+            "INSERT INTO state VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE "
+            "SET value = excluded.value, expires = excluded.expires "
+            "WHERE state.expires IS NOT NULL AND state.expires <= ?",
+            (key, json.dumps(value), now + ttl if ttl else None, now),
+        )
+        self._wrote(conn, now)
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._run(self._do_delete, self.prefix + key)
+
+    # noinspection PyMethodMayBeStatic
+    def _do_delete(self, conn, key):
+        conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def _update(self, conn, key, update):
+        """
+        Read, change and write a row in one write transaction.
+        :param update: Called with (value or None, expires, now), returns
+                (new value, new expires, result)
+        :return: result
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT value, expires FROM state WHERE key = ?", (key,)
+            ).fetchone()
+            value = expires = None
+            if row is not None and (row[1] is None or row[1] > now):
+                value, expires = json.loads(row[0]), row[1]
+            value, expires, result = update(value, expires, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._wrote(conn, now)
+        return result
+
+    def incr(self, key, amount=1, ttl=None):
+        def update(value, expires, now):
+            if value is None:
+                value = 0
+                expires = now + ttl if ttl else None
+            value += amount
+            return value, expires, value
+
+        return self._run(self._update, self.prefix + key, update)
+
+    def bucket(self, key, rate, capacity, take=1):
+        def update(value, expires, now):
+            tokens, updated = value if value is not None else (None, 0)
+            tokens, full_in = refill(tokens, updated, rate, capacity, take,
+                                     now)
+            return (tokens, now), now + full_in + 1, tokens
+
+        return self._run(self._update, self.prefix + key, update)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def __len__(self):
+        return self._run(self._do_len)
+
+    def _do_len(self, conn):
+        return conn.execute(
+            "SELECT COUNT(*) FROM state WHERE substr(key, 1, ?) = ? AND "
+            "(expires IS NULL OR expires > ?)",
+            (len(self.prefix), self.prefix, time.time()),
+        ).fetchone()[0]
+
+    def stats(self):
+        ret = super(SQLiteStateBackend, self).stats()
+        ret.update(purged=self.purged)
+        return ret
+
+
+class RedisStateBackend(StateBackend):
+    """
+    State on a Redis server, shared by processes on any number of hosts.
+    Needs the redis package, installed with the redis extra:
+    pip install webexteamsbot[redis]
+    """
+
+    # Attempts at updating a bucket other processes are updating too
+    MAX_ATTEMPTS = 20
+
+    def __init__(self, url="redis://localhost:6379/0", prefix="",
+                 timeout=5.0, pool_size=10):
+        """
+        Initialize a new RedisStateBackend
+
+        :param url: redis://[:password@]host[:port][/database], or
+                rediss:// for TLS
+        :param prefix: Prepended to every key
+        :param timeout: Seconds to wait for the server, or for a free
+                connection
+        :param pool_size: Most connections open at once
+        """
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("RedisStateBackend needs the redis package: "
+                              "pip install webexteamsbot[redis]")
+        super(RedisStateBackend, self).__init__(prefix)
+        parts = urlsplit(url)
+        if parts.scheme not in ("redis", "rediss"):
+            raise ValueError("Not a redis:// URL: {}".format(url))
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._redis = redis
+        self._pool = redis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=pool_size,
+            timeout=timeout,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout,
+            decode_responses=True,
+            # RESP2, spoken by every Redis version
+            protocol=2,
+        )
+        self.client = redis.Redis(connection_pool=self._pool)
+        self.conflicts = 0
+
+    def _call(self, func, *args, **kwargs):
+        self.operations += 1
+        try:
+            return func(*args, **kwargs)
+        except self._redis.RedisError as e:
+            self.errors += 1
+            raise StateError(str(e))
+
+    def get(self, key):
+        value = self._call(self.client.get, self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._call(self.client.set, self.prefix + key, json.dumps(value),
+                   px=_ms(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self._call(self.client.set, self.prefix + key,
+                               json.dumps(value), nx=True,
+                               px=_ms(ttl) if ttl else None))
+
+    def delete(self, key):
+        self._call(self.client.delete, self.prefix + key)
+
+    def incr(self, key, amount=1, ttl=None):
+        key = self.prefix + key
+        if not ttl:
+            return self._call(self.client.incrby, key, amount)
+        # Creating the counter with its expiry first keeps the expiry when
+        # another process creates it at the same time
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(key, 0, nx=True, px=_ms(ttl))
+        pipe.incrby(key, amount)
+        return self._call(pipe.execute)[1]
+
+    def bucket(self, key, rate, capacity, take=1):
+        key = self.prefix + key
+        self.operations += 1
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                # The pipeline unwatches the key and returns its connection
+                # to the pool however this ends
+                with self.client.pipeline() as pipe:
+                    # EXEC fails if another process changes the key after
+                    # WATCH
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    now = time.time()
+                    tokens, updated = json.loads(value) \
+                        if value is not None else (None, 0)
+                    tokens, full_in = refill(tokens, updated, rate,
+                                             capacity, take, now)
+                    pipe.multi()
+                    pipe.set(key, json.dumps([tokens, now]),
+                             px=_ms(full_in + 1))
+                    pipe.execute()
+                return tokens
+            except self._redis.WatchError:
+                self.conflicts += 1
+            except (self._redis.RedisError, TypeError, ValueError) as e:
+                self.errors += 1
+                raise StateError(str(e))
+            # Back off a little so the processes don't collide again
+            time.sleep(random.uniform(0, 0.001 * min(attempt + 1, 10)))
+        self.errors += 1
+        raise StateError("Bucket {} is too busy to update".format(key))
+
+    def close(self):
+        self._pool.disconnect()
+
+    def __len__(self):
+        # The whole database, not only keys with this prefix
+        return self._call(self.client.dbsize)
+
+    def stats(self):
+        ret = super(RedisStateBackend, self).stats()
+        ret.update(conflicts=self.conflicts)
+        return ret
+
+
+def _ms(seconds):
+    return max(1, int(seconds * 1000))
+
+
+def state_backend(url, prefix=""):
+    """
+    Create a StateBackend from a URL.
+    :param url: "memory://", "sqlite:///relative/file.db",
+            "sqlite:////absolute/file.db" or "redis://host:port/db"
+    :param prefix: Prepended to every key
+    :return: StateBackend
+    """
+    scheme = urlsplit(url).scheme
+    if scheme == "memory":
+        return MemoryStateBackend(prefix=prefix)
+    if scheme == "sqlite":
+        return SQLiteStateBackend(url[len("sqlite:///"):], prefix=prefix)
+    if scheme in ("redis", "rediss"):
+        return RedisStateBackend(url, prefix=prefix)
+    raise ValueError("Unknown state backend URL: {}".format(url))
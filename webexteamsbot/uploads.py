@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming multipart uploads of files attached to messages."""
+
+import json
+import mimetypes
+import os
+import time
+import uuid
+
+# Bytes read and sent at a time
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Largest file the Webex API accepts
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """A file is larger than the upload size limit."""
+
+
+class FileUpload(object):
+    """
+    A file to attach to a message, read while it is uploaded.
+
+    The source can be a local path, a binary file-like object, a
+    bytes-like buffer (bytes, bytearray, memoryview or mmap) or an
+    iterable of bytes chunks, such as a generator.  Buffers are sent
+    as slices of the buffer without copying it.  Paths, buffers and
+    seekable files can be sent again, e.g. when a rate limited message
+    is retried, but iterables only once.
+    """
+
+    def __init__(self, source, filename=None, content_type=None, size=None,
+                 progress=None):
+        """
+        Initialize a new FileUpload
+
+        :param source: Path, file-like object, buffer or iterable of bytes
+        :param filename: Name shown for the file.  Defaults to the name of
+                the path or file object.
+        :param content_type: MIME type.  Guessed from the filename by
+                default.
+        :param size: Size in bytes, if the source can't tell, e.g. for
+                a generator
+        :param progress: Called with (bytes sent, total bytes or None)
+                after each chunk is sent
+        """
+        self.source = source
+        self.path = source if isinstance(source, str) else None
+        if filename is None:
+            name = self.path or getattr(source, "name", None)
+            filename = os.path.basename(name) if isinstance(name, str) \
+                else "file"
+        self.filename = filename
+        if content_type is None:
+            content_type = mimetypes.guess_type(filename)[0] or \
+                "application/octet-stream"
+        self.content_type = content_type
+        self.progress = progress
+        self._size = size
+        self._start = None
+        self._used = False
+
+        if self.path is None and not self._is_buffer() \
+                and not hasattr(source, "read") \
+                and not hasattr(source, "__iter__"):
+            raise TypeError("Cannot upload {!r}".format(source))
+        if hasattr(source, "read") and self._seekable():
+            # Each send starts where the file was when it was attached
+            self._start = source.tell()
+
+    def _is_buffer(self):
+        if isinstance(self.source, str) or hasattr(self.source, "read"):
+            return False
+        try:
+            memoryview(self.source)
+        except TypeError:
+            return False
+        return True
+
+    def _seekable(self):
+        try:
+            return self.source.seekable()
+        except (AttributeError, ValueError, OSError):
+            return False
+
+    def size(self):
+        """
+        Size in bytes, if it is known before sending.
+        :return: int or None
+        """
+        if self._size is not None:
+            return self._size
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        if self._is_buffer():
+            return memoryview(self.source).nbytes
+        if self._start is not None:
+            end = self.source.seek(0, os.SEEK_END)
+            self.source.seek(self._start)
+            return end - self._start
+        return None
+
+    def chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        The file's content.
+        :param chunk_size: Bytes per chunk
+        :return: Iterator of bytes-like chunks
+        """
+        if self.path is not None:
+            return self._read(open(self.path, "rb"), chunk_size, close=True)
+        if self._is_buffer():
+            return self._slices(chunk_size)
+        if self._start is not None:
+            self.source.seek(self._start)
+        elif self._used:
+            raise ValueError("{} can only be sent once".format(self.filename))
+        self._used = True
+        if hasattr(self.source, "read"):
+            return self._read(self.source, chunk_size)
+        return iter(self.source)
+
+    # noinspection PyMethodMayBeStatic
+    def _read(self, f, chunk_size, close=False):
+        try:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            if close:
+                f.close()
+
+    def _slices(self, chunk_size):
+        view = memoryview(self.source).cast("B")
+        for i in range(0, len(view), chunk_size):
+            yield view[i:i + chunk_size]
+
+    def __repr__(self):
+        return "FileUpload(%r)" % (self.filename,)
+
+
+def as_upload(value):
+    """
+    The FileUpload for a value in a message's files.
+    :param value: Value from Response.files
+    :return: FileUpload, or None for a URL the API fetches itself
+    """
+    if isinstance(value, FileUpload):
+        return value
+    if isinstance(value, str) and "://" in value:
+        return None
+    return FileUpload(value)
+
+
+class MultipartStream(object):
+    """
+    A multipart/form-data message body that reads the file while it is
+    being sent.  When the file's size is known the body's length is too,
+    and it is sent with a Content-Length, otherwise chunked.
+    """
+
+    def __init__(self, fields, upload, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_size=None):
+        """
+        Initialize a new MultipartStream
+
+        :param fields: Other message fields
+        :param upload: FileUpload
+        :param chunk_size: Bytes per chunk
+        :param max_size: Raise UploadTooLarge once more bytes than this
+                have been read
+        """
+        self.upload = upload
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=" + self.boundary
+        self.sent = 0
+
+        parts = []
+        for name, value in fields.items():
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            parts.append(
+                '--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n'
+                '{}\r\n'.format(self.boundary, name, value).encode("utf-8")
+            )
+        parts.append(
+            '--{}\r\nContent-Disposition: form-data; name="files"; '
+            'filename="{}"\r\nContent-Type: {}\r\n\r\n'.format(
+                self.boundary, upload.filename.replace('"', "%22"),
+                upload.content_type,
+            ).encode("utf-8")
+        )
+        self.head = b"".join(parts)
+        self.tail = "\r\n--{}--\r\n".format(self.boundary).encode("utf-8")
+
+        self.size = upload.size()
+        # Read by requests to set the Content-Length, 0 sends it chunked
+        self.len = 0
+        if self.size is not None:
+            self.len = len(self.head) + self.size + len(self.tail)
+
+    def __iter__(self):
+        upload = self.upload
+        yield self.head
+        for chunk in upload.chunks(self.chunk_size):
+            if self.max_size is not None and \
+                    self.sent + len(chunk) > self.max_size:
+                raise UploadTooLarge(
+                    "{} is larger than {} bytes".format(
+                        upload.filename, self.max_size
+                    )
+                )
+            yield chunk
+            self.sent += len(chunk)
+            if upload.progress is not None:
+                upload.progress(self.sent, self.size)
+        yield self.tail
+
+
+class Uploader(object):
+    """
+    Creates messages, streaming attached files instead of reading them
+    into memory.  Messages without files, or with a URL for the API to
+    fetch, are created with messages.create() as usual.
+    """
+
+    def __init__(self, teams, max_size=DEFAULT_MAX_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE, observer=None):
+        """
+        Initialize a new Uploader
+
+        :param teams: WebexTeamsAPI to send with
+        :param max_size: Largest file allowed, in bytes.  None for no
+                limit.
+        :param chunk_size: Bytes read and sent at a time
+        :param observer: Called with (FileUpload, bytes sent, seconds,
+                error) after each upload.  error is None if it succeeded.
+        """
+        self.teams = teams
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.observer = observer
+
+        # Counters
+        self.uploads = 0
+        self.failed = 0
+        self.rejected = 0
+        self.bytes_sent = 0
+
+    def create_message(self, payload):
+        """
+        Create a message.
+        :param payload: messages.create() keyword arguments
+        :return: Message
+        """
+        files = payload.get("files")
+        upload = as_upload(files[0]) if files else None
+        if upload is None:
+            return self.teams.messages.create(**payload)
+        if len(files) != 1:
+            raise ValueError("Only one file may be sent per message")
+        fields = {k: v for k, v in payload.items() if k != "files"}
+        return self.send(fields, upload)
+
+    def send(self, fields, upload):
+        """
+        Create a message with a file.
+        :param fields: Other message fields
+        :param upload: FileUpload
+        :return: Message
+        """
+        body = MultipartStream(fields, upload, self.chunk_size,
+                               self.max_size)
+        if self.max_size is not None and body.size is not None \
+                and body.size > self.max_size:
+            self.rejected += 1
+            error = UploadTooLarge("{} is larger than {} bytes".format(
+                upload.filename, self.max_size
+            ))
+            self._observe(upload, 0, 0.0, error)
+            raise error
+
+        start = time.perf_counter()
+        error = None
+        try:
+            data = self.teams._session.post(
+                "messages/", data=body,
+                headers={"Content-Type": body.content_type},
+            )
+        except UploadTooLarge as e:
+            self.rejected += 1
+            error = e
+            raise
+        except Exception as e:
+            self.failed += 1
+            error = e
+            raise
+        finally:
+            self.bytes_sent += body.sent
+            self._observe(upload, body.sent, time.perf_counter() - start,
+                          error)
+        self.uploads += 1
+        return self.teams.messages._object_factory("message", data)
+
+    def _observe(self, upload, sent, seconds, error):
+        if self.observer is not None:
+            self.observer(upload, sent, seconds, error)
+
+    def stats(self):
+        """
+        Upload counters.
+        :return: dict
+        """
+        return dict(
+            uploads=self.uploads,
+            failed=self.failed,
+            rejected=self.rejected,
+            bytes_sent=self.bytes_sent,
+        )
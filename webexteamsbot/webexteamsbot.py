@@ -3,10 +3,33 @@
 """Main module."""
 
 from flask import Flask, request
-from webexteamssdk import WebexTeamsAPI
 from webexteamsbot.models import Response
-import sys
+from webexteamsbot.commands import CommandRegistry
+from webexteamsbot.actions import ActionCache, fetch_action
+from webexteamsbot.client import create_http_adapter, create_teams_api
+from webexteamsbot.identity import BotIdentity
+from webexteamsbot.workqueue import WorkQueue
+from webexteamsbot.webhooks import WebhookReconciler
+from webexteamsbot.delivery import DeliveryEngine, reply_payload
+from webexteamsbot.ratelimit import OutboundScheduler
+from webexteamsbot.dedupe import DedupeCache, StateDedupeBackend
+from webexteamsbot.policy import ApprovalPolicy
+from webexteamsbot.polling import MessagePoller
+from webexteamsbot import prefilter
+from webexteamsbot.metrics import BotMetrics
+from webexteamsbot.profiler import Profiler
+from webexteamsbot import logs
+from webexteamsbot import uploads
+from webexteamsbot.state import state_backend as create_state_backend
+from webexteamsbot.sessions import SessionStore, StateSessionBackend
+from webexteamsbot.arguments import UsageError, command_text
+import threading
 import json
+import hmac
+import logging
+import time
+
+log = logs.get_logger(__name__)
 
 # __author__ = "imapex"
 # __author_email__ = "CiscoTeamsBot@imapex.io"
@@ -14,7 +37,7 @@ import json
 # __license__ = "Apache 2.0"
 
 
-class TeamsBot(Flask):
+class TeamsBot(CommandRegistry, Flask):
     """An instance of a Webex Teams Bot"""
 
     def __init__(
@@ -28,8 +51,46 @@ class TeamsBot(Flask):
         webhook_resource_event=None,
         webhook_resource="messages",
         webhook_event="created",
-        approved_users=[], 
+        approved_users=[],
         debug=False,
+        identity_ttl=3600,
+        webhook_workers=0,
+        webhook_queue_size=100,
+        http_pool_size=10,
+        http_keep_alive=True,
+        http_connect_timeout=None,
+        http_read_timeout=None,
+        http_max_retries=0,
+        http_retry_backoff=0.5,
+        webhook_background=False,
+        delivery_workers=4,
+        outbound_rate=None,
+        outbound_burst=None,
+        outbound_room_rate=None,
+        outbound_room_burst=None,
+        outbound_queue_size=1000,
+        outbound_overflow="shed",
+        outbound_workers=None,
+        dedupe_ttl=300,
+        dedupe_size=10000,
+        dedupe_backend=None,
+        approved_users_file=None,
+        approved_rooms=None,
+        webhook_secret=None,
+        profiler_token=None,
+        log_level=None,
+        log_format="text",
+        log_sample_rate=1.0,
+        upload_max_size=uploads.DEFAULT_MAX_SIZE,
+        upload_chunk_size=uploads.DEFAULT_CHUNK_SIZE,
+        action_cache_ttl=300,
+        action_cache_size=1000,
+        state_backend=None,
+        host=None,
+        session_ttl=600,
+        session_max=10000,
+        session_max_bytes=16 * 1024 * 1024,
+        session_backend=None,
     ):
         """
         Initialize a new TeamsBot
@@ -38,7 +99,9 @@ class TeamsBot(Flask):
         :param teams_bot_token: Teams Auth Token for Bot Account
         :param teams_api_url: URL to the Teams/Webex API endpoint
         :param teams_bot_email: Teams Bot Email Address
-        :param teams_bot_url: WebHook URL for this Bot
+        :param teams_bot_url: WebHook URL for this Bot.  When not set no
+                webhooks are created, and messages can be received with
+                start_polling() instead.
         :param default_action: What action to take if no command found.
                 Defaults to /help
         :param webhook_resource: What resource to trigger webhook on
@@ -50,7 +113,98 @@ class TeamsBot(Flask):
                 [{"resource": "messages", "event": "created"},
                 {"resource": "attachmentActions", "event": "created"}]
         :param approved_users: List of approved users (by email) to interact with bot. Default all users.
+                Entries like "*@example.com" approve a whole domain.  An
+                ApprovalPolicy may be passed instead of a list.
         :param debug: boolean value for debut messages
+        :param identity_ttl: Seconds to cache the bot's own identity
+                (people.me) before looking it up again.  Defaults to 3600
+        :param webhook_workers: Number of background threads processing
+                webhooks.  When set, webhooks are acknowledged immediately
+                and processed from a queue.  Defaults to 0 (process inline)
+        :param webhook_queue_size: Maximum number of webhooks waiting for a
+                worker before new ones are dropped.  Defaults to 100
+        :param http_pool_size: Maximum pooled connections to the Teams API.
+                Defaults to 10
+        :param http_keep_alive: Reuse connections to the Teams API.
+                Defaults to True
+        :param http_connect_timeout: Seconds to wait for a connection to the
+                Teams API.  Defaults to the webexteamssdk timeout
+        :param http_read_timeout: Seconds to wait for a Teams API response.
+                Defaults to the webexteamssdk timeout
+        :param http_max_retries: Retries for failed connections and 5xx
+                responses on idempotent requests.  Defaults to 0
+        :param http_retry_backoff: Backoff factor between retries.
+                Defaults to 0.5
+        :param webhook_background: Set up the webhooks on a background
+                thread so the app can start serving right away.
+                Defaults to False
+        :param delivery_workers: Maximum number of rooms a list of Responses
+                is sent to in parallel.  Defaults to 4
+        :param outbound_rate: Maximum messages per second sent by the bot.
+                Defaults to None (no limit)
+        :param outbound_burst: Burst size allowed above outbound_rate
+        :param outbound_room_rate: Maximum messages per second sent to a
+                single room.  Defaults to None (no limit)
+        :param outbound_room_burst: Burst size allowed above
+                outbound_room_rate
+        :param outbound_queue_size: Maximum messages waiting to be sent
+                before new ones are shed or coalesced.  Defaults to 1000
+        :param outbound_overflow: "shed" to drop, or "coalesce" to merge
+                plain text replies into one waiting for the same room, when
+                the outbound queue is full.  Defaults to "shed"
+        :param outbound_workers: Threads sending the bot's messages, to
+                different rooms in parallel.  Defaults to the larger of
+                http_pool_size and delivery_workers
+        :param dedupe_ttl: Seconds to remember processed webhook events so
+                redeliveries are ignored.  0 disables.  Defaults to 300
+        :param dedupe_size: Maximum events remembered.  Defaults to 10000
+        :param dedupe_backend: DedupeBackend to store seen events in, for
+                sharing between workers.  Defaults to in-memory
+        :param approved_users_file: File listing approved users, one email
+                or "*@domain" rule per line.  Reloaded when it changes.
+        :param approved_rooms: List of room ids whose members are approved
+                to interact with the bot.
+        :param webhook_secret: Secret the webhooks are created with.  When
+                set, webhooks without a valid X-Spark-Signature are
+                rejected.
+        :param profiler_token: Token protecting the /profile route.  The
+                route is only added when this is set.
+        :param log_level: Level of the "webexteamsbot" logger.  Defaults
+                to DEBUG with debug=True, otherwise INFO
+        :param log_format: "text" or "json" (one object per line), for the
+                stderr logging set up when the application has not
+                configured logging itself.  Defaults to "text"
+        :param log_sample_rate: Fraction of events whose informational
+                records are logged.  Warnings and errors are always
+                logged.  Defaults to 1.0
+        :param upload_max_size: Largest file, in bytes, a Response may
+                attach.  Defaults to 100MB
+        :param upload_chunk_size: Bytes of an attached file read and sent
+                at a time.  Defaults to 64KB
+        :param action_cache_ttl: Seconds a fetched card submission
+                (attachmentAction) is cached.  Defaults to 300
+        :param action_cache_size: Maximum card submissions cached.
+                Defaults to 1000
+        :param state_backend: StateBackend, or its URL ("sqlite:///bot.db",
+                "redis://host:6379/0"), shared by the bot's worker
+                processes.  Dedupe keys, the bot's identity and the
+                outbound rate limits are kept there, so workers cooperate
+                instead of each keeping its own.  Defaults to None (each
+                process keeps its own, in memory)
+        :param host: BotHost serving this bot alongside others.  Its
+                connection pool, worker threads, webhook queue and state
+                backend are used instead of the bot's own, and the http,
+                worker and queue size options are ignored.  Use
+                BotHost.add_bot() rather than passing it here.
+        :param session_ttl: Seconds a conversation's session is kept after
+                it was last saved.  Defaults to 600
+        :param session_max: Maximum sessions kept in memory.
+                Defaults to 10000
+        :param session_max_bytes: Memory limit for the sessions, the least
+                recently used are evicted beyond it.  Defaults to 16MB
+        :param session_backend: SessionBackend keeping the sessions.
+                Defaults to the state backend if there is one, otherwise
+                memory
         """
 
         super(TeamsBot, self).__init__(teams_bot_name)
@@ -68,44 +222,208 @@ class TeamsBot(Flask):
             )
 
         self.DEBUG = debug
+        if log_level is None and debug:
+            log_level = logging.DEBUG
+        logs.default_logging(log_level, json_lines=log_format == "json")
+        self.log_sampler = logs.LogSampler(log_sample_rate)
         self.teams_bot_name = teams_bot_name
         self.teams_bot_token = teams_bot_token
         self.teams_bot_email = teams_bot_email
         self.teams_bot_url = teams_bot_url
         self.default_action = default_action
-        self.approved_users = approved_users
         self.webhook_resource = webhook_resource
         self.webhook_event = webhook_event
         self.webhook_resource_event = webhook_resource_event
+        self.webhook_background = webhook_background
+        self.webhook_reconciler = None
+        self.webhooks = None
+        self.webhook_thread = None
+        self.poller = None
+        self.host = host
+
+        # State shared with the other worker processes, if any.  Keys are
+        # prefixed with the bot's name so bots can share a backend.
+        if isinstance(state_backend, str):
+            state_backend = create_state_backend(state_backend)
+        if state_backend is None and host is not None:
+            state_backend = host.state
+        self.state = state_backend
+        state_prefix = teams_bot_name + ":"
+
+        # Counters and latency histograms, served at /metrics
+        self.metrics = BotMetrics()
+        # Off until started, from code or the /profile route
+        self.profiler = Profiler()
+        self.profiler_token = profiler_token
 
         # Create Teams API Object for interacting with Teams
-        if teams_api_url:
-            self.teams = WebexTeamsAPI(
-                access_token=teams_bot_token, base_url=teams_api_url
+        # This one client, and its connection pool, is shared by the bot,
+        # its webhook workers and the resource callbacks
+        if host is not None:
+            # The host's pool, whose observer times requests by token
+            self.http_adapter = host.http_adapter
+        else:
+            self.http_adapter = create_http_adapter(
+                pool_size=http_pool_size,
+                connect_timeout=http_connect_timeout,
+                read_timeout=http_read_timeout,
+                max_retries=http_max_retries,
+                retry_backoff=http_retry_backoff,
             )
+            # Every API request goes through the adapter, so time them
+            # there
+            self.http_adapter.observer = self.metrics.api_request
+        self.teams = create_teams_api(
+            teams_bot_token,
+            base_url=teams_api_url,
+            keep_alive=http_keep_alive,
+            adapter=self.http_adapter,
+        )
+
+        # Every message the bot sends goes through the outbound scheduler.
+        # Its client shares the connection pool but leaves 429 handling to
+        # the scheduler instead of sleeping inside webexteamssdk.
+        outbound_teams = create_teams_api(
+            teams_bot_token,
+            base_url=teams_api_url,
+            keep_alive=http_keep_alive,
+            adapter=self.http_adapter,
+            wait_on_rate_limit=False,
+        )
+        # Streams files attached to Responses instead of reading them
+        # into memory
+        self.uploader = uploads.Uploader(
+            outbound_teams,
+            max_size=upload_max_size,
+            chunk_size=upload_chunk_size,
+            observer=self.metrics.upload,
+        )
+        self.outbound = OutboundScheduler(
+            self.uploader.create_message,
+            rate=outbound_rate,
+            burst=outbound_burst,
+            room_rate=outbound_room_rate,
+            room_burst=outbound_room_burst,
+            max_queue=outbound_queue_size,
+            overflow=outbound_overflow,
+            workers=outbound_workers or max(http_pool_size,
+                                            delivery_workers),
+            state=self.state,
+            state_key=state_prefix + "outbound",
+            executor=host.send_executor if host else None,
+            idle_timeout=host.idle_timeout if host else None,
+        )
+
+        # Sends lists of Responses concurrently, in order within each room
+        self.delivery = DeliveryEngine(
+            lambda payload: self.send_message(**payload),
+            workers=delivery_workers,
+            executor=host.delivery_executor if host else None,
+        )
+
+        # Who may interact with the bot
+        if isinstance(approved_users, ApprovalPolicy):
+            self.approval = approved_users
         else:
-            self.teams = WebexTeamsAPI(access_token=teams_bot_token)
-
-        # A dictionary of commands this bot listens to
-        # Each key in the dictionary is a command, with associated help
-        # text and callback function
-        # By default supports 2 command, /echo and /help
-        self.commands = {
-            "/echo": {
-                "help": "Reply back with the same message sent.",
-                "callback": self.send_echo,
-            },
-            "/help": {"help": "Get help.", "callback": self.send_help},
-        }
-
-        # Set default help message
-        self.help_message = "Hello!  I understand the following commands:  \n"
+            self.approval = ApprovalPolicy(
+                users=approved_users,
+                path=approved_users_file,
+                rooms=approved_rooms,
+                teams=self.teams,
+            )
+
+        # Identity of the bot account, looked up once and then cached
+        self.identity = BotIdentity(self.teams, ttl=identity_ttl,
+                                    state=self.state,
+                                    state_key=state_prefix + "identity")
+
+        # Drops events from the webhook payload alone, before any API call
+        self.webhook_secret = webhook_secret
+        self.event_filter = prefilter.EventFilter(
+            identity=self.identity,
+            approval=self.approval,
+            secret=webhook_secret,
+        )
+
+        # Remembers processed events so webhook redeliveries are skipped
+        self.dedupe = None
+        if dedupe_ttl:
+            if dedupe_backend is None and self.state is not None:
+                dedupe_backend = StateDedupeBackend(
+                    self.state, prefix=state_prefix + "dedupe:"
+                )
+            self.dedupe = DedupeCache(
+                backend=dedupe_backend, ttl=dedupe_ttl, max_size=dedupe_size
+            )
+
+        # Optional background queue for processing webhooks
+        self.work_queue = None
+        if host is not None and host.work_queue is not None:
+            self.work_queue = host.work_queue.bind(self.process_event)
+        elif webhook_workers:
+            self.work_queue = WorkQueue(
+                self.process_event,
+                workers=webhook_workers,
+                maxsize=webhook_queue_size,
+                name=teams_bot_name,
+            )
+            self.work_queue.start()
+
+        self._init_commands()
+
+        # Card submissions, fetched once with the shared client
+        self.actions = ActionCache(
+            lambda action_id: fetch_action(self.teams, action_id),
+            ttl=action_cache_ttl,
+            max_size=action_cache_size,
+        )
+
+        # Conversation state for multi-step commands
+        if session_backend is None and self.state is not None:
+            session_backend = StateSessionBackend(
+                self.state, prefix=state_prefix + "session:"
+            )
+        self.sessions = SessionStore(
+            backend=session_backend,
+            ttl=session_ttl,
+            max_sessions=session_max,
+            max_bytes=session_max_bytes,
+        )
+
+        # Export the components' own counters with the metrics
+        components = dict(
+            identity=lambda: self.identity,
+            log_sampler=lambda: self.log_sampler,
+            approval=lambda: self.approval,
+            event_filter=lambda: self.event_filter,
+            dedupe=lambda: self.dedupe,
+            work_queue=lambda: self.work_queue,
+            outbound=lambda: self.outbound,
+            delivery=lambda: self.delivery,
+            webhooks=lambda: self.webhook_reconciler,
+            poller=lambda: self.poller,
+            uploads=lambda: self.uploader,
+            actions=lambda: self.actions,
+            card_actions=lambda: self.card_actions,
+            sessions=lambda: self.sessions,
+            state=lambda: self.state,
+        )
+        for name, component in sorted(components.items()):
+            self.metrics.registry.collector(name, self._stats_of(component))
 
         # Flask Application URLs
         # Basic Health Check for Flask Application
         self.add_url_rule("/health", "health", self.health)
         # Endpoint to enable dynamically configuring account
         self.add_url_rule("/config", "config", self.config_bot)
+        # Prometheus metrics
+        self.add_url_rule("/metrics", "metrics", self.export_metrics)
+        # Profiler control and results, only with a token to protect it
+        if profiler_token:
+            self.add_url_rule(
+                "/profile", "profile", self.profile,
+                methods=["GET", "POST", "DELETE"],
+            )
         # Teams WebHook Target
         self.add_url_rule(
             "/", "index", self.process_incoming_message, methods=["POST"]
@@ -114,6 +432,22 @@ class TeamsBot(Flask):
         # Setup the Teams WebHook and connections.
         self.teams_setup()
 
+    @property
+    def approved_users(self):
+        """
+        Approved email addresses and "*@domain" rules, read-only.  Assign
+        a new list, or an ApprovalPolicy, to change who may use the bot.
+        """
+        return tuple(self.approval.users)
+
+    @approved_users.setter
+    def approved_users(self, users):
+        if isinstance(users, ApprovalPolicy):
+            self.approval = users
+            self.event_filter.approval = users
+        else:
+            self.approval.set_users(users)
+
     # *** Bot Setup and Core Processing Functions
     def add_new_url(self, path, ep, func):
         self.add_url_rule(path, ep, func, methods=["GET", "POST", "PUT"])
@@ -124,23 +458,42 @@ class TeamsBot(Flask):
         Setup the Teams Connection and WebHook
         :return:
         """
-        # Update the global variables for config details
-        globals()["teams_token"] = self.teams_bot_token
-        globals()["bot_email"] = self.teams_bot_email
-
-        sys.stderr.write("Teams Bot Email: " + self.teams_bot_email + "\n")
-        sys.stderr.write("Teams Token: REDACTED\n")
-
-        # Setup the Teams Connection
-        globals()["teams"] = WebexTeamsAPI(access_token=self.teams_bot_token)
-        globals()["webhook"] = self.setup_webhook(
-            self.teams_bot_name, self.teams_bot_url,
-            self.webhook_resource, self.webhook_event,
-            self.webhook_resource_event
-        )
-        sys.stderr.write("Configuring Webhook. \n")
-        for w in globals()["webhook"]:
-            sys.stderr.write("Webhook ID: " + w.id + "\n")
+        # The token, email, client and webhooks are kept on the bot only,
+        # so bots in one process (see BotHost) can't overwrite each other's
+        log.info("Teams bot configured", name=self.teams_bot_name,
+                 email=self.teams_bot_email)
+
+        if not self.teams_bot_url:
+            log.info("No bot URL.  Not configuring webhooks.")
+            return
+        log.info("Configuring webhooks", url=self.teams_bot_url)
+        if self.webhook_background:
+            self.webhook_thread = threading.Thread(
+                target=self._setup_webhooks,
+                name=self.teams_bot_name + "-webhooks"
+            )
+            self.webhook_thread.daemon = True
+            self.webhook_thread.start()
+        else:
+            self._setup_webhooks()
+
+    def _setup_webhooks(self):
+        try:
+            webhooks = self.setup_webhook(
+                self.teams_bot_name, self.teams_bot_url,
+                self.webhook_resource, self.webhook_event,
+                self.webhook_resource_event
+            )
+        except Exception as e:
+            if not self.webhook_background:
+                raise
+            log.error("Encountered an error setting up webhooks",
+                      error=str(e))
+            return
+        self.webhooks = webhooks
+        for w in webhooks:
+            log.info("Webhook ready", webhook=w.id, resource=w.resource,
+                     event=w.event)
 
     # noinspection PyMethodMayBeStatic
     def setup_webhook(self, name, targeturl, wh_resource, wh_event,
@@ -154,60 +507,91 @@ class TeamsBot(Flask):
         :param wh_event: WebHook Event (created, updated, deleted)
         :param wh_resource_event: List of Dicts including which
                 resource/event mappings to use.
-        :return: WebHook
+        :return: List of WebHooks
         """
-        # Get a list of current webhooks
-        webhooks = self.teams.webhooks.list()
-
-        whlist = []
         if not wh_resource_event:
             wh_resource_event = [{"resource": wh_resource, "event": wh_event}]
 
-        for w in wh_resource_event:
-            searchname = name + "." + w["resource"] + "." + w["event"]
-
-            # Look for an Existing Webhook with this name, if found update it
-            wh = None
-            # webhooks is a generator
-            for h in webhooks:
-                if h.name == searchname:
-                    sys.stderr.write("Found existing webhook.  Updating it.\n")
-                    wh = h
-                elif h.name == name:
-                    # check for webhook name with original naming convention
-                    #  if found, let's update to the new naming convetion
-                    if w["resource"] == "messages" and w["event"] == "created":
-                        sys.stderr.write("Found old webhook.  Updating it.\n")
-                        wh = h
-
-            # No existing webhook found, create new one
-            # we reached the end of the generator w/o finding matching webhook
-            if wh is None:
-                sys.stderr.write("Creating new webhook.\n")
-                wh = self.teams.webhooks.create(
-                    name=searchname,
-                    targetUrl=targeturl,
-                    resource=w["resource"],
-                    event=w["event"],
-                )
+        # Only create, update or delete the webhooks that differ
+        self.webhook_reconciler = WebhookReconciler(
+            self.teams, name, targeturl, wh_resource_event,
+            secret=self.webhook_secret,
+        )
+        return self.webhook_reconciler.reconcile()
 
-            # if we have an existing webhook, delete and recreate
-            #   (can't update resource/event)
-            else:
-                # try block because if there are NO webhooks it throws error
-                try:
-                    wh = self.teams.webhooks.delete(webhookId=wh.id)
-                    wh = self.teams.webhooks.create(
-                        name=searchname, targetUrl=targeturl,
-                        resource=w["resource"], event=w["event"]
-                    )
-                # https://github.com/CiscoDevNet/ciscoteamsapi/blob/master/ciscoteamsapi/api/webhooks.py#L237
-                except Exception as e:
-                    msg = "Encountered an error updating webhook: {}"
-                    sys.stderr.write(msg.format(e))
-            whlist.append(wh)
+    # noinspection PyMethodMayBeStatic
+    def _stats_of(self, component):
+        def stats():
+            c = component()
+            return c.stats() if c is not None else None
+        return stats
 
-        return whlist
+    def export_metrics(self):
+        """
+        Metrics in the Prometheus text format.
+        :return:
+        """
+        return (
+            self.metrics.registry.render(),
+            200,
+            {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    def profile(self):
+        """
+        Control the profiler and fetch its results.  Requires the
+        profiler_token as a bearer token.
+
+        GET returns the results, ?format=collapsed (default), pstats,
+        raw (pstats binary) or status.  POST starts or stops profiling
+        with a JSON body like {"enabled": true, "sample_rate": 0.1,
+        "command": "/slow"}.  DELETE discards the results.
+        :return:
+        """
+        auth = request.headers.get("Authorization", "")
+        token = auth[7:] if auth.startswith("Bearer ") else ""
+        if not hmac.compare_digest(token.encode("utf-8"),
+                                   self.profiler_token.encode("utf-8")):
+            return "Unauthorized", 401
+
+        if request.method == "DELETE":
+            self.profiler.reset()
+            return json.dumps(self.profiler.status())
+        if request.method == "POST":
+            settings = request.get_json(silent=True) or {}
+            try:
+                if settings.get("enabled", True):
+                    self.profiler.start(
+                        sample_rate=settings.get("sample_rate"),
+                        command=settings.get("command"),
+                        interval=settings.get("interval"),
+                    )
+                else:
+                    self.profiler.stop()
+            except (TypeError, ValueError) as e:
+                return str(e), 400
+            return json.dumps(self.profiler.status())
+
+        fmt = request.args.get("format", "collapsed")
+        text = {"Content-Type": "text/plain; charset=utf-8"}
+        if fmt == "collapsed":
+            return self.profiler.collapsed(), 200, text
+        if fmt == "pstats":
+            try:
+                report = self.profiler.pstats_text(
+                    sort=request.args.get("sort", "cumulative")
+                )
+            except KeyError:
+                return "Unknown sort key", 400
+            return report, 200, text
+        if fmt == "raw":
+            return self.profiler.pstats_dump(), 200, {
+                "Content-Type": "application/octet-stream",
+                "Content-Disposition": "attachment; filename=bot.pstats",
+            }
+        if fmt == "status":
+            return json.dumps(self.profiler.status())
+        return "Unknown format", 400
 
     def config_bot(self):
         """
@@ -269,63 +653,214 @@ class TeamsBot(Flask):
         """
         return "I'm Alive"
 
+    # noinspection PyMethodMayBeStatic
+    def valid_webhook(self, post_data):
+        """
+        Check that a webhook payload has the fields needed to process it.
+        :param post_data: Decoded webhook payload
+        :return: True if the payload can be processed
+        """
+        if not isinstance(post_data, dict):
+            return False
+        data = post_data.get("data")
+        return (
+            isinstance(post_data.get("resource"), str)
+            and isinstance(data, dict)
+            and "id" in data
+        )
+
     def process_incoming_message(self):
         """
         Process an incoming message, determine the command and action,
         and determine reply.
+
+        When the bot has webhook workers the webhook is queued and
+        acknowledged right away instead.
         :return:
         """
-        reply = None
-
         # Get the webhook data
-        post_data = request.json
+        post_data = request.get_json(silent=True)
+        self.metrics.webhook_received(post_data)
+
+        # Drop forged events, and messages from ourself or unapproved users,
+        # without fetching the message
+        reply = self.filter_event(
+            post_data,
+            request.get_data() if self.webhook_secret else None,
+            request.headers.get(prefilter.SIGNATURE_HEADER),
+        )
+        if reply is not None:
+            return reply
+
+        # Skip redeliveries of events that were already processed
+        if self.dedupe is not None and self.dedupe.seen(post_data):
+            log.debug("Ignoring duplicate webhook.")
+            return "Duplicate"
+
+        if self.work_queue is None:
+            return self.process_event(post_data)
+
+        if not self.valid_webhook(post_data):
+            log.warning("Ignoring invalid webhook payload.")
+            return "Invalid webhook", 400
+        if not self.work_queue.submit(post_data):
+            log.warning("Webhook queue full.  Dropping webhook.")
+            # Let the redelivery through
+            if self.dedupe is not None:
+                self.dedupe.forget(post_data)
+            return "Busy", 503
+        return "Queued"
+
+    def filter_event(self, post_data, body=None, signature=None):
+        """
+        Check an event against the pre-fetch filter.
+        :param post_data: Decoded webhook payload
+        :param body: Raw request body, to verify its signature
+        :param signature: Value of the X-Spark-Signature header
+        :return: Reply for a rejected event, or None to process it
+        """
+        reason = self.event_filter.check(post_data, body, signature)
+        if reason is None:
+            return None
+        if reason == prefilter.SIGNATURE:
+            log.warning("Ignoring webhook with invalid signature.")
+            return "Invalid signature", 403
+        if reason == prefilter.UNAPPROVED:
+            log.info("User is not approved to interact with bot. Ignoring.",
+                     person=post_data["data"]["personEmail"])
+            return "Unapproved user"
+        log.debug("Ignoring message from our self")
+        return ""
+
+    def process_event(self, post_data, message=None):
+        """
+        Run handle_event(), forgetting the event if it fails so that a
+        redelivery is processed again.
+        :param post_data: Decoded webhook payload
+        :param message: The message, if it has already been fetched
+        :return: Reply
+        """
+        start = time.perf_counter()
+        with self.log_sampler.event():
+            try:
+                with self.profiler.event():
+                    reply = self.handle_event(post_data, message)
+            except Exception:
+                self.metrics.errors.inc("event")
+                if self.dedupe is not None:
+                    self.dedupe.forget(post_data)
+                log.exception("Error handling event")
+                raise
+            log.debug("Event handled",
+                      duration_ms=_ms(time.perf_counter() - start))
+            return reply
+
+    def process_polled_message(self, post_data, message):
+        """
+        Process a message found by the poller the same way as a webhook.
+        :param post_data: Webhook style payload for the message
+        :param message: The message
+        :return: Reply
+        """
+        reply = self.filter_event(post_data)
+        if reply is not None:
+            return reply
+        # A message may also arrive by webhook if both are in use
+        if self.dedupe is not None and self.dedupe.seen(post_data):
+            return "Duplicate"
+        return self.process_event(post_data, message)
+
+    def start_polling(self, rooms=None, **kwargs):
+        """
+        Receive messages by polling the Teams API instead of webhooks, for
+        bots without a publicly reachable URL.  Polling runs on a
+        background thread.
+        :param rooms: Room ids to poll.  Defaults to every room the bot
+                is a member of.
+        :param kwargs: Further MessagePoller options, e.g. min_interval
+                and max_interval
+        :return: The MessagePoller
+        """
+        if self.poller is None:
+            self.poller = MessagePoller(
+                self.teams,
+                self.process_polled_message,
+                rooms=rooms,
+                name=self.teams_bot_name,
+                **kwargs
+            )
+        self.poller.start()
+        return self.poller
+
+    def stop_polling(self):
+        """
+        Stop polling for messages.
+        :return:
+        """
+        if self.poller is not None:
+            self.poller.stop()
+
+    def handle_event(self, post_data, message=None):
+        """
+        Process a webhook payload, determine the command and action,
+        and send the reply.
+        :param post_data: Decoded webhook payload
+        :param message: The message, if it has already been fetched
+        :return: Reply
+        """
+        reply = None
 
         # Determine the Teams Room to send reply to
         room_id = post_data["data"]["roomId"]
+        logs.bind(resource=post_data["resource"], room=room_id)
 
         if post_data["resource"] != "messages":
             cmdcheck = post_data["resource"].lower()
-            if cmdcheck in self.commands.keys():
-                api = WebexTeamsAPI(access_token=self.teams_bot_token)
+            card = callback = None
+            if cmdcheck == "attachmentactions" and len(self.card_actions):
+                action = self.actions.get(post_data["data"]["id"])
+                card, callback = self.card_actions.route(action)
+            if callback is not None:
+                logs.bind(person=action.personId, card=card)
+                reply = self.run_callback("card " + card, callback, action)
+            elif cmdcheck in self.commands.keys():
+                # Resource callbacks share the bot's pooled API client
                 p = post_data
-                reply = self.commands[cmdcheck]["callback"](api, p)
+                reply = self.run_command(cmdcheck, self.teams, p)
             else:
                 return ""
         elif post_data["resource"] == "messages":
             # Get the details about the message that was sent.
-            message_id = post_data["data"]["id"]
-            message = self.teams.messages.get(message_id)
-            if self.DEBUG:
-                sys.stderr.write("Message content:" + "\n")
-                sys.stderr.write(str(message) + "\n")
+            if message is None:
+                message_id = post_data["data"]["id"]
+                message = self.teams.messages.get(message_id)
+            logs.bind(message=message.id, person=message.personEmail)
+            if log.enabled(logging.DEBUG):
+                log.debug("Message content", content=str(message))
 
             # First make sure not processing a message from the bots
             # Needed to avoid the bot talking to itself
             # We check using IDs instead of emails since the email
             # of the bot could change while the bot is running
             # for example from bot@teamsbot.io to bot@webex.bot
-            if message.personId in self.teams.people.me().id:
-                if self.DEBUG:
-                    sys.stderr.write("Ignoring message from our self" + "\n")
+            if self.identity.is_self(message.personId):
+                log.debug("Ignoring message from our self")
                 return ""
 
             # Log details on message
-            sys.stderr.write("Message from: " + message.personEmail + "\n")
+            log.info("Message received")
 
             # Check if user is approved
-            if len(self.approved_users) > 0 and message.personEmail not in self.approved_users:
+            if not self.approval.is_approved(message.personEmail):
                 # User NOT approved
-                sys.stderr.write("User: " + message.personEmail + " is not approved to interact with bot. Ignoring.\n")
+                log.info("User is not approved to interact with bot. "
+                         "Ignoring.")
                 return "Unapproved user"
 
             # Find the command that was sent, if any
-            command = ""
-            for c in sorted(self.commands.items()):
-                if message.text.lower().find(c[0]) != -1:
-                    command = c[0]
-                    sys.stderr.write("Found command: " + command + "\n")
-                    # If a command was found, stop looking for others
-                    break
+            command = self.find_command(message.text)
+            if command:
+                log.debug("Found command", command=command)
 
             # Build the reply to the user
             reply = ""
@@ -334,83 +869,112 @@ class TeamsBot(Flask):
             # If no command found, send the default_action
             if command in [""] and self.default_action:
                 # noinspection PyCallingNonCallable
-                reply = self.commands[self.default_action]["callback"](message)
+                reply = self.run_message_command(self.default_action,
+                                                 message)
             elif command in self.commands.keys():
                 # noinspection PyCallingNonCallable
-                reply = self.commands[command]["callback"](message)
+                reply = self.run_message_command(command, message)
             else:
                 pass
 
         # allow command handlers to craft their own Teams message
         if reply and isinstance(reply, Response):
-            # If the Response lacks a roomId, set it to the incoming room
-            if not reply.roomId:
-                reply.roomId = room_id
-            reply = reply.as_dict()
-            self.teams.messages.create(**reply)
+            self.send_message(**reply_payload(reply, room_id))
             reply = "ok"
         # Support returning a list of Responses
         elif reply and isinstance(reply, list):
-            for response in reply:
-                # Make sure is a Response
-                if isinstance(response, Response):
-                    if not response.roomId:
-                        response.roomId = room_id
-                    self.teams.messages.create(**response.as_dict())
-
-            reply = "ok"
+            # Make sure is a Response
+            payloads = [reply_payload(response, room_id) for response in reply
+                        if isinstance(response, Response)]
+
+            results = self.delivery.deliver(payloads)
+            failed = [r for r in results if not r.ok]
+            if failed:
+                self.metrics.errors.add(len(failed), "send")
+            for r in failed:
+                log.error("Error sending reply", to=r.payload.get("roomId"),
+                          error=str(r.error))
+            if failed:
+                reply = "{} of {} replies failed".format(
+                    len(failed), len(results)
+                )
+            else:
+                reply = "ok"
         elif reply:
-            self.teams.messages.create(roomId=room_id, markdown=reply)
+            self.send_message(roomId=room_id, markdown=reply)
         return reply
 
-    def add_command(self, command, help_message, callback):
+    def run_command(self, command, *args):
         """
-        Add a new command to the bot
-        :param command: The command string, example "/status"
-        :param help_message: A Help string for this command
-        :param callback: The function to run when this command is given
-        :return:
+        Call a command's callback, recording metrics and profiling it when
+        requested.
+        :param command: Command
+        :param args: Arguments for the callback
+        :return: Reply
         """
-        self.commands[command.lower()] = {"help": help_message,
-                                          "callback": callback}
+        return self.run_callback(
+            command, self.commands[command]["callback"], *args
+        )
 
-    def remove_command(self, command):
+    def run_message_command(self, command, message):
         """
-        Remove a command from the bot
-        :param command: The command string, example "/status"
-        :return:
+        Call the callback of a command sent in a message.  Commands added
+        with an argument specification get the parsed arguments too, or
+        a usage error is returned without calling them.
+        :param command: Command
+        :param message: The message
+        :return: Reply
         """
-        del self.commands[command]
-
-    def extract_message(self, command, text):
+        spec = self.commands[command].get("args")
+        if spec is None:
+            return self.run_command(command, message)
+        try:
+            args = spec.parse(command_text(command, message.text))
+        except UsageError as e:
+            self.metrics.errors.inc("usage")
+            log.info("Invalid command arguments", command=command,
+                     error=str(e))
+            return "%s  \nUsage: `%s`" % (e, spec.usage(command))
+        return self.run_command(command, message, args)
+
+    def run_callback(self, name, callback, *args):
         """
-        Return message contents following a given command.
-        :param command: Command to search for.  Example "/echo"
-        :param text: text to search within.
-        :return:
+        Call a command or card action callback, recording metrics and
+        profiling it when requested.
+        :param name: Name it is recorded under
+        :param callback: Callback
+        :param args: Arguments for the callback
+        :return: Reply
         """
-        cmd_loc = text.find(command)
-        message = text[cmd_loc + len(command):]
-        return message
+        start = time.perf_counter()
+        with self.metrics.command(name), self.profiler.run_command(name):
+            reply = callback(*args)
+        log.info("Command handled", command=name,
+                 duration_ms=_ms(time.perf_counter() - start))
+        return reply
 
-    def set_greeting(self, callback):
+    def session(self, message, per_person=True):
         """
-        Configure the response provided by the bot when no command is found.
-        :param callback: The function to run to create and return the greeting.
-        :return:
+        The session of the conversation a message belongs to, for commands
+        that take several messages.  Save it, or use it in a with block,
+        to keep changes for the next message.
+        :param message: Message, or attachmentAction, from the conversation
+        :param per_person: One session per person in the room, or False
+                for one shared by the whole room
+        :return: Session
         """
-        self.add_command(
-            command="/greeting", help_message="*", callback=callback
+        return self.sessions.get(
+            message.roomId, message.personId if per_person else None
         )
-        self.default_action = "/greeting"
 
-    def set_help_message(self, msg):
+    def send_message(self, **kwargs):
         """
-        Configure the banner for the help message.
-        Command list will be appended to this later.
-        :return:
+        Send a message through the outbound scheduler.  Every reply from
+        the bot goes through here.
+        :param kwargs: Arguments for messages.create()
+        :return: The created message
         """
-        self.help_message = msg
+        return self.outbound.send(kwargs)
 
     # *** Default Commands included in Bot
     def send_help(self, post_data):
@@ -419,11 +983,7 @@ class TeamsBot(Flask):
         :param post_data:
         :return:
         """
-        message = self.help_message
-        for c in sorted(self.commands.items()):
-            if c[1]["help"][0] != "*":
-                message += "* **%s**: %s \n" % (c[0], c[1]["help"])
-        return message
+        return self.help_text()
 
     def send_echo(self, post_data):
         """
@@ -434,3 +994,7 @@ class TeamsBot(Flask):
         # Get sent message
         message = self.extract_message("/echo", post_data.text)
         return message
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
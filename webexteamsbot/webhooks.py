@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+"""Reconcile the bot's Teams webhooks against the desired configuration."""
+
+from webexteamsbot import logs
+
+log = logs.get_logger(__name__)
+
+# Webhook fields compared when deciding whether a webhook needs changing
+FIELDS = ("name", "targetUrl", "resource", "event", "filter", "secret")
+
+# Fields that can be changed in place with webhooks.update()
+UPDATABLE = ("name", "targetUrl", "secret")
+
+
+def webhook_fields(webhook):
+    """
+    Extract the compared fields from a webhook object or dict.
+    :param webhook: Webhook object (webexteamssdk) or dict
+    :return: dict of FIELDS
+    """
+    if isinstance(webhook, dict):
+        return {f: webhook.get(f) for f in FIELDS}
+    return {f: getattr(webhook, f, None) for f in FIELDS}
+
+
+def is_active(webhook):
+    """
+    Whether Webex still delivers a webhook's events.  Webhooks are disabled
+    ("inactive") after repeated failed deliveries.
+    :param webhook: Webhook object (webexteamssdk)
+    :return: bool
+    """
+    return getattr(webhook, "status", None) in (None, "active")
+
+
+def update_args(want, have):
+    """
+    The webhooks.update() arguments bringing a webhook in line, enabling
+    it again if it was disabled.
+    :param want: Desired dict of FIELDS
+    :param have: Existing webhook
+    :return: dict
+    """
+    args = dict(name=want["name"], targetUrl=want["targetUrl"])
+    if want["secret"] is not None:
+        args["secret"] = want["secret"]
+    if not is_active(have):
+        args["status"] = "active"
+    return args
+
+
+class WebhookReconciler(object):
+    """
+    Bring the bot's webhooks in line with the desired resource/event list.
+
+    The existing webhooks are listed once and compared on name, targetUrl,
+    resource, event, filter and secret.  Matching webhooks are left alone,
+    webhooks whose name, targetUrl or secret changed, or that Webex
+    disabled, are updated in place (and enabled again), and anything else
+    that differs is deleted and recreated.  Stale webhooks
+    that use this bot's naming convention, but are no longer wanted, are
+    deleted.
+    """
+
+    def __init__(self, teams, name, target_url, resource_events,
+                 webhook_filter=None, secret=None):
+        """
+        Initialize a new WebhookReconciler
+
+        :param teams: WebexTeamsAPI object
+        :param name: Bot name, used as the webhook name prefix
+        :param target_url: Target URL for the webhooks
+        :param resource_events: List of dicts with "resource" and "event"
+                keys, and optionally "filter"
+        :param webhook_filter: Default filter for every webhook
+        :param secret: Secret Webex signs webhook payloads with
+        """
+        self.teams = teams
+        self.name = name
+        self.target_url = target_url
+        self.resource_events = resource_events
+        self.webhook_filter = webhook_filter
+        self.secret = secret
+
+        # Counters from the last run
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.errors = 0
+
+    def desired(self):
+        """
+        The webhooks this bot should have.
+        :return: List of dicts of FIELDS
+        """
+        hooks = []
+        for w in self.resource_events:
+            hooks.append(dict(
+                name=self.name + "." + w["resource"] + "." + w["event"],
+                targetUrl=self.target_url,
+                resource=w["resource"],
+                event=w["event"],
+                filter=w.get("filter", self.webhook_filter),
+                secret=self.secret,
+            ))
+        return hooks
+
+    def plan(self, existing):
+        """
+        Compute the changes needed to reach the desired state.
+        :param existing: List of current webhooks
+        :return: List of (action, desired, existing) tuples, where action is
+                "keep", "update", "replace", "create" or "delete"
+        """
+        by_name = {}
+        for h in existing:
+            by_name.setdefault(h.name, []).append(h)
+
+        actions = []
+        claimed = set()
+        for want in self.desired():
+            candidates = by_name.get(want["name"], [])
+            if not candidates and want["resource"] == "messages" \
+                    and want["event"] == "created":
+                # Webhook using the original naming convention
+                candidates = by_name.get(self.name, [])
+            candidates = [h for h in candidates if id(h) not in claimed]
+
+            if not candidates:
+                actions.append(("create", want, None))
+                continue
+
+            # Prefer an exact match, then one that can be updated in place
+            def rank(h):
+                have = webhook_fields(h)
+                if have == want and is_active(h):
+                    return 0
+                if all(have[f] == want[f] for f in FIELDS
+                       if f not in UPDATABLE):
+                    return 1
+                return 2
+
+            candidates.sort(key=rank)
+            h = candidates[0]
+            claimed.add(id(h))
+            actions.append(
+                (("keep", "update", "replace")[rank(h)], want, h)
+            )
+
+        # Anything else using our naming convention is no longer wanted
+        prefix = self.name + "."
+        for h in existing:
+            if id(h) in claimed:
+                continue
+            if h.name == self.name or h.name.startswith(prefix):
+                actions.append(("delete", None, h))
+        return actions
+
+    def apply(self, actions):
+        """
+        Carry out a plan.
+        :param actions: List of (action, desired, existing) tuples
+        :return: List of resulting webhooks, in desired order
+        """
+        result = []
+        for action, want, have in actions:
+            try:
+                wh = self._apply(action, want, have)
+            except Exception as e:
+                self.errors += 1
+                log.error("Encountered an error updating webhook",
+                          error=str(e))
+                wh = have
+            if want is not None and wh is not None:
+                result.append(wh)
+        return result
+
+    def _apply(self, action, want, have):
+        if action == "keep":
+            self.unchanged += 1
+            return have
+        if action == "update":
+            log.info("Found existing webhook.  Updating it.",
+                     webhook=have.id, status=getattr(have, "status", None))
+            wh = self.teams.webhooks.update(webhookId=have.id,
+                                            **update_args(want, have))
+            self.updated += 1
+            return wh
+        if action in ("replace", "delete"):
+            log.info("Deleting webhook", webhook=have.id, name=have.name)
+            self.teams.webhooks.delete(webhookId=have.id)
+            self.deleted += 1
+            if action == "delete":
+                return None
+        log.info("Creating new webhook", resource=want["resource"],
+                 event=want["event"])
+        wh = self.teams.webhooks.create(**self._create_args(want))
+        self.created += 1
+        return wh
+
+    # noinspection PyMethodMayBeStatic
+    def _create_args(self, want):
+        return {k: v for k, v in want.items() if v is not None}
+
+    def reconcile(self):
+        """
+        List the current webhooks once and apply only the needed changes.
+        :return: List of resulting webhooks, in desired order
+        """
+        self.created = self.updated = self.deleted = 0
+        self.unchanged = self.errors = 0
+        existing = list(self.teams.webhooks.list())
+        return self.apply(self.plan(existing))
+
+    def stats(self):
+        """
+        Counters from the last reconcile run.
+        :return: dict of counters
+        """
+        return dict(
+            created=self.created,
+            updated=self.updated,
+            deleted=self.deleted,
+            unchanged=self.unchanged,
+            errors=self.errors,
+        )
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""Bounded background work queue for processing webhooks."""
+
+import queue
+import threading
+import time
+
+from webexteamsbot import logs
+
+log = logs.get_logger(__name__)
+
+
+class WorkQueue(object):
+    """
+    A bounded in-process queue drained by a pool of worker threads.
+
+    Items are handed to ``handler`` one at a time on a worker thread.  When
+    the queue is full new items are dropped rather than blocking the caller.
+
+    A queue without a handler can be shared: bind() gives each user its
+    own handler, submitting to the same queue and workers.
+    """
+
+    _STOP = object()
+
+    def __init__(self, handler, workers=4, maxsize=100, name="webexteamsbot"):
+        """
+        Initialize a new WorkQueue
+
+        :param handler: Function called with each queued item.  None for
+                a shared queue, fed through bind()
+        :param workers: Number of worker threads
+        :param maxsize: Maximum number of items waiting in the queue
+        :param name: Prefix for worker thread names
+        """
+        if workers < 1:
+            raise ValueError("WorkQueue requires at least one worker")
+
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.name = name
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+
+        # Counters
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def start(self):
+        """
+        Start the worker threads.
+        :return:
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(
+                    target=self._run, name="%s-worker-%d" % (self.name, i)
+                )
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=None):
+        """
+        Let the workers finish queued items, then stop them.
+        :param timeout: Seconds to wait for each worker to exit
+        :return:
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(self._STOP)
+        for t in threads:
+            t.join(timeout)
+
+    def submit(self, item):
+        """
+        Queue an item for processing without blocking.
+        :param item: Item to hand to the handler
+        :return: True if queued, False if the queue was full and it was dropped
+        """
+        return self._put(self.handler, item)
+
+    def _put(self, handler, item):
+        try:
+            self._queue.put_nowait((time.time(), handler, item))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def bind(self, handler):
+        """
+        Submit items handled by ``handler`` to this queue.
+        :param handler: Function called with each item
+        :return: BoundWorkQueue
+        """
+        return BoundWorkQueue(self, handler)
+
+    def join(self):
+        """
+        Block until every queued item has been processed.
+        :return:
+        """
+        self._queue.join()
+
+    @property
+    def depth(self):
+        """Number of items waiting to be processed."""
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is self._STOP:
+                    return
+                queued_at, handler, item = entry
+                waited = time.time() - queued_at
+                with self._lock:
+                    self.wait_time_total += waited
+                    if waited > self.wait_time_max:
+                        self.wait_time_max = waited
+                try:
+                    handler(item)
+                except Exception as e:
+                    with self._lock:
+                        self.errors += 1
+                    log.error("Error processing queued webhook",
+                              error=str(e))
+                with self._lock:
+                    self.processed += 1
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        """
+        Queue depth, wait time and drop counters.
+        :return: dict of counters
+        """
+        with self._lock:
+            return dict(
+                depth=self.depth,
+                maxsize=self.maxsize,
+                workers=self.workers,
+                submitted=self.submitted,
+                processed=self.processed,
+                dropped=self.dropped,
+                errors=self.errors,
+                wait_time_total=self.wait_time_total,
+                wait_time_max=self.wait_time_max,
+                wait_time_avg=(
+                    self.wait_time_total / self.processed
+                    if self.processed else 0.0
+                ),
+            )
+
+
+class BoundWorkQueue(object):
+    """
+    One handler's view of a shared WorkQueue.
+
+    Items are queued with the other handlers' and processed by the same
+    workers.  Its own submitted and dropped counts are kept apart.
+    """
+
+    def __init__(self, work_queue, handler):
+        self.queue = work_queue
+        self.handler = handler
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+
+    def submit(self, item):
+        """
+        Queue an item for the handler without blocking.
+        :param item: Item to hand to the handler
+        :return: True if queued, False if the queue was full and it was dropped
+        """
+        queued = self.queue._put(self.handler, item)
+        with self._lock:
+            if queued:
+                self.submitted += 1
+            else:
+                self.dropped += 1
+        return queued
+
+    @property
+    def depth(self):
+        """Number of items waiting in the shared queue."""
+        return self.queue.depth
+
+    def start(self):
+        self.queue.start()
+
+    def stop(self, timeout=None):
+        # The queue is stopped by its owner
+        pass
+
+    def join(self):
+        self.queue.join()
+
+    def stats(self):
+        """
+        The shared queue's counters, with this handler's own submitted and
+        dropped counts.
+        :return: dict of counters
+        """
+        ret = self.queue.stats()
+        with self._lock:
+            ret.update(submitted=self.submitted, dropped=self.dropped)
+        return ret